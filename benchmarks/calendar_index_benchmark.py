@@ -0,0 +1,92 @@
+"""Benchmark for calendar queries on calendars with many recurring events.
+
+Run with:
+  poetry run python -m benchmarks.calendar_index_benchmark
+
+Compares `CalendarIndex.query` with expanding the recurrence rules on every
+query with `query_icalendar`, which the calendar tool did before, for the
+query lengths the tool allows. Also measures building the index from scratch,
+and updating it after a single event has changed.
+"""
+
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+import icalendar
+
+from minerva.tools.calendar.calendar_index import CalendarIndex
+from minerva.tools.calendar.query_icalendar import query_icalendar
+
+RECURRING_EVENT_COUNTS = [100, 300, 1_000]
+QUERY_DAYS = [1, 7, 30, 366]
+REPEAT_COUNT = 3
+NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+RULES = [
+  "FREQ=DAILY",
+  "FREQ=WEEKLY;BYDAY=MO,WE,FR",
+  "FREQ=WEEKLY",
+  "FREQ=WEEKLY;INTERVAL=2",
+  "FREQ=MONTHLY",
+]
+
+
+def create_calendar_ics(recurring_event_count: int, changed_uid: str = "") -> str:
+  random.seed(0)
+  events: list[str] = []
+  for i in range(recurring_event_count):
+    start = NOW - timedelta(days=random.randint(0, 365), hours=random.randint(0, 23))
+    uid = f"event-{i}"
+    events.append(
+      f"""BEGIN:VEVENT
+UID:{uid}
+SUMMARY:Meeting {i}{" (changed)" if uid == changed_uid else ""}
+DTSTAMP:20250101T000000Z
+DTSTART:{start:%Y%m%dT%H%M%SZ}
+DTEND:{start + timedelta(minutes=30):%Y%m%dT%H%M%SZ}
+RRULE:{RULES[i % len(RULES)]}
+END:VEVENT"""
+    )
+  return "BEGIN:VCALENDAR\nVERSION:2.0\n" + "\n".join(events) + "\nEND:VCALENDAR\n"
+
+
+def measure_ms(fn: Callable[[], object], repeat_count: int = REPEAT_COUNT) -> float:
+  start = time.perf_counter()
+  for _ in range(repeat_count):
+    fn()
+  return (time.perf_counter() - start) * 1000 / repeat_count
+
+
+def main():
+  for recurring_event_count in RECURRING_EVENT_COUNTS:
+    calendar = icalendar.Calendar.from_ical(create_calendar_ics(recurring_event_count))
+    changed_calendar = icalendar.Calendar.from_ical(
+      create_calendar_ics(recurring_event_count, changed_uid="event-0")
+    )
+
+    def build_index() -> CalendarIndex:
+      calendar_index = CalendarIndex()
+      calendar_index.update(calendar, NOW)
+      return calendar_index
+
+    build_ms = measure_ms(build_index, repeat_count=1)
+    calendar_index = build_index()
+    update_ms = measure_ms(lambda: calendar_index.update(changed_calendar, NOW), repeat_count=1)
+
+    print(
+      f"\n{recurring_event_count} recurring events: "
+      f"build index {build_ms:.0f} ms, update after one change {update_ms:.0f} ms"
+    )
+    print(f"{'query days':>12} {'events':>8} {'index ms':>12} {'expand ms':>12}")
+    for query_days in QUERY_DAYS:
+      date_to = timedelta(days=query_days)
+      event_count = len(calendar_index.query(NOW, date_to))
+      index_ms = measure_ms(lambda: calendar_index.query(NOW, date_to))
+      expand_ms = measure_ms(lambda: query_icalendar(changed_calendar, NOW, date_to))
+      print(f"{query_days:>12} {event_count:>8} {index_ms:>12.2f} {expand_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,56 @@
+"""Microbenchmark for `MessageHistory.add` in the steady state, when every new
+message triggers an eviction.
+
+Run with:
+  poetry run python -m benchmarks.message_history_benchmark
+
+The per-message cost should stay flat as the history grows. The list-based
+implementation that `MessageHistory` used before is included for comparison.
+"""
+
+import time
+
+from minerva.message_history import Message, MessageHistory
+
+HISTORY_LENGTHS = [100, 1_000, 10_000, 100_000]
+ADD_COUNT = 20_000
+
+
+class ListMessageHistory:
+  def __init__(self, token_limit: int):
+    self.token_limit = token_limit
+    self.history: list[Message] = []
+    self.current_tokens = 0
+
+  def add(self, message: Message):
+    self.history.append(message)
+    self.current_tokens += message.len_tokens
+    while self.current_tokens > self.token_limit:
+      deleted_message = self.history.pop(0)
+      self.current_tokens -= deleted_message.len_tokens
+
+
+def measure_add_ns(history: MessageHistory | ListMessageHistory, message: Message) -> float:
+  # Fill the history up to the limit, so every measured add evicts
+  while history.current_tokens + message.len_tokens <= history.token_limit:
+    history.add(message)
+
+  start = time.perf_counter_ns()
+  for _ in range(ADD_COUNT):
+    history.add(message)
+  return (time.perf_counter_ns() - start) / ADD_COUNT
+
+
+def main():
+  message = Message("user", "hello")
+
+  print(f"{'history length':>15} {'deque ns/add':>15} {'list ns/add':>15}")
+  for history_length in HISTORY_LENGTHS:
+    token_limit = history_length * message.len_tokens
+    deque_ns = measure_add_ns(MessageHistory(prompt_str="", token_limit=token_limit), message)
+    list_ns = measure_add_ns(ListMessageHistory(token_limit=token_limit), message)
+    print(f"{history_length:>15} {deque_ns:>15.0f} {list_ns:>15.0f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,76 @@
+"""Microbenchmark for `parse_tool_call`.
+
+Run with:
+  poetry run python -m benchmarks.parse_tool_call_benchmark
+
+Compares the precompiled grammar (and the single string argument fast path)
+with building the grammar and inspecting the tool signature on every call,
+which `parse_tool_call` did before.
+"""
+
+import time
+from inspect import Parameter, signature
+from typing import Any, Callable, Unpack, cast
+
+import pyparsing as pp
+
+from minerva.tool_utils import GenericToolFn, parse_tool_call
+from minerva.tools.tool_kwargs import DefaultToolKwargs
+
+PARSE_COUNT = 10_000
+
+
+async def fetch_html(url: str, **kwargs: Unpack[DefaultToolKwargs]) -> str:
+  return ""
+
+
+async def sum(a: int, b: int, **kwargs: Unpack[DefaultToolKwargs]) -> str:
+  return ""
+
+
+TOOLS: dict[str, GenericToolFn] = {"fetch_html": fetch_html, "sum": sum}
+
+MESSAGES = {
+  "single string arg": "fetch_html('https://github.com/move-fast-and-break-things')",
+  "escaped string arg": "fetch_html('https://example.com/?q=it\\'s')",
+  "two int args": "sum(1, 2)",
+}
+
+
+def parse_tool_call_with_new_grammar(message: str, tools: dict[str, GenericToolFn]) -> Any:
+  quoted_single = cast(Any, pp.QuotedString("'", escChar="\\", multiline=True))
+  quoted_double = cast(Any, pp.QuotedString('"', escChar="\\", multiline=True))
+  simple_token = cast(Any, pp.Word(pp.alphanums + "._-:/"))
+  tool_call = cast(
+    Any,
+    pp.Word(pp.alphanums + "_").setResultsName("tool_name")
+    + pp.Suppress("(")
+    + pp.Optional(pp.delimitedList(quoted_single | quoted_double | simple_token, delim=","))
+    + pp.Suppress(")"),
+  )
+  parsed = tool_call.parseString(message)
+  tool = tools[parsed["tool_name"]]
+  params = [p for p in signature(tool).parameters.values() if p.kind != Parameter.VAR_KEYWORD]
+  return [
+    arg if param.annotation is str else param.annotation(arg)
+    for arg, param in zip(parsed[1:], params)
+  ]
+
+
+def measure_us(parse: Callable[[str, dict[str, GenericToolFn]], Any], message: str) -> float:
+  start = time.perf_counter()
+  for _ in range(PARSE_COUNT):
+    parse(message, TOOLS)
+  return (time.perf_counter() - start) * 1_000_000 / PARSE_COUNT
+
+
+def main():
+  print(f"{'message':>20} {'us/parse':>10} {'rebuilt us/parse':>18}")
+  for name, message in MESSAGES.items():
+    parse_us = measure_us(parse_tool_call, message)
+    rebuilt_us = measure_us(parse_tool_call_with_new_grammar, message)
+    print(f"{name:>20} {parse_us:>10.1f} {rebuilt_us:>18.1f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,103 @@
+"""Startup time benchmark.
+
+Run with:
+  poetry run python -m benchmarks.startup_benchmark [--run]
+
+Reports the time it takes to import `minerva.app` with a per-module breakdown
+(from `python -X importtime`), and the time it takes to load the tokenizer,
+which no longer happens at import time. With `--run`, it also starts the bot
+with `python -m minerva.app` and measures the time until it prints that it is
+ready. That needs the usual environment (Telegram and OpenAI credentials).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+TOP_MODULE_COUNT = 20
+READY_LINE = "is ready"
+READY_TIMEOUT_SEC = 120
+
+
+def measure_imports() -> tuple[int, list[tuple[int, int, str]]]:
+  """Return the total import time and the (self, cumulative, module) times in microseconds."""
+
+  result = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", "import minerva.app"],
+    capture_output=True,
+    text=True,
+    check=True,
+  )
+  module_times: list[tuple[int, int, str]] = []
+  for line in result.stderr.splitlines():
+    # import time: self [us] | cumulative | imported package
+    if not line.startswith("import time:") or "[us]" in line:
+      continue
+    self_us, cumulative_us, module = line.removeprefix("import time:").split("|")
+    module_times.append((int(self_us), int(cumulative_us), module.strip()))
+  total_us = sum(self_us for self_us, _, _ in module_times)
+  return total_us, module_times
+
+
+def measure_tokenizer_load_ms() -> float:
+  result = subprocess.run(
+    [
+      sys.executable,
+      "-c",
+      "import time\n"
+      "from minerva.message_history import get_tokenizer\n"
+      "start = time.perf_counter()\n"
+      "get_tokenizer()\n"
+      "print((time.perf_counter() - start) * 1000)",
+    ],
+    capture_output=True,
+    text=True,
+    check=True,
+  )
+  return float(result.stdout.strip())
+
+
+def measure_time_to_ready_sec() -> float:
+  start = time.perf_counter()
+  process = subprocess.Popen(
+    [sys.executable, "-u", "-m", "minerva.app"],
+    stdout=subprocess.PIPE,
+    stderr=subprocess.STDOUT,
+    text=True,
+    env=os.environ.copy(),
+  )
+  try:
+    assert process.stdout is not None
+    for line in process.stdout:
+      if READY_LINE in line:
+        return time.perf_counter() - start
+      if time.perf_counter() - start > READY_TIMEOUT_SEC:
+        break
+    raise RuntimeError("Minerva exited or timed out before it was ready")
+  finally:
+    process.terminate()
+    process.wait()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--run", action="store_true", help="measure the time until the bot is ready")
+  args = parser.parse_args()
+
+  total_us, module_times = measure_imports()
+  print(f"import minerva.app: {total_us / 1000:.0f} ms")
+  print(f"\nTop {TOP_MODULE_COUNT} modules by self import time:")
+  print(f"{'self ms':>10} {'cumulative ms':>15}  module")
+  for self_us, cumulative_us, module in sorted(module_times, reverse=True)[:TOP_MODULE_COUNT]:
+    print(f"{self_us / 1000:>10.1f} {cumulative_us / 1000:>15.1f}  {module}")
+
+  print(f"\ntokenizer load: {measure_tokenizer_load_ms():.0f} ms")
+
+  if args.run:
+    print(f"time to ready: {measure_time_to_ready_sec():.1f} s")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,49 @@
+"""Microbenchmark for `trim_by_token_size` on large tool responses.
+
+Run with:
+  poetry run python -m benchmarks.trim_by_token_size_benchmark
+
+Compares trimming by encoding a bounded prefix with encoding the whole
+response, which `trim_by_token_size` did before.
+"""
+
+import time
+from typing import Callable
+
+from minerva.message_history import get_tokenizer, trim_by_token_size
+
+RESPONSE_SIZES_KB = [10, 100, 1_000]
+TOKEN_LIMIT = 2048
+REPEAT_COUNT = 10
+
+
+def trim_by_full_encoding(message: str, token_limit: int, trimmed_suffix: str = "") -> str:
+  tokenizer = get_tokenizer()
+  tokens = tokenizer.encode(message)
+  if len(tokens) <= token_limit:
+    return message
+  return tokenizer.decode(tokens[:token_limit]) + trimmed_suffix
+
+
+def measure_ms(trim: Callable[[str, int, str], str], message: str) -> float:
+  start = time.perf_counter()
+  for _ in range(REPEAT_COUNT):
+    trim(message, TOKEN_LIMIT, "...TRUNCATED")
+  return (time.perf_counter() - start) * 1000 / REPEAT_COUNT
+
+
+def main():
+  # Warm up the tokenizer
+  get_tokenizer().encode("hello")
+
+  line = "<div class='item'><a href='/page'>Some link text</a> and a description</div>\n"
+  print(f"{'response KB':>12} {'prefix ms':>12} {'full ms':>12}")
+  for size_kb in RESPONSE_SIZES_KB:
+    message = line * (size_kb * 1024 // len(line))
+    prefix_ms = measure_ms(trim_by_token_size, message)
+    full_ms = measure_ms(trim_by_full_encoding, message)
+    print(f"{size_kb:>12} {prefix_ms:>12.2f} {full_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+  main()
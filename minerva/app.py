@@ -1,7 +1,12 @@
+import logging
 from typing import cast
 
+from minerva.chat_config import ChatConfig, load_chat_configs
 from minerva.config import (
   AI_NAME,
+  CALENDAR_ICS_URL,
+  CHATS_CONFIG_PATH,
+  LOG_LEVEL,
   OPENAI_API_KEY,
   OPENAI_API_BASE,
   OPENAI_IMAGE_MODEL,
@@ -16,17 +21,30 @@ from telegram.ext import Application
 from minerva.minerva import Minerva
 
 
+def get_chat_configs() -> list[ChatConfig]:
+  if CHATS_CONFIG_PATH:
+    return load_chat_configs(CHATS_CONFIG_PATH)
+  if TELEGRAM_CHAT_ID is None:
+    raise ValueError("TELEGRAM_CHAT_ID or CHATS_CONFIG_PATH is required")
+  return [ChatConfig(chat_id=TELEGRAM_CHAT_ID, calendar_ics_url=CALENDAR_ICS_URL or None)]
+
+
 def main():
   if TELEGRAM_BOT_TOKEN is None:
     raise ValueError("TELEGRAM_BOT_TOKEN is required")
 
+  logging.basicConfig(
+    level=LOG_LEVEL,
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+  )
+  # httpx logs every request at the INFO level, including Telegram polling
+  logging.getLogger("httpx").setLevel(logging.WARNING)
+
   print(f"Starting {AI_NAME} powered by {OPENAI_MODEL}")
 
   async def initialize_minerva(application: Application) -> None:
     if OPENAI_API_KEY is None:
       raise ValueError("OPENAI_API_KEY is required")
-    if TELEGRAM_CHAT_ID is None:
-      raise ValueError("TELEGRAM_CHAT_ID is required")
     if not OPENAI_MODEL:
       raise ValueError("OPENAI_MODEL is required")
     if not OPENAI_IMAGE_MODEL:
@@ -34,7 +52,7 @@ def main():
 
     minerva = Minerva(
       application,
-      chat_id=TELEGRAM_CHAT_ID,
+      chats=get_chat_configs(),
       openai_api_key=OPENAI_API_KEY,
       openai_base_url=OPENAI_API_BASE,
       openai_model=OPENAI_MODEL,
@@ -0,0 +1,84 @@
+import json
+from typing import Any, NamedTuple, Optional, cast
+
+# The tools every chat gets unless its config lists the tools. `query_calendar`
+# is added for the chats with a calendar.
+DEFAULT_TOOL_NAMES = ("fetch_html", "send_text_file", "generate_image")
+CALENDAR_TOOL_NAME = "query_calendar"
+
+
+class ChatConfig(NamedTuple):
+  """What Minerva does in a Telegram chat."""
+
+  chat_id: int
+  # Replaces the default persona part of the system prompt
+  prompt: Optional[str] = None
+  tool_names: tuple[str, ...] = DEFAULT_TOOL_NAMES
+  calendar_ics_url: Optional[str] = None
+
+
+def _parse_chat_config(value: Any) -> ChatConfig:
+  if not isinstance(value, dict):
+    raise ValueError(f"Chat config must be an object, got: {value!r}")
+  value = cast(dict[str, Any], value)
+
+  chat_id = value.get("chat_id")
+  if not isinstance(chat_id, int):
+    raise ValueError(f"Chat config must have an integer chat_id, got: {chat_id!r}")
+
+  prompt = value.get("prompt")
+  if prompt is not None and not isinstance(prompt, str):
+    raise ValueError(f"Chat {chat_id}: prompt must be a string")
+
+  calendar_ics_url = value.get("calendar_ics_url")
+  if calendar_ics_url is not None and not isinstance(calendar_ics_url, str):
+    raise ValueError(f"Chat {chat_id}: calendar_ics_url must be a string")
+
+  tool_names: Any = value.get("tools", list(DEFAULT_TOOL_NAMES))
+  if not isinstance(tool_names, list) or not all(
+    isinstance(name, str) for name in cast(list[Any], tool_names)
+  ):
+    raise ValueError(f"Chat {chat_id}: tools must be a list of tool names")
+  tool_names = cast(list[str], tool_names)
+  unknown_tool_names = set(tool_names) - set(DEFAULT_TOOL_NAMES)
+  if unknown_tool_names:
+    raise ValueError(
+      f"Chat {chat_id}: unknown tools: {', '.join(sorted(unknown_tool_names))}. "
+      f"Available tools: {', '.join(DEFAULT_TOOL_NAMES)}"
+    )
+
+  return ChatConfig(
+    chat_id=chat_id,
+    prompt=prompt,
+    tool_names=tuple(tool_names),
+    calendar_ics_url=calendar_ics_url or None,
+  )
+
+
+def parse_chat_configs(config_str: str) -> list[ChatConfig]:
+  """Parse the chats from a JSON config.
+
+  The config is a list of chats, for example:
+
+    [
+      {"chat_id": -100123, "calendar_ics_url": "https://..."},
+      {"chat_id": -100456, "prompt": "You are ...", "tools": ["fetch_html"]}
+    ]
+
+  `prompt`, `tools`, and `calendar_ics_url` are optional.
+  """
+
+  value = json.loads(config_str)
+  if not isinstance(value, list) or not value:
+    raise ValueError("Chats config must be a non-empty list of chats")
+
+  chats = [_parse_chat_config(chat) for chat in cast(list[Any], value)]
+  chat_ids = [chat.chat_id for chat in chats]
+  if len(set(chat_ids)) != len(chat_ids):
+    raise ValueError("Chats config has duplicate chat ids")
+  return chats
+
+
+def load_chat_configs(path: str) -> list[ChatConfig]:
+  with open(path) as f:
+    return parse_chat_configs(f.read())
@@ -1,18 +1,64 @@
+import asyncio
+import contextlib
+import logging
+import time
 from typing import Optional
 from openai import AsyncOpenAI
 from telegram import Bot
-from minerva.llm_session import LlmSession
+from minerva.deadline import Deadline
+from minerva.history_store import TopicHistoryStore
+from minerva.http_client import HttpClientRegistry
+from minerva.history_summarizer import HistorySummarizer
+from minerva.llm_session import CANCELLED_TOOL_RESPONSE, LlmResponse, LlmSession
 from minerva.markdown_splitter import split_markdown
 from minerva.message_history import Message, trim_by_token_size
+from minerva.metrics import (
+  MODEL_REQUEST_DURATION,
+  RESPONSE_DURATION,
+  RESPONSE_RETRIES,
+  TELEGRAM_SEND_DURATION,
+  TOOL_CALL_DURATION,
+  TOOL_CALL_PARSE_FAILURES,
+  TOOL_USE_LIMIT_REACHED,
+)
 from minerva.prompt import ModelAction, parse_model_message
+from minerva.response_scheduler import ResponseRequest, ResponseScheduler
+from minerva.telegram_message_streamer import TelegramMessageStreamer
 from telegram.constants import ParseMode
 
-from minerva.tool_utils import GenericToolFn, format_tool_username, parse_tool_call
+from minerva.tool_utils import (
+  GenericToolFn,
+  ToolCall,
+  format_tool_username,
+  get_tool_json_schema,
+  parse_native_tool_call,
+  parse_tool_calls,
+)
+
+logger = logging.getLogger(__name__)
+
+ERROR_ANSWER = "I'm sorry, I'm having trouble understanding you right now. Could you please rephrase your question?"
+MAX_TOOL_COUNT_REACHED_ANSWER = "I'm sorry, I can't help you with that. Please ask something else."
+RESPONSE_TIMEOUT_ANSWER = "I'm sorry, this is taking me too long. Could you please try again?"
+OUT_OF_TIME_ERROR = (
+  "ERROR: You ran out of time. Don't use any more tools, answer the user right away with what"
+  " you found so far."
+)
 
 
 class CreateMessageCallInfo:
   tool_use_count: int = 0
   retry_count: int = 0
+  turn_count: int = 0
+
+
+class TurnTimings:
+  """Where the time of a single model turn went."""
+
+  def __init__(self):
+    self.model_sec = 0.0
+    self.tools_sec = 0.0
+    self.tool_call_count = 0
 
 
 class ChatSession:
@@ -28,10 +74,21 @@ class ChatSession:
     max_create_response_tool_use_count: int,
     max_telegram_message_length_char: int,
     max_tool_response_tokens: int,
+    max_image_tokens: int,
     tools: dict[str, GenericToolFn],
     prompt: str,
     chat_id: int,
     topic_id: int,
+    stream_responses: bool = False,
+    stream_edit_interval_sec: float = 1.5,
+    history_store: Optional[TopicHistoryStore] = None,
+    native_tool_calls: bool = False,
+    tool_semaphores: Optional[dict[str, asyncio.Semaphore]] = None,
+    response_timeout_sec: Optional[float] = None,
+    best_effort_answer_timeout_sec: Optional[float] = None,
+    history_eviction_block_ratio: float = 0,
+    history_summarizer: Optional[HistorySummarizer] = None,
+    http_clients: Optional[HttpClientRegistry] = None,
   ):
     self.ai_username = ai_username
     self.bot = bot
@@ -41,6 +98,22 @@ class ChatSession:
     self.max_create_response_tool_use_count = max_create_response_tool_use_count
     self.max_telegram_message_length_char = max_telegram_message_length_char
     self.max_tool_response_tokens = max_tool_response_tokens
+    # The token budget of a single image, see `get_max_image_tokens`
+    self.max_image_tokens = max_image_tokens
+    self.stream_responses = stream_responses
+    self.stream_edit_interval_sec = stream_edit_interval_sec
+    # Call tools through the API's structured tool calls instead of the
+    # "Action: ..." text protocol
+    self.native_tool_calls = native_tool_calls
+    # Limit the concurrent calls of some tools, usually shared by all sessions
+    self.tool_semaphores = tool_semaphores or {}
+    # The wall-clock limit of a response, including all tool calls
+    self.response_timeout_sec = response_timeout_sec
+    # The part of the response timeout reserved for a last model request, which
+    # answers from the work done so far. Without it, we apologize on timeout.
+    self.best_effort_answer_timeout_sec = best_effort_answer_timeout_sec
+    # Shared HTTP clients passed to the tools
+    self.http_clients = http_clients
     self.tools: dict[str, GenericToolFn] = tools
     self.openai_client = openai_client
 
@@ -51,157 +124,438 @@ class ChatSession:
       max_completion_tokens=max_completion_tokens,
       max_history_tokens=max_history_tokens,
       prompt=prompt,
+      history_store=history_store,
+      tools=(
+        [get_tool_json_schema(name, tool) for name, tool in tools.items()]
+        if native_tool_calls
+        else None
+      ),
+      eviction_block_ratio=history_eviction_block_ratio,
+      prompt_cache_key=f"minerva:{chat_id}:{topic_id}",
+      summarizer=history_summarizer,
     )
+    self._response_scheduler = ResponseScheduler(self._create_scheduled_response)
+
+    # The state of the response in flight
+    self._response_timeout: Optional[asyncio.Timeout] = None
+    self._deadline: Optional[Deadline] = None
+    self._streamer: Optional[TelegramMessageStreamer] = None
+    self._is_sending_answer = False
+
+  @property
+  def is_busy(self) -> bool:
+    """Whether the session is creating a response."""
+    return self._response_scheduler.is_busy
 
   def add_message(self, message: Message):
     self.llm_session.add_message(message)
 
-  def create_response(self, user_id: str, reply_to_message_id: Optional[int] = None):
-    return self._create_response(user_id=user_id, reply_to_message_id=reply_to_message_id)
+  def get_max_image_tokens(self, image_count: int) -> int:
+    """The token budget of each of `image_count` new images.
+
+    The images share the part of the history budget that isn't taken by the
+    images already in the history, up to `max_image_tokens` each. Photos that
+    don't fit are sent at a lower resolution or in low detail.
+    """
+
+    history = self.llm_session.history
+    remaining_tokens = history.token_limit - history.current_image_tokens
+    return min(self.max_image_tokens, remaining_tokens // image_count)
+
+  def load_history(self):
+    return self.llm_session.load_history()
+
+  def unload(self):
+    self.llm_session.unload()
+
+  def create_response(
+    self, user_id: str, reply_to_message_id: Optional[int] = None
+  ) -> asyncio.Future[None]:
+    """Schedule a response to the current history.
+
+    Responses are created one at a time. Requests made while a response is in
+    flight are coalesced into a single follow-up response. A follow-up from the
+    user who requested the response in flight cancels it, unless we already
+    started sending the answer. The returned future resolves once the response
+    covering this request is sent.
+    """
+
+    current_request = self._response_scheduler.current_request
+    if (
+      current_request is not None
+      and current_request.user_id == user_id
+      and not self._is_answer_visible()
+    ):
+      self._response_scheduler.cancel_current()
+    return self._response_scheduler.submit(ResponseRequest(user_id, reply_to_message_id))
 
-  async def _create_response(
+  def _create_scheduled_response(self, request: ResponseRequest):
+    return self._create_response(
+      user_id=request.user_id,
+      reply_to_message_id=request.reply_to_message_id,
+    )
+
+  async def _create_response(self, user_id: str, reply_to_message_id: Optional[int] = None) -> None:
+    """Run model turns until the model answers the user.
+
+    Every turn is a model request, followed by the tool calls the model made,
+    if any. Failed parses and tool calls start another turn.
+    """
+
+    call_info = CreateMessageCallInfo()
+    started_at = time.monotonic()
+    work_timeout_sec = self.response_timeout_sec
+    if work_timeout_sec is not None and self.best_effort_answer_timeout_sec is not None:
+      work_timeout_sec -= self.best_effort_answer_timeout_sec
+    self._deadline = Deadline(work_timeout_sec) if work_timeout_sec is not None else None
+    try:
+      async with asyncio.timeout(work_timeout_sec) as self._response_timeout:
+        while await self._run_turn(user_id, reply_to_message_id, call_info):
+          pass
+    except TimeoutError:
+      logger.warning(
+        "response timed out: topic=%d turns=%d timeout_sec=%s",
+        self.topic_id,
+        call_info.turn_count,
+        work_timeout_sec,
+      )
+      await self._send_best_effort_answer(user_id, reply_to_message_id)
+    except asyncio.CancelledError:
+      logger.info("response cancelled: topic=%d turns=%d", self.topic_id, call_info.turn_count)
+      raise
+    finally:
+      self._response_timeout = None
+      self._deadline = None
+      self._streamer = None
+      self._is_sending_answer = False
+      duration_sec = time.monotonic() - started_at
+      RESPONSE_DURATION.observe(str(self.chat_id), str(self.topic_id), value=duration_sec)
+      logger.info(
+        "response finished: topic=%d turns=%d tool_uses=%d retries=%d duration_sec=%.2f",
+        self.topic_id,
+        call_info.turn_count,
+        call_info.tool_use_count,
+        call_info.retry_count,
+        duration_sec,
+      )
+
+  async def _run_turn(
     self,
     user_id: str,
-    reply_to_message_id: Optional[int] = None,
-    call_info: Optional[CreateMessageCallInfo] = None,
-  ) -> None:
-    if call_info is None:
-      call_info = CreateMessageCallInfo()
+    reply_to_message_id: Optional[int],
+    call_info: CreateMessageCallInfo,
+  ) -> bool:
+    """Run a single model turn, return whether another turn is needed."""
 
+    call_info.turn_count += 1
+    timings = TurnTimings()
     try:
-      answer = await self.llm_session.create_response(user_id=user_id)
-      print(f"OpenAI response:\n{answer}\n\n")
-    except Exception as err:
-      print("OpenAI API error:", err)
-      answer = (
-        f"Action: {ModelAction.RESPOND}\n"
-        "I'm sorry, I'm having trouble understanding you right now."
-        " Could you please rephrase your question?"
+      return await self._run_turn_steps(user_id, reply_to_message_id, call_info, timings)
+    finally:
+      logger.info(
+        "response turn: topic=%d turn=%d model_sec=%.2f tools_sec=%.2f tool_calls=%d",
+        self.topic_id,
+        call_info.turn_count,
+        timings.model_sec,
+        timings.tools_sec,
+        timings.tool_call_count,
+      )
+
+  async def _run_turn_steps(
+    self,
+    user_id: str,
+    reply_to_message_id: Optional[int],
+    call_info: CreateMessageCallInfo,
+    timings: TurnTimings,
+  ) -> bool:
+    streamer = self._create_streamer(reply_to_message_id) if self.stream_responses else None
+    self._streamer = streamer
+
+    model_started_at = time.monotonic()
+    try:
+      response = await self.llm_session.create_response(
+        user_id=user_id,
+        on_answer_update=streamer.on_answer_update if streamer else None,
+        deadline=self._deadline,
       )
+      logger.debug("OpenAI response:\n%s", response.answer)
+    except Exception as err:
+      if self._deadline is not None and self._deadline.is_expired:
+        # The request timed out with the response, not because of an API error
+        raise TimeoutError from err
+      logger.error("OpenAI API error: %s", err)
+      answer = self._format_answer(ERROR_ANSWER)
       self.llm_session.add_message(Message(self.ai_username, answer))
+      response = LlmResponse(answer)
+    finally:
+      timings.model_sec = time.monotonic() - model_started_at
+      MODEL_REQUEST_DURATION.observe(str(self.chat_id), str(self.topic_id), value=timings.model_sec)
+
+    if self.native_tool_calls:
+      return await self._handle_native_response(
+        response, reply_to_message_id, call_info, streamer, timings
+      )
 
     try:
-      model_message = parse_model_message(answer)
+      model_message = parse_model_message(response.answer)
     except Exception as err:
+      TOOL_CALL_PARSE_FAILURES.inc("text", "action")
       if call_info.retry_count >= self.max_create_response_retry_count:
-        answer = "I'm sorry, I'm having trouble understanding you right now. Could you please rephrase your question?"
-        self.llm_session.add_message(
-          Message(self.ai_username, f"Action: {ModelAction.RESPOND}\n{answer}")
-        )
-        await self._send_message(answer, reply_to_message_id)
-        return
+        await self._send_fallback_answer(ERROR_ANSWER, reply_to_message_id)
+        return False
 
       call_info.retry_count += 1
+      RESPONSE_RETRIES.inc("text")
       self.llm_session.add_message(Message("ERROR", str(err)))
-      await self._create_response(
-        user_id=user_id,
-        reply_to_message_id=reply_to_message_id,
-        call_info=call_info,
-      )
-      return
+      return True
 
     match model_message.action:
       case ModelAction.RESPOND:
-        for response in split_markdown(
-          model_message.content, self.max_telegram_message_length_char
-        ):
-          await self._send_message(response, reply_to_message_id)
+        await self._send_answer(model_message.content, reply_to_message_id, streamer)
+        return False
 
       case ModelAction.USE_TOOL:
         call_info.tool_use_count += 1
 
         # Minerva reached the tool use limit, tell her to reply to the user
         if call_info.tool_use_count == self.max_create_response_tool_use_count:
+          TOOL_USE_LIMIT_REACHED.inc("text")
           self.llm_session.add_message(
-            Message(
-              format_tool_username("ERROR"),
-              f"You've used tools more than {self.max_create_response_tool_use_count} times in a row. Reply to the user.",
-            )
+            Message(format_tool_username("ERROR"), self._get_tool_use_limit_error())
           )
-          await self._create_response(
-            user_id=user_id,
-            reply_to_message_id=reply_to_message_id,
-            call_info=call_info,
-          )
-          return
+          return True
 
         # Minerva is past the tool use limit and ignored our request to reply to the user
         # Reply to the user instead of her
         if call_info.tool_use_count > self.max_create_response_tool_use_count:
-          max_tool_count_reached_response = (
-            "I'm sorry, I can't help you with that. Please ask something else."
-          )
-          self.llm_session.add_message(
-            Message(
-              self.ai_username,
-              f"Action: {ModelAction.RESPOND}\n{max_tool_count_reached_response}",
-            )
-          )
-          await self._send_message(max_tool_count_reached_response, reply_to_message_id)
-          return
+          await self._send_fallback_answer(MAX_TOOL_COUNT_REACHED_ANSWER, reply_to_message_id)
+          return False
 
         try:
-          tool_call = parse_tool_call(model_message.content, self.tools)
+          tool_calls = parse_tool_calls(model_message.content, self.tools)
         except Exception as err:
+          TOOL_CALL_PARSE_FAILURES.inc("text", "tool_call")
+          RESPONSE_RETRIES.inc("text")
           self.llm_session.add_message(
             Message(format_tool_username("ERROR"), f"ERROR: {repr(err)}")
           )
-          await self._create_response(
-            user_id=user_id,
-            reply_to_message_id=reply_to_message_id,
-            call_info=call_info,
-          )
-          return
+          return True
 
-        try:
-          tool_response = await self.tools[tool_call.tool_name](
-            *tool_call.args,
-            bot=self.bot,
-            chat_id=self.chat_id,
-            topic_id=self.topic_id,
-            reply_to_message_id=reply_to_message_id,
-            openai_client=self.openai_client,
-            ai_username=self.ai_username,
-            add_message_to_history=self.add_message,
-          )
-          # Ensure we won't blow up the conversation history with a huge tool response
-          truncated_tool_response = trim_by_token_size(
-            tool_response,
-            self.max_tool_response_tokens,
-            "...TRUNCATED",
-          )
+        tool_responses = await self._call_tools(tool_calls, reply_to_message_id, timings)
+        for tool_call, tool_response in zip(tool_calls, tool_responses):
           self.llm_session.add_message(
-            Message(
-              format_tool_username(tool_call.tool_name),
-              truncated_tool_response,
-            )
+            Message(format_tool_username(tool_call.tool_name), tool_response)
           )
-        except Exception as err:
-          self.llm_session.add_message(
-            Message(
-              format_tool_username(tool_call.tool_name),
-              f"ERROR: {repr(err)}",
-            )
+        return True
+
+      case _:
+        logger.error("Unknown action: %s", model_message.action)
+        return False
+
+  async def _handle_native_response(
+    self,
+    response: LlmResponse,
+    reply_to_message_id: Optional[int],
+    call_info: CreateMessageCallInfo,
+    streamer: Optional[TelegramMessageStreamer],
+    timings: TurnTimings,
+  ) -> bool:
+    if not response.tool_calls:
+      await self._send_answer(response.answer, reply_to_message_id, streamer)
+      return False
+
+    call_info.tool_use_count += 1
+    if call_info.tool_use_count == self.max_create_response_tool_use_count:
+      TOOL_USE_LIMIT_REACHED.inc("native")
+    tool_responses: dict[int, str] = {}
+    tool_calls: dict[int, ToolCall] = {}
+    has_parse_failures = False
+    for i, native_tool_call in enumerate(response.tool_calls):
+      if call_info.tool_use_count >= self.max_create_response_tool_use_count:
+        tool_responses[i] = self._get_tool_use_limit_error()
+        continue
+      try:
+        tool_calls[i] = parse_native_tool_call(
+          native_tool_call.tool_name, native_tool_call.arguments, self.tools
+        )
+      except Exception as err:
+        TOOL_CALL_PARSE_FAILURES.inc("native", "tool_call")
+        has_parse_failures = True
+        tool_responses[i] = f"ERROR: {repr(err)}"
+
+    try:
+      if streamer is not None and streamer.is_streaming:
+        # The model said something before calling the tools
+        await streamer.finish(response.answer)
+      tool_responses.update(
+        zip(
+          tool_calls,
+          await self._call_tools(list(tool_calls.values()), reply_to_message_id, timings),
+        )
+      )
+    finally:
+      # Every tool call needs a response, even if we didn't run the tool or the
+      # response was cancelled, otherwise the API rejects the history
+      for i, native_tool_call in enumerate(response.tool_calls):
+        self.llm_session.add_message(
+          Message(
+            format_tool_username(native_tool_call.tool_name),
+            tool_responses.get(i, CANCELLED_TOOL_RESPONSE),
+            tool_call_id=native_tool_call.call_id,
           )
+        )
+
+    # Minerva is past the tool use limit and ignored our request to reply to the user
+    # Reply to the user instead of her
+    if call_info.tool_use_count > self.max_create_response_tool_use_count:
+      await self._send_fallback_answer(MAX_TOOL_COUNT_REACHED_ANSWER, reply_to_message_id)
+      return False
+
+    if has_parse_failures:
+      RESPONSE_RETRIES.inc("native")
+    return True
 
-        await self._create_response(
-          user_id=user_id,
+  async def _call_tools(
+    self, tool_calls: list[ToolCall], reply_to_message_id: Optional[int], timings: TurnTimings
+  ) -> list[str]:
+    """Run the tools concurrently and return their responses in the order of the calls."""
+
+    timings.tool_call_count += len(tool_calls)
+    started_at = time.monotonic()
+    try:
+      return list(
+        await asyncio.gather(
+          *(self._call_tool(tool_call, reply_to_message_id) for tool_call in tool_calls)
+        )
+      )
+    finally:
+      timings.tools_sec += time.monotonic() - started_at
+
+  async def _call_tool(self, tool_call: ToolCall, reply_to_message_id: Optional[int]) -> str:
+    """Run the tool and return its response, or the error if it failed."""
+
+    semaphore = self.tool_semaphores.get(tool_call.tool_name)
+    started_at = time.monotonic()
+    outcome = "error"
+    try:
+      async with semaphore or contextlib.nullcontext():
+        tool_response = await self.tools[tool_call.tool_name](
+          *tool_call.args,
+          bot=self.bot,
+          chat_id=self.chat_id,
+          topic_id=self.topic_id,
           reply_to_message_id=reply_to_message_id,
-          call_info=call_info,
+          openai_client=self.openai_client,
+          ai_username=self.ai_username,
+          add_message_to_history=self.add_message,
+          deadline=self._deadline,
+          http_clients=self.http_clients,
         )
+      outcome = "ok"
+    except Exception as err:
+      return f"ERROR: {repr(err)}"
+    finally:
+      TOOL_CALL_DURATION.observe(tool_call.tool_name, outcome, value=time.monotonic() - started_at)
 
-      case _:
-        print("Unknown action:", model_message.action)
+    # Ensure we won't blow up the conversation history with a huge tool response
+    return trim_by_token_size(
+      tool_response,
+      self.max_tool_response_tokens,
+      "...TRUNCATED",
+    )
 
-  def _send_message(
+  async def _send_answer(
     self,
-    text: str,
-    reply_to_message_id: Optional[int] = None,
-  ):
-    return self.bot.send_message(
+    answer: str,
+    reply_to_message_id: Optional[int],
+    streamer: Optional[TelegramMessageStreamer],
+  ) -> None:
+    # Once we start sending the answer, let it finish
+    self._is_sending_answer = True
+    if self._response_timeout is not None and not self._response_timeout.expired():
+      self._response_timeout.reschedule(None)
+
+    if streamer is not None and streamer.is_streaming:
+      await streamer.finish(answer)
+      return
+
+    for response in split_markdown(answer, self.max_telegram_message_length_char):
+      await self._send_message(response, reply_to_message_id)
+
+  async def _send_best_effort_answer(
+    self, user_id: str, reply_to_message_id: Optional[int]
+  ) -> None:
+    """Ask the model to answer from the work done so far, without calling more tools."""
+
+    if self.best_effort_answer_timeout_sec is None:
+      await self._send_fallback_answer(RESPONSE_TIMEOUT_ANSWER, reply_to_message_id)
+      return
+
+    self.llm_session.add_message(Message(format_tool_username("ERROR"), OUT_OF_TIME_ERROR))
+    deadline = Deadline(self.best_effort_answer_timeout_sec)
+    try:
+      async with asyncio.timeout(deadline.timeout_sec):
+        response = await self.llm_session.create_response(
+          user_id=user_id, deadline=deadline, allow_tools=False
+        )
+      answer = response.answer
+      if not self.native_tool_calls:
+        model_message = parse_model_message(answer)
+        if model_message.action != ModelAction.RESPOND:
+          raise ValueError(f"Unexpected action: {model_message.action}")
+        answer = model_message.content
+    except Exception as err:
+      logger.error("Failed to create a best effort answer: %s", repr(err))
+      await self._send_fallback_answer(RESPONSE_TIMEOUT_ANSWER, reply_to_message_id)
+      return
+
+    await self._send_answer(answer, reply_to_message_id, streamer=None)
+
+  async def _send_fallback_answer(self, answer: str, reply_to_message_id: Optional[int]) -> None:
+    """Answer the user on behalf of the model."""
+
+    self.llm_session.add_message(Message(self.ai_username, self._format_answer(answer)))
+    await self._send_answer(answer, reply_to_message_id, streamer=None)
+
+  def _is_answer_visible(self) -> bool:
+    """Whether a part of the current answer was already sent to the chat."""
+
+    return self._is_sending_answer or (self._streamer is not None and self._streamer.is_streaming)
+
+  def _get_tool_use_limit_error(self) -> str:
+    return (
+      f"You've used tools more than {self.max_create_response_tool_use_count} times in a row."
+      " Reply to the user."
+    )
+
+  def _format_answer(self, answer: str) -> str:
+    """Format an answer we give on behalf of the model the way the model would."""
+
+    if self.native_tool_calls:
+      return answer
+    return f"Action: {ModelAction.RESPOND}\n{answer}"
+
+  def _create_streamer(self, reply_to_message_id: Optional[int]) -> TelegramMessageStreamer:
+    return TelegramMessageStreamer(
+      bot=self.bot,
       chat_id=self.chat_id,
-      text=text,
-      message_thread_id=self.topic_id,
+      topic_id=self.topic_id,
       reply_to_message_id=reply_to_message_id,
-      parse_mode=ParseMode.MARKDOWN,
+      max_message_length_char=self.max_telegram_message_length_char,
+      edit_interval_sec=self.stream_edit_interval_sec,
+      has_action_header=not self.native_tool_calls,
     )
+
+  async def _send_message(
+    self,
+    text: str,
+    reply_to_message_id: Optional[int] = None,
+  ):
+    with TELEGRAM_SEND_DURATION.time("send_message"):
+      return await self.bot.send_message(
+        chat_id=self.chat_id,
+        text=text,
+        message_thread_id=self.topic_id,
+        reply_to_message_id=reply_to_message_id,
+        parse_mode=ParseMode.MARKDOWN,
+      )
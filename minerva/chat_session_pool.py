@@ -0,0 +1,176 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, Callable, NamedTuple
+
+from minerva.chat_session import ChatSession
+from minerva.message_history import MessageHistory
+
+logger = logging.getLogger(__name__)
+
+
+# Sessions are kept per topic of every chat
+SessionKey = tuple[int, int]
+
+
+class ChatSessionStats(NamedTuple):
+  chat_id: int
+  topic_id: int
+  message_count: int
+  history_tokens: int
+  size_bytes: int
+  image_count: int
+  image_size_bytes: int
+  idle_sec: float
+
+
+def _get_image_stats(history: MessageHistory) -> tuple[int, int]:
+  image_count = 0
+  image_size_bytes = 0
+  for message in history.history:
+    if isinstance(message.content, str):
+      continue
+    image_count += len(message.content.images)
+    image_size_bytes += sum(image.size_bytes for image in message.content.images)
+  return image_count, image_size_bytes
+
+
+class ChatSessionPool:
+  """A bounded, LRU-ordered store of chat sessions keyed by (chat id, topic id).
+
+  Sessions are evicted when they stay idle for longer than `idle_ttl_sec`, or
+  when the pool exceeds its session count, history token, or memory budget,
+  least recently used first. Sessions that are creating a response, and the
+  sessions pinned with `pin`, are never evicted. The budgets are shared by all chats, so the pool bounds the memory
+  of the whole process.
+
+  Sessions load their history from the history store (if they have one) when
+  they are created, so an evicted session is restored the next time the topic
+  gets a message. Without a history store, the evicted history is dropped.
+  """
+
+  def __init__(
+    self,
+    create_chat_session: Callable[[int, int], ChatSession],
+    max_sessions: int,
+    idle_ttl_sec: float,
+    max_total_tokens: int,
+    max_total_size_bytes: int,
+  ):
+    self.create_chat_session = create_chat_session
+    self.max_sessions = max_sessions
+    self.idle_ttl_sec = idle_ttl_sec
+    self.max_total_tokens = max_total_tokens
+    self.max_total_size_bytes = max_total_size_bytes
+
+    # Ordered from the least to the most recently used
+    self._sessions: OrderedDict[SessionKey, ChatSession] = OrderedDict()
+    self._last_used_at: dict[SessionKey, float] = {}
+    self._loading_sessions: dict[SessionKey, asyncio.Task[ChatSession]] = {}
+    self._pin_counts: dict[SessionKey, int] = {}
+
+  def __len__(self) -> int:
+    return len(self._sessions)
+
+  async def get(self, chat_id: int, topic_id: int) -> ChatSession:
+    """Get the chat session for the topic, restoring or creating it if needed."""
+
+    key = (chat_id, topic_id)
+    session = self._sessions.get(key)
+    if session is None:
+      # Concurrent calls for the same topic share a single session
+      loading_session = self._loading_sessions.get(key)
+      if loading_session is None:
+        loading_session = asyncio.create_task(self._load(key))
+        self._loading_sessions[key] = loading_session
+      session = await loading_session
+    else:
+      self._sessions.move_to_end(key)
+    self._last_used_at[key] = time.monotonic()
+
+    self._evict(keep_key=key)
+    return session
+
+  @contextlib.asynccontextmanager
+  async def pin(self, chat_id: int, topic_id: int) -> AsyncGenerator[ChatSession, None]:
+    """Get the chat session like `get`, and keep it in the pool until the block exits."""
+
+    key = (chat_id, topic_id)
+    self._pin_counts[key] = self._pin_counts.get(key, 0) + 1
+    try:
+      yield await self.get(chat_id, topic_id)
+    finally:
+      pin_count = self._pin_counts.pop(key) - 1
+      if pin_count:
+        self._pin_counts[key] = pin_count
+
+  async def _load(self, key: SessionKey) -> ChatSession:
+    try:
+      session = self.create_chat_session(*key)
+      await session.load_history()
+      self._sessions[key] = session
+      return session
+    finally:
+      self._loading_sessions.pop(key, None)
+
+  def get_stats(self) -> list[ChatSessionStats]:
+    """Report the memory used by each topic."""
+
+    now = time.monotonic()
+    stats: list[ChatSessionStats] = []
+    for (chat_id, topic_id), session in self._sessions.items():
+      history = session.llm_session.history
+      image_count, image_size_bytes = _get_image_stats(history)
+      stats.append(
+        ChatSessionStats(
+          chat_id=chat_id,
+          topic_id=topic_id,
+          message_count=len(history.history),
+          history_tokens=history.current_tokens,
+          size_bytes=history.current_size_bytes,
+          image_count=image_count,
+          image_size_bytes=image_size_bytes,
+          idle_sec=now - self._last_used_at[(chat_id, topic_id)],
+        )
+      )
+    return stats
+
+  def _evict(self, keep_key: SessionKey) -> None:
+    now = time.monotonic()
+    total_tokens = sum(s.llm_session.history.current_tokens for s in self._sessions.values())
+    total_size_bytes = sum(
+      s.llm_session.history.current_size_bytes for s in self._sessions.values()
+    )
+
+    for key, session in list(self._sessions.items()):
+      is_expired = now - self._last_used_at[key] > self.idle_ttl_sec
+      is_over_budget = (
+        len(self._sessions) > self.max_sessions
+        or total_tokens > self.max_total_tokens
+        or total_size_bytes > self.max_total_size_bytes
+      )
+      if not is_expired and not is_over_budget:
+        # Sessions are ordered by last use, the rest are more recent
+        break
+      if key == keep_key or session.is_busy or key in self._pin_counts:
+        continue
+
+      total_tokens -= session.llm_session.history.current_tokens
+      total_size_bytes -= session.llm_session.history.current_size_bytes
+      self._remove(key, reason="expired" if is_expired else "over budget")
+
+  def _remove(self, key: SessionKey, reason: str) -> None:
+    session = self._sessions.pop(key)
+    self._last_used_at.pop(key, None)
+    history = session.llm_session.history
+    logger.info(
+      "evicting chat session: chat=%d topic=%d reason=%s messages=%d tokens=%d size_bytes=%d",
+      *key,
+      reason,
+      len(history.history),
+      history.current_tokens,
+      history.current_size_bytes,
+    )
+    session.unload()
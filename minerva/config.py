@@ -7,6 +7,9 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5.4")
 OPENAI_IMAGE_MODEL = os.getenv("OPENAI_IMAGE_MODEL", "gpt-image-1.5")
+# A cheaper model that summarizes the messages evicted from the topic histories.
+# Evicted messages are dropped if it's not set.
+OPENAI_SUMMARY_MODEL = os.getenv("OPENAI_SUMMARY_MODEL")
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
@@ -16,4 +19,47 @@ TELEGRAM_CHAT_ID = int(TELEGRAM_CHAT_ID_STR) if TELEGRAM_CHAT_ID_STR is not None
 
 CALENDAR_ICS_URL = os.getenv("CALENDAR_ICS_URL")
 
+# Path to a JSON file with the chats Minerva talks in, each with its own prompt,
+# tools, and calendar (see `minerva/chat_config.py`). Replaces TELEGRAM_CHAT_ID
+# and CALENDAR_ICS_URL if set.
+CHATS_CONFIG_PATH = os.getenv("CHATS_CONFIG_PATH")
+# The calendar is downloaded at most this often, and only if it changed
+CALENDAR_REFETCH_INTERVAL_MIN = int(os.getenv("CALENDAR_REFETCH_INTERVAL_MIN", "15"))
+
+# Limits for the in-memory chat sessions (one per topic), shared by all chats.
+# Idle sessions and the least recently used sessions over budget are evicted
+# from memory. Their history is restored from the history store on the next
+# message in the topic.
+CHAT_SESSIONS_MAX_COUNT = int(os.getenv("CHAT_SESSIONS_MAX_COUNT", "100"))
+CHAT_SESSIONS_IDLE_TTL_MIN = int(os.getenv("CHAT_SESSIONS_IDLE_TTL_MIN", str(24 * 60)))
+CHAT_SESSIONS_MAX_TOKENS = int(os.getenv("CHAT_SESSIONS_MAX_TOKENS", str(100 * 16384)))
+CHAT_SESSIONS_MAX_MEMORY_MB = int(os.getenv("CHAT_SESSIONS_MAX_MEMORY_MB", "256"))
+
+# Path to the SQLite database where chat histories are persisted. History is
+# kept in memory only if it's not set.
+HISTORY_STORE_PATH = os.getenv("HISTORY_STORE_PATH")
+
+# Images from the chat history are stored in this directory and referenced by
+# id. A temporary directory is used if it's not set.
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR") or None
+IMAGE_STORE_MAX_MEMORY_MB = int(os.getenv("IMAGE_STORE_MAX_MEMORY_MB", "64"))
+
+# Send the model answer to Telegram progressively while it's being generated
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "false").lower() in ("1", "true", "yes")
+
+# Let the model call tools through the API's structured tool calls instead of
+# the "Action: ..." text protocol
+NATIVE_TOOL_CALLS = os.getenv("NATIVE_TOOL_CALLS", "false").lower() in ("1", "true", "yes")
+
+# Serve the metrics in the Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics.
+# The metrics are not served if the port is not set.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT_STR = os.getenv("METRICS_PORT")
+METRICS_PORT = int(METRICS_PORT_STR) if METRICS_PORT_STR else None
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Log the full prompt and chat history sent to the model (at the DEBUG level).
+# The history includes base64 images, so it may be megabytes per request.
+LOG_FULL_HISTORY = os.getenv("LOG_FULL_HISTORY", "false").lower() in ("1", "true", "yes")
+
 AI_NAME = "Minerva"
@@ -0,0 +1,25 @@
+import time
+
+
+class Deadline:
+  """The point in time by which a response has to be done.
+
+  Passed down to the model requests and the tools, so they can bound the
+  timeouts of their own requests by the time the response has left.
+  """
+
+  def __init__(self, timeout_sec: float):
+    self.timeout_sec = timeout_sec
+    self.expires_at = time.monotonic() + timeout_sec
+
+  @property
+  def is_expired(self) -> bool:
+    return self.remaining_sec() == 0
+
+  def remaining_sec(self) -> float:
+    return max(0.0, self.expires_at - time.monotonic())
+
+  def cap_timeout_sec(self, timeout_sec: float) -> float:
+    """Shorten the timeout of a request so it doesn't outlive the deadline."""
+
+    return min(timeout_sec, self.remaining_sec())
@@ -1,26 +1,65 @@
-from minerva.message_history import MessageHistory
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Optional, cast
+
+from minerva.image_store import IMAGE_STORE
+from minerva.message_history import Message, MessageHistory
 from minerva.tool_utils import TOOL_PREFIX
 from openai.types.chat import ChatCompletionMessageParam
 from openai.types.chat.chat_completion_content_part_param import ChatCompletionContentPartParam
 
+logger = logging.getLogger(__name__)
 
-def format_chat_history_for_openai(
-  system_prompt: str, chat_history: MessageHistory
-) -> list[ChatCompletionMessageParam]:
-  messages: list[ChatCompletionMessageParam] = [{"role": "system", "content": system_prompt}]
-  for message in chat_history.history:
-    if message.author.startswith(TOOL_PREFIX):
-      if not isinstance(message.content, str):
-        raise Exception("Unexpected: tool response is not a string")
-      messages.append(
+# Converted messages reference images by id, the image data is only inlined
+# into the payload right before sending it to the model
+IMAGE_REF_URL_PREFIX = "minerva-image:"
+# Replaces the images that are no longer stored, e.g. when a temporary image
+# directory was lost on restart
+MISSING_IMAGE_TEXT = "[The image is no longer available]"
+SUMMARY_HEADER = "Summary of the earlier conversation, the messages are no longer in the history:"
+
+
+def format_message_for_openai(message: Message) -> ChatCompletionMessageParam:
+  """Convert a history message to the OpenAI format.
+
+  Messages are immutable once added to the history, so the result is cached on
+  the message and reused by every following request. Images are referenced by
+  id, use `materialize_images` to inline them before sending the message.
+  """
+
+  if message.openai_message is not None:
+    return message.openai_message
+
+  openai_message: ChatCompletionMessageParam
+  if message.tool_calls:
+    openai_message = {
+      "role": "assistant",
+      "content": cast(str, message.content) or None,
+      "tool_calls": [
         {
-          "role": "system",
-          "content": message.content,
-          "name": message.author,
+          "id": tool_call.call_id,
+          "type": "function",
+          "function": {"name": tool_call.tool_name, "arguments": tool_call.arguments},
         }
-      )
-      continue
-
+        for tool_call in message.tool_calls
+      ],
+    }
+  elif message.tool_call_id is not None:
+    openai_message = {
+      "role": "tool",
+      "content": cast(str, message.content),
+      "tool_call_id": message.tool_call_id,
+    }
+  elif message.author.startswith(TOOL_PREFIX):
+    if not isinstance(message.content, str):
+      raise Exception("Unexpected: tool response is not a string")
+    openai_message = {
+      "role": "system",
+      "content": message.content,
+      "name": message.author,
+    }
+  else:
     content: list[ChatCompletionContentPartParam] = []
     if isinstance(message.content, str):
       content = [{"type": "text", "text": message.content}]
@@ -29,17 +68,139 @@ def format_chat_history_for_openai(
         content.append(
           {
             "type": "image_url",
-            "image_url": {"url": image.url},
+            "image_url": {
+              "url": f"{IMAGE_REF_URL_PREFIX}{image.image_id}",
+              "detail": image.detail,
+            },
           }
         )
       if message.content.text:
         content.append({"type": "text", "text": message.content.text})
 
-    messages.append(
-      {
-        "role": "user",
-        "content": content,
-        "name": message.author,
-      }
-    )
+    openai_message = {
+      "role": "user",
+      "content": content,
+      "name": message.author,
+    }
+
+  message.openai_message = openai_message
+  return openai_message
+
+
+def _has_image_refs(message: ChatCompletionMessageParam) -> bool:
+  content = message.get("content")
+  return isinstance(content, list) and any(
+    cast(dict[str, Any], part)["type"] == "image_url" for part in content
+  )
+
+
+async def _materialize_image_part(part: dict[str, Any]) -> dict[str, Any]:
+  url = part["image_url"]["url"] if part["type"] == "image_url" else None
+  if not url or not url.startswith(IMAGE_REF_URL_PREFIX):
+    return part
+
+  image_id = url.removeprefix(IMAGE_REF_URL_PREFIX)
+  data_url = await IMAGE_STORE.get_data_url(image_id)
+  if data_url is None:
+    logger.warning("Image is missing from the image store: %s", image_id)
+    return {"type": "text", "text": MISSING_IMAGE_TEXT}
+  return {**part, "image_url": {**part["image_url"], "url": data_url}}
+
+
+async def materialize_images(message: ChatCompletionMessageParam) -> ChatCompletionMessageParam:
+  """Return a copy of the message with the referenced images inlined as data URLs.
+
+  The images that are no longer stored are replaced with `MISSING_IMAGE_TEXT`.
+  """
+
+  content = cast(list[dict[str, Any]], message.get("content"))
+  materialized_content = await asyncio.gather(*(_materialize_image_part(part) for part in content))
+  return cast(ChatCompletionMessageParam, {**message, "content": materialized_content})
+
+
+async def format_chat_history_for_openai(
+  system_prompt: str, chat_history: MessageHistory
+) -> list[ChatCompletionMessageParam]:
+  messages: list[ChatCompletionMessageParam] = [{"role": "system", "content": system_prompt}]
+  for message in chat_history.history:
+    openai_message = format_message_for_openai(message)
+    if _has_image_refs(openai_message):
+      openai_message = await materialize_images(openai_message)
+    messages.append(openai_message)
   return messages
+
+
+class OpenAiChatPayload:
+  """The OpenAI messages payload for a chat history, kept in sync incrementally.
+
+  Instead of re-converting the whole history for every request, the payload
+  appends the messages added since the last sync and drops the evicted ones.
+
+  The summary of the evicted messages, if any, is pinned right after the
+  system prompt.
+  """
+
+  def __init__(self, system_prompt: str, chat_history: MessageHistory):
+    self.chat_history = chat_history
+    self._messages: Deque[ChatCompletionMessageParam] = deque(
+      [{"role": "system", "content": system_prompt}]
+    )
+    self._synced_added_count = 0
+    self._synced_evicted_count = 0
+    self._image_message_count = 0
+    self._summary_message: Optional[ChatCompletionMessageParam] = None
+
+  def set_summary(self, summary: Optional[str]) -> None:
+    self._summary_message = (
+      {"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"} if summary else None
+    )
+
+  def _sync(self):
+    history = self.chat_history
+    added_count = history.added_count - self._synced_added_count
+    evicted_count = history.evicted_count - self._synced_evicted_count
+    self._synced_added_count = history.added_count
+    self._synced_evicted_count = history.evicted_count
+
+    # The first message is the system prompt, it's never evicted
+    synced_message_count = len(self._messages) - 1
+    if evicted_count >= synced_message_count:
+      # Everything we had was evicted (possibly together with some of the new
+      # messages), take whatever is left in the history
+      system_message = self._messages[0]
+      self._messages.clear()
+      self._messages.append(system_message)
+      self._image_message_count = 0
+      for message in history.history:
+        self._append(format_message_for_openai(message))
+      return
+
+    for _ in range(evicted_count):
+      if _has_image_refs(self._messages[1]):
+        self._image_message_count -= 1
+      del self._messages[1]
+
+    new_messages: list[ChatCompletionMessageParam] = []
+    for message in reversed(history.history):
+      if len(new_messages) == added_count:
+        break
+      new_messages.append(format_message_for_openai(message))
+    for openai_message in reversed(new_messages):
+      self._append(openai_message)
+
+  def _append(self, openai_message: ChatCompletionMessageParam):
+    if _has_image_refs(openai_message):
+      self._image_message_count += 1
+    self._messages.append(openai_message)
+
+  async def get_messages(self) -> list[ChatCompletionMessageParam]:
+    self._sync()
+    # Return a snapshot, the history may change while the request is in flight
+    messages = list(self._messages)
+    if self._summary_message is not None:
+      messages.insert(1, self._summary_message)
+    if self._image_message_count:
+      for i, message in enumerate(messages):
+        if _has_image_refs(message):
+          messages[i] = await materialize_images(message)
+    return messages
@@ -1,17 +1,22 @@
-import base64
 from telegram import Bot, PhotoSize
 
+from minerva.image_policy import select_photo_size
+from minerva.image_store import IMAGE_STORE
 from minerva.message_history import Image
 
 
-async def get_image_from_telegram_photo(bot: Bot, photo: tuple[PhotoSize, ...]) -> Image:
-  sorted_photo_sizes = sorted(photo, key=lambda p: p.width)
-  largest_photo_size = sorted_photo_sizes[-1]
-  photo_object = await bot.get_file(largest_photo_size.file_id)
-  photo_bytes = await photo_object.download_as_bytearray()
-  photo_base64 = f"data:image/jpeg;base64,{base64.b64encode(photo_bytes).decode('utf-8')}"
+async def get_image_from_telegram_photo(
+  bot: Bot, photo: tuple[PhotoSize, ...], max_image_tokens: int
+) -> Image:
+  # Telegram already keeps the photo downscaled to several sizes, so we pick
+  # the one that fits the token budget instead of resizing it ourselves
+  choice = select_photo_size(photo, max_image_tokens)
+  photo_object = await bot.get_file(choice.photo_size.file_id)
+  photo_bytes = bytes(await photo_object.download_as_bytearray())
   return Image(
-    url=photo_base64,
-    height_px=largest_photo_size.height,
-    width_px=largest_photo_size.width,
+    image_id=await IMAGE_STORE.put(photo_bytes, "image/jpeg"),
+    height_px=choice.photo_size.height,
+    width_px=choice.photo_size.width,
+    size_bytes=len(photo_bytes),
+    detail=choice.detail,
   )
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, NamedTuple, Optional
+
+from minerva.message_history import Message, get_image_ids, message_from_dict, message_to_dict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL_SEC = 1.0
+DEFAULT_MAX_PENDING_WRITES = 100
+
+
+class HistoryStore(ABC):
+  """Persistent storage for chat histories, keyed by chat and topic ids.
+
+  Messages are stored together with their token counts, so loading a history
+  doesn't need to re-tokenize it.
+  """
+
+  @abstractmethod
+  def add(self, chat_id: int, topic_id: int, message: Message) -> None:
+    """Append a message to the topic history. The write may be buffered."""
+
+  @abstractmethod
+  def trim(self, chat_id: int, topic_id: int, keep_last: int) -> None:
+    """Keep only the last `keep_last` messages of the topic. The write may be buffered."""
+
+  @abstractmethod
+  async def load(self, chat_id: int, topic_id: int) -> list[Message]:
+    """Load the topic history, including the buffered writes."""
+
+  @abstractmethod
+  def set_summary(self, chat_id: int, topic_id: int, summary: str) -> None:
+    """Replace the summary of the evicted topic history. The write may be buffered."""
+
+  @abstractmethod
+  async def load_summary(self, chat_id: int, topic_id: int) -> Optional[str]:
+    """Load the summary of the evicted topic history, including the buffered writes."""
+
+  @abstractmethod
+  async def load_image_ids(self) -> list[str]:
+    """Load the ids of the images referenced by all the histories, once per reference."""
+
+  @abstractmethod
+  async def close(self) -> None:
+    """Flush the buffered writes and release the storage."""
+
+  def for_topic(self, chat_id: int, topic_id: int) -> "TopicHistoryStore":
+    return TopicHistoryStore(self, chat_id, topic_id)
+
+
+class TopicHistoryStore(NamedTuple):
+  """A `HistoryStore` bound to a single topic."""
+
+  store: HistoryStore
+  chat_id: int
+  topic_id: int
+
+  def add(self, message: Message) -> None:
+    self.store.add(self.chat_id, self.topic_id, message)
+
+  def trim(self, keep_last: int) -> None:
+    self.store.trim(self.chat_id, self.topic_id, keep_last)
+
+  def load(self):
+    return self.store.load(self.chat_id, self.topic_id)
+
+  def set_summary(self, summary: str) -> None:
+    self.store.set_summary(self.chat_id, self.topic_id, summary)
+
+  def load_summary(self):
+    return self.store.load_summary(self.chat_id, self.topic_id)
+
+
+class _Write(NamedTuple):
+  sql: str
+  params: tuple[Any, ...]
+
+
+class SqliteHistoryStore(HistoryStore):
+  """A `HistoryStore` backed by a local SQLite database.
+
+  Writes are buffered and committed in batches from a worker thread, either
+  every `flush_interval_sec` or once `max_pending_writes` accumulate, so they
+  don't block the event loop.
+  """
+
+  def __init__(
+    self,
+    path: str,
+    flush_interval_sec: float = DEFAULT_FLUSH_INTERVAL_SEC,
+    max_pending_writes: int = DEFAULT_MAX_PENDING_WRITES,
+  ):
+    self.flush_interval_sec = flush_interval_sec
+    self.max_pending_writes = max_pending_writes
+
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    self._connection_lock = threading.Lock()
+    with self._connection_lock, self._connection:
+      self._connection.execute("PRAGMA journal_mode=WAL")
+      self._connection.execute(
+        """CREATE TABLE IF NOT EXISTS messages (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          chat_id INTEGER NOT NULL,
+          topic_id INTEGER NOT NULL,
+          data TEXT NOT NULL
+        )"""
+      )
+      self._connection.execute(
+        "CREATE INDEX IF NOT EXISTS messages_topic ON messages (chat_id, topic_id, id)"
+      )
+      self._connection.execute(
+        """CREATE TABLE IF NOT EXISTS summaries (
+          chat_id INTEGER NOT NULL,
+          topic_id INTEGER NOT NULL,
+          summary TEXT NOT NULL,
+          PRIMARY KEY (chat_id, topic_id)
+        )"""
+      )
+
+    self._pending_writes: list[_Write] = []
+    self._flush_lock = asyncio.Lock()
+    self._flush_loop_task: Optional[asyncio.Task[None]] = None
+    self._flush_task: Optional[asyncio.Task[None]] = None
+
+  def add(self, chat_id: int, topic_id: int, message: Message) -> None:
+    self._queue_write(
+      _Write(
+        "INSERT INTO messages (chat_id, topic_id, data) VALUES (?, ?, ?)",
+        (chat_id, topic_id, json.dumps(message_to_dict(message))),
+      )
+    )
+
+  def trim(self, chat_id: int, topic_id: int, keep_last: int) -> None:
+    self._queue_write(
+      _Write(
+        """DELETE FROM messages WHERE chat_id = ? AND topic_id = ? AND id NOT IN (
+          SELECT id FROM messages WHERE chat_id = ? AND topic_id = ? ORDER BY id DESC LIMIT ?
+        )""",
+        (chat_id, topic_id, chat_id, topic_id, keep_last),
+      )
+    )
+
+  async def load(self, chat_id: int, topic_id: int) -> list[Message]:
+    await self.flush()
+    rows = await asyncio.to_thread(self._read, chat_id, topic_id)
+    return [message_from_dict(json.loads(data)) for (data,) in rows]
+
+  def set_summary(self, chat_id: int, topic_id: int, summary: str) -> None:
+    self._queue_write(
+      _Write(
+        """INSERT INTO summaries (chat_id, topic_id, summary) VALUES (?, ?, ?)
+        ON CONFLICT (chat_id, topic_id) DO UPDATE SET summary = excluded.summary""",
+        (chat_id, topic_id, summary),
+      )
+    )
+
+  async def load_summary(self, chat_id: int, topic_id: int) -> Optional[str]:
+    await self.flush()
+    return await asyncio.to_thread(self._read_summary, chat_id, topic_id)
+
+  async def load_image_ids(self) -> list[str]:
+    await self.flush()
+    rows = await asyncio.to_thread(self._read_image_messages)
+    return get_image_ids(message_from_dict(json.loads(data)) for (data,) in rows)
+
+  async def flush(self) -> None:
+    async with self._flush_lock:
+      if not self._pending_writes:
+        return
+      writes = self._pending_writes
+      self._pending_writes = []
+      try:
+        await asyncio.to_thread(self._write, writes)
+      except Exception:
+        logger.exception("Failed to write %d history changes", len(writes))
+
+  async def close(self) -> None:
+    if self._flush_loop_task is not None:
+      self._flush_loop_task.cancel()
+      self._flush_loop_task = None
+    if self._flush_task is not None:
+      await self._flush_task
+      self._flush_task = None
+    await self.flush()
+    with self._connection_lock:
+      self._connection.close()
+
+  def _queue_write(self, write: _Write) -> None:
+    self._pending_writes.append(write)
+    if len(self._pending_writes) >= self.max_pending_writes:
+      if self._flush_task is None or self._flush_task.done():
+        self._flush_task = asyncio.create_task(self.flush())
+    elif self._flush_loop_task is None:
+      self._flush_loop_task = asyncio.create_task(self._flush_loop())
+
+  async def _flush_loop(self) -> None:
+    while True:
+      await asyncio.sleep(self.flush_interval_sec)
+      await self.flush()
+
+  def _write(self, writes: list[_Write]) -> None:
+    with self._connection_lock, self._connection:
+      for write in writes:
+        self._connection.execute(write.sql, write.params)
+
+  def _read(self, chat_id: int, topic_id: int) -> list[tuple[str]]:
+    with self._connection_lock:
+      return self._connection.execute(
+        "SELECT data FROM messages WHERE chat_id = ? AND topic_id = ? ORDER BY id",
+        (chat_id, topic_id),
+      ).fetchall()
+
+  def _read_image_messages(self) -> list[tuple[str]]:
+    with self._connection_lock:
+      # Narrows down the rows to parse, the texts can't match since their
+      # quotes are escaped
+      return self._connection.execute(
+        """SELECT data FROM messages WHERE data LIKE '%"images": %'"""
+      ).fetchall()
+
+  def _read_summary(self, chat_id: int, topic_id: int) -> Optional[str]:
+    with self._connection_lock:
+      row = self._connection.execute(
+        "SELECT summary FROM summaries WHERE chat_id = ? AND topic_id = ?",
+        (chat_id, topic_id),
+      ).fetchone()
+    return row[0] if row else None
@@ -0,0 +1,77 @@
+import logging
+from typing import Optional
+
+from openai import AsyncOpenAI
+
+from minerva.message_history import Message, trim_by_token_size
+from minerva.tool_utils import TOOL_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Tool responses are mostly raw data (HTML, calendar events), the gist of them
+# is usually in the answer that follows
+TOOL_RESPONSE_MAX_CHARS = 500
+
+SUMMARY_PROMPT = """You maintain the summary of the earlier part of a Telegram chat topic. The \
+messages below were removed from the chat history, merge them into the summary. Keep the facts, \
+decisions, open questions, and preferences of the participants that may matter later, and who \
+said what. Drop greetings, small talk, and the details of tool responses. Write plain text, \
+no more than {max_words} words."""
+
+
+def _format_message_for_summary(message: Message) -> str:
+  if isinstance(message.content, str):
+    text = message.content
+  else:
+    image_count = len(message.content.images)
+    text = f"[{image_count} image{'s' if image_count > 1 else ''}] {message.content.text or ''}"
+
+  if message.tool_call_id is not None or message.author.startswith(TOOL_PREFIX):
+    text = text[:TOOL_RESPONSE_MAX_CHARS]
+  for tool_call in message.tool_calls:
+    text += f"\n[called {tool_call.tool_name}({tool_call.arguments})]"
+  return f"{message.author}: {text.strip()}"
+
+
+class HistorySummarizer:
+  """Summarize the messages evicted from chat histories with a cheaper model.
+
+  The summary of a topic is updated with every block of evicted messages, and
+  is trimmed to `max_summary_tokens`, so it takes a fixed part of the history
+  budget no matter how long the topic is.
+  """
+
+  def __init__(self, openai_client: AsyncOpenAI, model_name: str, max_summary_tokens: int):
+    self.openai_client = openai_client
+    self.model_name = model_name
+    self.max_summary_tokens = max_summary_tokens
+
+  async def summarize(self, summary: Optional[str], messages: list[Message]) -> str:
+    """Return the summary updated with the messages."""
+
+    transcript = "\n".join(_format_message_for_summary(message) for message in messages)
+    content = f"Current summary:\n{summary}\n\n" if summary else ""
+    content += f"Removed messages:\n{transcript}"
+
+    response = await self.openai_client.chat.completions.create(
+      model=self.model_name,
+      messages=[
+        # About 0.75 words per token
+        {
+          "role": "system",
+          "content": SUMMARY_PROMPT.format(max_words=int(self.max_summary_tokens * 0.75)),
+        },
+        {"role": "user", "content": content},
+      ],
+      max_completion_tokens=self.max_summary_tokens,
+    )
+    new_summary = response.choices[0].message.content
+    if not new_summary:
+      raise Exception("Unexpected: summary is empty")
+
+    logger.info(
+      "summarized history: messages=%d summary_chars=%d",
+      len(messages),
+      len(new_summary),
+    )
+    return trim_by_token_size(new_summary, self.max_summary_tokens, "...")
@@ -0,0 +1,63 @@
+import importlib.util
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 10
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS_PER_HOST = 4
+DEFAULT_KEEPALIVE_EXPIRY_SEC = 60
+
+
+def is_http2_available() -> bool:
+  # httpx supports HTTP/2 only with the optional `h2` package (`httpx[http2]`)
+  return importlib.util.find_spec("h2") is not None
+
+
+class HttpClientRegistry:
+  """Process-wide HTTP clients for the outbound requests of tools and background jobs.
+
+  Every host gets its own `httpx.AsyncClient`, created on first use and reused
+  after that, so requests to the same host share kept-alive connections
+  instead of repeating the DNS lookup and the TCP and TLS handshakes. Separate
+  clients also make the connection limits per host. HTTP/2 is used when `h2`
+  is installed.
+  """
+
+  def __init__(
+    self,
+    max_connections_per_host: int = DEFAULT_MAX_CONNECTIONS_PER_HOST,
+    max_keepalive_connections_per_host: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS_PER_HOST,
+    keepalive_expiry_sec: float = DEFAULT_KEEPALIVE_EXPIRY_SEC,
+  ):
+    self.limits = httpx.Limits(
+      max_connections=max_connections_per_host,
+      max_keepalive_connections=max_keepalive_connections_per_host,
+      keepalive_expiry=keepalive_expiry_sec,
+    )
+    self.http2 = is_http2_available()
+    self._clients: dict[tuple[str, str, int | None], httpx.AsyncClient] = {}
+    self._is_closed = False
+
+  def get(self, url: str) -> httpx.AsyncClient:
+    """Get the client for the host of the URL."""
+
+    if self._is_closed:
+      raise RuntimeError("HTTP clients are closed")
+
+    parsed_url = httpx.URL(url)
+    key = (parsed_url.scheme, parsed_url.host, parsed_url.port)
+    client = self._clients.get(key)
+    if client is None:
+      client = httpx.AsyncClient(limits=self.limits, http2=self.http2)
+      self._clients[key] = client
+      logger.info("created HTTP client: host=%s http2=%s", parsed_url.host, self.http2)
+    return client
+
+  async def close(self) -> None:
+    self._is_closed = True
+    clients = list(self._clients.values())
+    self._clients.clear()
+    for client in clients:
+      await client.aclose()
@@ -0,0 +1,41 @@
+from typing import NamedTuple
+
+from telegram import PhotoSize
+
+from minerva.message_history import (
+  IMAGE_TILE_SIZE_PX,
+  ImageDetail,
+  get_image_token_count_for_size,
+)
+
+
+class PhotoSizeChoice(NamedTuple):
+  photo_size: PhotoSize
+  detail: ImageDetail
+  token_count: int
+
+
+def select_photo_size(photo_sizes: tuple[PhotoSize, ...], max_image_tokens: int) -> PhotoSizeChoice:
+  """Pick the Telegram photo size and detail level to send to the model.
+
+  Telegram provides every photo in several sizes. We pick the largest size
+  whose high detail token cost fits into `max_image_tokens`. Photos that fit
+  into a single tile are sent in low detail, because the model sees them at the
+  same resolution for a fraction of the tokens. If no size fits the budget, we
+  send the smallest size in low detail.
+  """
+
+  sorted_photo_sizes = sorted(photo_sizes, key=lambda p: p.width * p.height, reverse=True)
+  for photo_size in sorted_photo_sizes:
+    if photo_size.width <= IMAGE_TILE_SIZE_PX and photo_size.height <= IMAGE_TILE_SIZE_PX:
+      return _low_detail(photo_size)
+    token_count = get_image_token_count_for_size(photo_size.width, photo_size.height, "high")
+    if token_count <= max_image_tokens:
+      return PhotoSizeChoice(photo_size, "high", token_count)
+
+  return _low_detail(sorted_photo_sizes[-1])
+
+
+def _low_detail(photo_size: PhotoSize) -> PhotoSizeChoice:
+  token_count = get_image_token_count_for_size(photo_size.width, photo_size.height, "low")
+  return PhotoSizeChoice(photo_size, "low", token_count)
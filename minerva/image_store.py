@@ -0,0 +1,179 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Iterable, NamedTuple, Optional
+
+from minerva.config import IMAGE_STORE_DIR, IMAGE_STORE_MAX_MEMORY_MB
+
+logger = logging.getLogger(__name__)
+
+TMP_SUFFIX = ".tmp"
+
+
+class StoredImage(NamedTuple):
+  data: bytes
+  mime_type: str
+
+
+class ImageStore:
+  """Content-addressed storage for the images referenced by chat histories.
+
+  Histories keep only the image id, and the image is turned into a base64 data
+  URL only when a request to the model is sent. Every image is written to
+  `directory`, and the most recently used ones are also kept in memory, up to
+  `max_memory_bytes`. Identical images are stored once. If `directory` is not
+  set, a temporary directory is created on the first write.
+
+  Every `put` is a reference owned by the message that carries the image. The
+  message owner calls `release` when the message is dropped, and the image is
+  deleted once its last reference is released. File reads and writes run in a
+  worker thread, so they don't block the event loop.
+  """
+
+  def __init__(self, directory: Optional[str], max_memory_bytes: int):
+    self.directory = directory
+    self.max_memory_bytes = max_memory_bytes
+
+    # Ordered from the least to the most recently used
+    self._memory_cache: OrderedDict[str, StoredImage] = OrderedDict()
+    self._memory_cache_size_bytes = 0
+    self._ref_counts: dict[str, int] = {}
+    # Serializes the writes and deletes from the worker threads, so a delete
+    # can't remove an image that was stored again in the meantime
+    self._file_lock = threading.Lock()
+    self._delete_tasks: set[asyncio.Task[None]] = set()
+
+  async def put(self, data: bytes, mime_type: str) -> str:
+    """Store an image and return its id. The caller owns a reference to the image."""
+
+    image_id = f"{hashlib.sha256(data).hexdigest()}.{mime_type.removeprefix('image/')}"
+    self._ref_counts[image_id] = self._ref_counts.get(image_id, 0) + 1
+    await asyncio.to_thread(self._write, image_id, data)
+    self._cache(image_id, StoredImage(data, mime_type))
+    return image_id
+
+  async def get(self, image_id: str) -> Optional[StoredImage]:
+    """Get an image, or None if it's no longer stored."""
+
+    image = self._memory_cache.get(image_id)
+    if image is not None:
+      self._memory_cache.move_to_end(image_id)
+      return image
+
+    data = await asyncio.to_thread(self._read, image_id)
+    if data is None:
+      return None
+    image = StoredImage(data, f"image/{image_id.rsplit('.', 1)[-1]}")
+    self._cache(image_id, image)
+    return image
+
+  async def get_data_url(self, image_id: str) -> Optional[str]:
+    image = await self.get(image_id)
+    if image is None:
+      return None
+    return f"data:{image.mime_type};base64,{base64.b64encode(image.data).decode('utf-8')}"
+
+  def release(self, image_ids: Iterable[str]) -> None:
+    """Drop a reference to each image, deleting the images that are no longer referenced."""
+
+    for image_id in image_ids:
+      ref_count = self._ref_counts.get(image_id, 0) - 1
+      if ref_count > 0:
+        self._ref_counts[image_id] = ref_count
+        continue
+      self._ref_counts.pop(image_id, None)
+      cached_image = self._memory_cache.pop(image_id, None)
+      if cached_image is not None:
+        self._memory_cache_size_bytes -= len(cached_image.data)
+      task = asyncio.create_task(asyncio.to_thread(self._delete, image_id))
+      self._delete_tasks.add(task)
+      task.add_done_callback(self._delete_tasks.discard)
+
+  async def collect_garbage(self, image_ids: Iterable[str]) -> None:
+    """Set the references to the images left by a previous run, and delete the rest.
+
+    `image_ids` has an entry for every message that still references an image.
+    """
+
+    for image_id in image_ids:
+      self._ref_counts[image_id] = self._ref_counts.get(image_id, 0) + 1
+    deleted_count = await asyncio.to_thread(self._delete_unreferenced)
+    if deleted_count:
+      logger.info("Deleted %d unreferenced images", deleted_count)
+
+  async def close(self) -> None:
+    """Wait for the pending deletes."""
+
+    await asyncio.gather(*self._delete_tasks)
+
+  def _delete(self, image_id: str) -> None:
+    with self._file_lock:
+      # The image may have been stored again while the delete was waiting
+      if image_id in self._ref_counts or self.directory is None:
+        return
+      try:
+        os.remove(self._get_path(image_id))
+      except FileNotFoundError:
+        pass
+      except OSError:
+        logger.exception("Failed to delete image: %s", image_id)
+
+  def _write(self, image_id: str, data: bytes) -> None:
+    with self._file_lock:
+      if self.directory is None:
+        self.directory = tempfile.mkdtemp(prefix="minerva-images-")
+      else:
+        os.makedirs(self.directory, exist_ok=True)
+      path = self._get_path(image_id)
+      if os.path.exists(path):
+        return
+      tmp_path = f"{path}{TMP_SUFFIX}"
+      with open(tmp_path, "wb") as f:
+        f.write(data)
+      os.replace(tmp_path, path)
+
+  def _read(self, image_id: str) -> Optional[bytes]:
+    if self.directory is None:
+      return None
+    try:
+      with open(self._get_path(image_id), "rb") as f:
+        return f.read()
+    except FileNotFoundError:
+      return None
+
+  def _delete_unreferenced(self) -> int:
+    with self._file_lock:
+      if self.directory is None or not os.path.isdir(self.directory):
+        return 0
+      deleted_count = 0
+      for file_name in os.listdir(self.directory):
+        if file_name in self._ref_counts:
+          continue
+        os.remove(os.path.join(self.directory, file_name))
+        deleted_count += 1
+      return deleted_count
+
+  def _cache(self, image_id: str, image: StoredImage) -> None:
+    if image_id in self._memory_cache:
+      self._memory_cache.move_to_end(image_id)
+      return
+
+    self._memory_cache[image_id] = image
+    self._memory_cache_size_bytes += len(image.data)
+    while self._memory_cache_size_bytes > self.max_memory_bytes and len(self._memory_cache) > 1:
+      _, evicted_image = self._memory_cache.popitem(last=False)
+      self._memory_cache_size_bytes -= len(evicted_image.data)
+
+  def _get_path(self, image_id: str) -> str:
+    if os.path.basename(image_id) != image_id:
+      raise ValueError(f"Invalid image id: {image_id}")
+    assert self.directory is not None
+    return os.path.join(self.directory, image_id)
+
+
+IMAGE_STORE = ImageStore(IMAGE_STORE_DIR, IMAGE_STORE_MAX_MEMORY_MB * 1024 * 1024)
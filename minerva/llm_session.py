@@ -1,8 +1,44 @@
+import asyncio
+import hashlib
 import json
-from openai import AsyncOpenAI
+import logging
+from typing import Awaitable, Callable, Literal, NamedTuple, Optional
+from openai import AsyncOpenAI, NotGiven, Omit, not_given, omit
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletionMessageParam, ChatCompletionToolParam
 
-from minerva.format_chat_history_for_openai import format_chat_history_for_openai
-from minerva.message_history import Message, MessageHistory
+from minerva.config import LOG_FULL_HISTORY
+from minerva.deadline import Deadline
+
+from minerva.format_chat_history_for_openai import OpenAiChatPayload
+from minerva.history_store import TopicHistoryStore
+from minerva.history_summarizer import HistorySummarizer
+from minerva.image_store import IMAGE_STORE
+from minerva.message_history import Message, MessageHistory, NativeToolCall, get_image_ids
+from minerva.metrics import COMPLETION_TOKENS, PROMPT_TOKENS
+from minerva.tool_utils import format_tool_username
+
+logger = logging.getLogger(__name__)
+
+CANCELLED_TOOL_RESPONSE = "ERROR: The tool call was cancelled."
+
+
+def _short_hash(text: str) -> str:
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+
+
+def _get_cached_tokens(usage: Optional[CompletionUsage]) -> Optional[int]:
+  """The prompt tokens the provider served from its prompt cache."""
+
+  if usage is None or usage.prompt_tokens_details is None:
+    return None
+  return usage.prompt_tokens_details.cached_tokens
+
+
+class LlmResponse(NamedTuple):
+  answer: str
+  # Structured tool calls, only made when the session has `tools`
+  tool_calls: tuple[NativeToolCall, ...] = ()
 
 
 class LlmSession:
@@ -14,52 +50,292 @@ class LlmSession:
     max_completion_tokens: int,
     max_history_tokens: int,
     prompt: str,
+    history_store: Optional[TopicHistoryStore] = None,
+    tools: Optional[list[ChatCompletionToolParam]] = None,
+    eviction_block_ratio: float = 0,
+    prompt_cache_key: Optional[str] = None,
+    summarizer: Optional[HistorySummarizer] = None,
   ):
     self.ai_username = ai_username
     self.prompt = prompt
     self.max_completion_tokens = max_completion_tokens
     self.openai_client = openai_client
     self.openai_model_name = openai_model_name
+    # The summary of the evicted messages takes a fixed part of the history budget
+    if summarizer is not None:
+      max_history_tokens -= summarizer.max_summary_tokens
     self.history = MessageHistory(
       prompt_str=prompt,
       token_limit=max_history_tokens,
+      eviction_block_ratio=eviction_block_ratio,
     )
+    self.payload = OpenAiChatPayload(prompt, self.history)
+    self.prompt_hash = _short_hash(prompt)
+    self.history_store = history_store
+    # The tools the model can call through the API's structured tool calling
+    self.tools = tools
+    # Requests with the same key are routed to the same prompt cache
+    self.prompt_cache_key = prompt_cache_key
+    self.summarizer = summarizer
+    self.summary: Optional[str] = None
+    # The evicted messages waiting to be merged into the summary
+    self._messages_to_summarize: list[Message] = []
+    self._summarize_task: Optional[asyncio.Task[None]] = None
+    # The structured tool calls of the last model message still waiting for
+    # their responses, and the messages held back until they arrive
+    self._pending_tool_call_ids: set[str] = set()
+    self._held_back_messages: list[Message] = []
 
   def add_message(self, message: Message):
-    self.history.add(message)
+    """Add the message to the history.
+
+    The API requires the responses to structured tool calls right after the
+    call, so the other messages added while the calls are running, e.g. the
+    users' messages, are held back and added after the last response.
+    """
+
+    if self._pending_tool_call_ids and message.tool_call_id is None:
+      self._held_back_messages.append(message)
+      return
 
-  async def create_response(self, user_id: str) -> str:
+    self._add_message(message)
+    if message.tool_calls:
+      self._pending_tool_call_ids = {tool_call.call_id for tool_call in message.tool_calls}
+    elif message.tool_call_id is not None:
+      self._pending_tool_call_ids.discard(message.tool_call_id)
+      if not self._pending_tool_call_ids:
+        held_back_messages = self._held_back_messages
+        self._held_back_messages = []
+        for held_back_message in held_back_messages:
+          self.add_message(held_back_message)
+
+  def _add_message(self, message: Message):
+    evicted_messages = self.history.add(message)
+    if self.history_store is not None:
+      self.history_store.add(message)
+      if evicted_messages:
+        self.history_store.trim(keep_last=len(self.history.history))
+    IMAGE_STORE.release(get_image_ids(evicted_messages))
+    if evicted_messages and self.summarizer is not None:
+      self._messages_to_summarize.extend(evicted_messages)
+      if self._summarize_task is None:
+        self._summarize_task = asyncio.create_task(self._summarize_evicted_messages())
+
+  async def load_history(self):
+    """Restore the history from the history store."""
+
+    if self.history_store is None:
+      return
+    messages = await self.history_store.load()
+    evicted_messages: list[Message] = []
+    last_tool_call_message: Optional[Message] = None
+    unanswered_tool_calls: dict[str, NativeToolCall] = {}
+    for message in messages:
+      evicted_messages.extend(self.history.add(message))
+      if message.tool_calls:
+        last_tool_call_message = message
+        unanswered_tool_calls = {tool_call.call_id: tool_call for tool_call in message.tool_calls}
+      elif message.tool_call_id is not None:
+        unanswered_tool_calls.pop(message.tool_call_id, None)
+    # Don't load the messages that didn't fit again on the next restore
+    if evicted_messages:
+      self.history_store.trim(keep_last=len(self.history.history))
+      IMAGE_STORE.release(get_image_ids(evicted_messages))
+
+    # The responses are lost if we stopped in the middle of the tool calls, and
+    # the API rejects a history with unanswered calls
+    if last_tool_call_message in self.history.history:
+      for tool_call in unanswered_tool_calls.values():
+        self.add_message(
+          Message(
+            format_tool_username(tool_call.tool_name),
+            CANCELLED_TOOL_RESPONSE,
+            tool_call_id=tool_call.call_id,
+          )
+        )
+    if self.summarizer is not None:
+      self._set_summary(await self.history_store.load_summary())
+
+  def unload(self):
+    """Drop the session. Without a history store, its images are no longer referenced."""
+
+    if self.history_store is None:
+      IMAGE_STORE.release(get_image_ids(self.history.history))
+
+  async def wait_for_summary(self):
+    """Wait until the evicted messages are merged into the summary."""
+
+    if self._summarize_task is not None:
+      await asyncio.shield(self._summarize_task)
+
+  async def _summarize_evicted_messages(self):
+    """Merge the evicted messages into the summary, off the response path.
+
+    Messages evicted while a summary is being created are merged in the next
+    round, so there's at most one summary request per session at a time.
+    """
+
+    assert self.summarizer is not None
+    try:
+      while self._messages_to_summarize:
+        messages = self._messages_to_summarize
+        self._messages_to_summarize = []
+        try:
+          summary = await self.summarizer.summarize(self.summary, messages)
+        except Exception:
+          logger.exception("Failed to summarize %d evicted messages", len(messages))
+          continue
+        self._set_summary(summary)
+        if self.history_store is not None:
+          self.history_store.set_summary(summary)
+    finally:
+      self._summarize_task = None
+
+  def _set_summary(self, summary: Optional[str]):
+    self.summary = summary
+    self.payload.set_summary(summary)
+
+  async def create_response(
+    self,
+    user_id: str,
+    on_answer_update: Optional[Callable[[str], Awaitable[None]]] = None,
+    deadline: Optional[Deadline] = None,
+    allow_tools: bool = True,
+  ) -> LlmResponse:
     """
     Create a response from the model using the current history and prompt.
 
     Args:
       user_id (str): The id of the user that triggered the response creation.
+      on_answer_update (Callable[[str], Awaitable[None]], optional): If provided, the
+        response is streamed and the callback is called with the accumulated answer
+        every time a new part of it arrives.
+      deadline (Deadline, optional): If provided, the request times out when the
+        deadline passes.
+      allow_tools (bool): If False, the model has to answer without calling tools.
 
     Returns:
-      str: The model's response.
+      LlmResponse: The model's answer and the tools it called.
     """
 
-    print(f"OpenAPI prompt:\n{self.prompt}\n\n")
-    messages = format_chat_history_for_openai(self.prompt, self.history)
-    print(f"Chat history:\n{json.dumps(messages, indent=2)}\n\n")
-
-    response = await self.openai_client.chat.completions.create(
-      model=self.openai_model_name,
-      messages=messages,
-      temperature=1,
-      max_completion_tokens=self.max_completion_tokens,
-      user=user_id,
+    messages = await self.payload.get_messages()
+    logger.info(
+      "openai request: user=%s prompt_hash=%s prompt_chars=%d messages=%d history_tokens=%d",
+      user_id,
+      self.prompt_hash,
+      len(self.prompt),
+      len(messages),
+      self.history.current_tokens,
     )
+    if LOG_FULL_HISTORY and logger.isEnabledFor(logging.DEBUG):
+      logger.debug("OpenAI prompt:\n%s", self.prompt)
+      logger.debug("Chat history:\n%s", json.dumps(messages, indent=2))
+
+    timeout: float | NotGiven = deadline.remaining_sec() if deadline is not None else not_given
+    # The tools stay in the request even if not allowed, the history may have their calls
+    tool_choice: Literal["none"] | Omit = "none" if self.tools and not allow_tools else omit
+
+    tool_calls: tuple[NativeToolCall, ...] = ()
+    if on_answer_update is None:
+      response = await self.openai_client.chat.completions.create(
+        model=self.openai_model_name,
+        messages=messages,
+        temperature=1,
+        max_completion_tokens=self.max_completion_tokens,
+        user=user_id,
+        tools=self.tools or omit,
+        tool_choice=tool_choice,
+        timeout=timeout,
+        prompt_cache_key=self.prompt_cache_key or omit,
+      )
+      response_message = response.choices[0].message
+      answer = response_message.content or ""
+      tool_calls = tuple(
+        NativeToolCall(tool_call.id, tool_call.function.name, tool_call.function.arguments)
+        for tool_call in response_message.tool_calls or []
+        if tool_call.type == "function"
+      )
+      usage = response.usage
+    else:
+      answer, tool_calls, usage = await self._create_streamed_answer(
+        messages, user_id, on_answer_update, tool_choice, timeout
+      )
 
-    answer = response.choices[0].message.content
-    if not answer:
+    if not answer and not tool_calls:
       raise Exception("Unexpected: OpenAI response is empty")
 
+    cached_tokens = _get_cached_tokens(usage)
+    logger.info(
+      "openai response: user=%s answer_hash=%s answer_chars=%d tool_calls=%d prompt_tokens=%s"
+      " cached_tokens=%s completion_tokens=%s",
+      user_id,
+      _short_hash(answer),
+      len(answer),
+      len(tool_calls),
+      usage.prompt_tokens if usage else None,
+      cached_tokens,
+      usage.completion_tokens if usage else None,
+    )
+    if usage is not None:
+      PROMPT_TOKENS.inc("hit", amount=cached_tokens or 0)
+      PROMPT_TOKENS.inc("miss", amount=usage.prompt_tokens - (cached_tokens or 0))
+      COMPLETION_TOKENS.inc(amount=usage.completion_tokens)
+
     self.add_message(
       Message(
         author=self.ai_username,
         content=answer,
+        tool_calls=tool_calls,
       )
     )
 
-    return answer
+    return LlmResponse(answer, tool_calls)
+
+  async def _create_streamed_answer(
+    self,
+    messages: list[ChatCompletionMessageParam],
+    user_id: str,
+    on_answer_update: Callable[[str], Awaitable[None]],
+    tool_choice: Literal["none"] | Omit,
+    timeout: float | NotGiven,
+  ) -> tuple[str, tuple[NativeToolCall, ...], Optional[CompletionUsage]]:
+    stream = await self.openai_client.chat.completions.create(
+      model=self.openai_model_name,
+      messages=messages,
+      temperature=1,
+      max_completion_tokens=self.max_completion_tokens,
+      user=user_id,
+      stream=True,
+      stream_options={"include_usage": True},
+      tools=self.tools or omit,
+      tool_choice=tool_choice,
+      timeout=timeout,
+      prompt_cache_key=self.prompt_cache_key or omit,
+    )
+
+    answer = ""
+    # Tool calls arrive in fragments, keyed by their index in the response
+    tool_call_parts: dict[int, list[str]] = {}
+    usage: Optional[CompletionUsage] = None
+    async for chunk in stream:
+      if chunk.usage is not None:
+        usage = chunk.usage
+      if not chunk.choices:
+        continue
+      delta = chunk.choices[0].delta
+      for tool_call_delta in delta.tool_calls or []:
+        # [call id, tool name, arguments]
+        parts = tool_call_parts.setdefault(tool_call_delta.index, ["", "", ""])
+        if tool_call_delta.id:
+          parts[0] = tool_call_delta.id
+        if tool_call_delta.function and tool_call_delta.function.name:
+          parts[1] += tool_call_delta.function.name
+        if tool_call_delta.function and tool_call_delta.function.arguments:
+          parts[2] += tool_call_delta.function.arguments
+      if not delta.content:
+        continue
+      answer += delta.content
+      await on_answer_update(answer)
+
+    tool_calls = tuple(NativeToolCall(*tool_call_parts[index]) for index in sorted(tool_call_parts))
+    return answer, tool_calls, usage
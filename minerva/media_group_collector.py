@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from telegram import Message as TelegramMessage
+
+logger = logging.getLogger(__name__)
+
+
+class MediaGroupCollector:
+  """Collect the messages of Telegram media groups (albums).
+
+  Telegram delivers every photo of an album as a separate message sharing the
+  same `media_group_id`. The collector buffers them until no new message of the
+  group arrives for `wait_sec`, and then passes the whole group, ordered by
+  message id, to `on_media_group` at once.
+  """
+
+  def __init__(
+    self,
+    on_media_group: Callable[[list[TelegramMessage]], Awaitable[None]],
+    wait_sec: float,
+  ):
+    self.on_media_group = on_media_group
+    self.wait_sec = wait_sec
+
+    self._media_groups: dict[str, list[TelegramMessage]] = {}
+    self._flush_tasks: dict[str, asyncio.Task[None]] = {}
+
+  def add(self, message: TelegramMessage) -> None:
+    media_group_id = message.media_group_id
+    if media_group_id is None:
+      raise ValueError("Unexpected: message is not a part of a media group")
+
+    self._media_groups.setdefault(media_group_id, []).append(message)
+    flush_task = self._flush_tasks.get(media_group_id)
+    if flush_task is not None:
+      flush_task.cancel()
+    self._flush_tasks[media_group_id] = asyncio.create_task(self._flush(media_group_id))
+
+  async def _flush(self, media_group_id: str) -> None:
+    await asyncio.sleep(self.wait_sec)
+    del self._flush_tasks[media_group_id]
+    messages = sorted(self._media_groups.pop(media_group_id), key=lambda m: m.message_id)
+    try:
+      await self.on_media_group(messages)
+    except Exception:
+      logger.exception("Failed to handle media group %s", media_group_id)
@@ -1,24 +1,58 @@
-from typing import List, NamedTuple, Optional, Union
+import math
+import threading
+from collections import deque
+from typing import Any, Deque, Iterable, Literal, NamedTuple, Optional, Union
 
 import tiktoken
+from openai.types.chat import ChatCompletionMessageParam
 
 from minerva.config import OPENAI_MODEL
 
-TOKENIZER = (
-  tiktoken.get_encoding("o200k_base")
-  if OPENAI_MODEL == "gpt-4.1"
-  or OPENAI_MODEL.startswith("gpt-4.1-")
-  or OPENAI_MODEL == "gpt-5"
-  or OPENAI_MODEL.startswith("gpt-5-")
-  or OPENAI_MODEL.startswith("gpt-5.")
-  else tiktoken.encoding_for_model(OPENAI_MODEL)
-)
+
+def get_encoding_name(model: str) -> str:
+  if (
+    model == "gpt-4.1"
+    or model.startswith("gpt-4.1-")
+    or model == "gpt-5"
+    or model.startswith("gpt-5-")
+    or model.startswith("gpt-5.")
+  ):
+    return "o200k_base"
+  return tiktoken.encoding_name_for_model(model)
+
+
+_tokenizer: Optional[tiktoken.Encoding] = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer() -> tiktoken.Encoding:
+  """Load the tokenizer of the configured model on first use.
+
+  Loading the encoding may download and build the BPE ranks, so we don't do it
+  at import time. The app loads it from a worker thread on startup, the lock
+  makes the concurrent first calls wait for that load instead of repeating it.
+  Point `TIKTOKEN_CACHE_DIR` to a directory with pre-baked encoding files to
+  avoid the download altogether.
+  """
+
+  global _tokenizer
+  if _tokenizer is None:
+    with _tokenizer_lock:
+      if _tokenizer is None:
+        _tokenizer = tiktoken.get_encoding(get_encoding_name(OPENAI_MODEL))
+  return _tokenizer
+
+
+ImageDetail = Literal["low", "high", "auto"]
 
 
 class Image(NamedTuple):
-  url: str
+  # The id of the image in the `ImageStore`
+  image_id: str
   height_px: int
   width_px: int
+  size_bytes: int
+  detail: ImageDetail = "auto"
 
 
 class ImageContent(NamedTuple):
@@ -29,47 +63,315 @@ class ImageContent(NamedTuple):
 ContentType = Union[str, ImageContent]
 
 
-# It's a pessimistic image token size computation assuming the "auto" gpt-4o
-# image detail mode
+class NativeToolCall(NamedTuple):
+  """A structured tool call made by the model through the API."""
+
+  # Assigned by the API, the tool response references the call by it
+  call_id: str
+  tool_name: str
+  # The JSON object with the arguments, as generated by the model
+  arguments: str
+
+
+LOW_DETAIL_IMAGE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+IMAGE_TILE_SIZE_PX = 512
+HIGH_DETAIL_MAX_SIZE_PX = 2048
+HIGH_DETAIL_SHORT_SIDE_PX = 768
+
+
+def get_image_token_count_for_size(width_px: int, height_px: int, detail: ImageDetail) -> int:
+  """Compute the image token count following the OpenAI vision pricing rules.
+
+  The "auto" detail is counted as "high" to stay pessimistic.
+  """
+
+  if detail == "low":
+    return LOW_DETAIL_IMAGE_TOKENS
+
+  # The image is scaled down to fit into a 2048x2048 square, and then scaled
+  # down further so that its shortest side is at most 768px
+  width, height = float(width_px), float(height_px)
+  if max(width, height) > HIGH_DETAIL_MAX_SIZE_PX:
+    scale = HIGH_DETAIL_MAX_SIZE_PX / max(width, height)
+    width, height = width * scale, height * scale
+  if min(width, height) > HIGH_DETAIL_SHORT_SIDE_PX:
+    scale = HIGH_DETAIL_SHORT_SIDE_PX / min(width, height)
+    width, height = width * scale, height * scale
+
+  tiles = math.ceil(width / IMAGE_TILE_SIZE_PX) * math.ceil(height / IMAGE_TILE_SIZE_PX)
+  return LOW_DETAIL_IMAGE_TOKENS + IMAGE_TILE_TOKENS * tiles
+
+
 def get_image_token_count(image: Image) -> int:
-  if image.width_px <= 512 and image.height_px <= 512:
-    return 85
-  max_tiles = (image.width_px // 512) * (image.height_px // 512)
-  return 85 + 170 * max_tiles
+  return get_image_token_count_for_size(image.width_px, image.height_px, image.detail)
 
 
-def get_message_token_count(author: str, content: ContentType) -> int:
+def _get_message_text(
+  author: str, content: ContentType, tool_calls: tuple[NativeToolCall, ...] = ()
+) -> str:
+  text = f"{author}: {content}" if isinstance(content, str) else f"{author}: {content.text or ''}"
+  for tool_call in tool_calls:
+    text += f"\n{tool_call.tool_name}({tool_call.arguments})"
+  return text
+
+
+def _get_message_image_token_count(content: ContentType) -> int:
   if isinstance(content, str):
-    return len(TOKENIZER.encode(f"{author}: {content}"))
-  else:
-    text_tokens = len(TOKENIZER.encode(f"{author}: {content.text or ''}"))
-    image_tokens = sum(get_image_token_count(image) for image in content.images)
-    return text_tokens + image_tokens
+    return 0
+  return sum(get_image_token_count(image) for image in content.images)
+
+
+def get_message_token_count(
+  author: str, content: ContentType, tool_calls: tuple[NativeToolCall, ...] = ()
+) -> int:
+  text_tokens = len(get_tokenizer().encode(_get_message_text(author, content, tool_calls)))
+  return text_tokens + _get_message_image_token_count(content)
+
+
+def get_message_max_token_count(
+  author: str, content: ContentType, tool_calls: tuple[NativeToolCall, ...] = ()
+) -> int:
+  """Cheaply bound the message token count from above without tokenizing it.
+
+  Every token is at least one byte long, so the text never has more tokens than
+  UTF-8 bytes. For English text the bound is about 4 times the real count.
+  """
+
+  text_max_tokens = len(_get_message_text(author, content, tool_calls).encode("utf-8"))
+  return text_max_tokens + _get_message_image_token_count(content)
+
+
+def get_message_size_bytes(author: str, content: ContentType) -> int:
+  """Approximate the memory held by the message contents, including the images it references.
+
+  Text is counted by its UTF-8 size, so non-Latin text isn't undercounted.
+  """
+
+  if isinstance(content, str):
+    return _get_utf8_size(author) + _get_utf8_size(content)
+  return (
+    _get_utf8_size(author)
+    + _get_utf8_size(content.text or "")
+    + sum(image.size_bytes for image in content.images)
+  )
+
+
+def _get_utf8_size(text: str) -> int:
+  return len(text.encode("utf-8"))
+
+
+def get_image_ids(messages: Iterable["Message"]) -> list[str]:
+  """The ids of the images referenced by the messages, once per reference."""
+
+  return [
+    image.image_id
+    for message in messages
+    if not isinstance(message.content, str)
+    for image in message.content.images
+  ]
 
 
 class Message:
-  def __init__(self, author: str, content: ContentType):
+  def __init__(
+    self,
+    author: str,
+    content: ContentType,
+    len_tokens: Optional[int] = None,
+    tool_calls: tuple[NativeToolCall, ...] = (),
+    tool_call_id: Optional[str] = None,
+  ):
     self.author = author
     self.content = content
-    self.len_tokens = get_message_token_count(author, content)
+    # Set on model messages that call tools through the API
+    self.tool_calls = tool_calls
+    # Set on tool responses to calls made through the API
+    self.tool_call_id = tool_call_id
+    # `len_tokens` can be passed when restoring a message that was counted before
+    self._len_tokens = len_tokens
+    # The exact token count once it's known, and an upper bound before that
+    self.max_len_tokens = (
+      len_tokens
+      if len_tokens is not None
+      else get_message_max_token_count(author, content, tool_calls)
+    )
+    self.size_bytes = get_message_size_bytes(author, content)
+    self.image_tokens = _get_message_image_token_count(content)
+    # Populated by `format_message_for_openai` on first use
+    self.openai_message: Optional[ChatCompletionMessageParam] = None
+
+  @property
+  def len_tokens(self) -> int:
+    """The exact token count, the message is tokenized on first use."""
+
+    if self._len_tokens is None:
+      self._len_tokens = get_message_token_count(self.author, self.content, self.tool_calls)
+      self.max_len_tokens = self._len_tokens
+    return self._len_tokens
+
+  @property
+  def is_counted(self) -> bool:
+    return self._len_tokens is not None
 
 
 class MessageHistory:
-  def __init__(self, prompt_str: str, token_limit: int):
+  """The chat history trimmed to `token_limit` by evicting the oldest messages.
+
+  Tokenizing every message is expensive, so messages are admitted using an
+  upper bound of their token count (see `get_message_max_token_count`). Only
+  when the bounds add up to more than the limit, the messages are counted
+  exactly, and then the oldest ones are evicted if the history is still over
+  the limit. Every message is tokenized at most once. `current_tokens` is the
+  sum of the exact counts and the bounds of the not yet counted messages.
+
+  With `eviction_block_ratio`, the history evicts in blocks instead of one
+  message at a time: once over the limit, it drops the oldest messages until
+  the history is `eviction_block_ratio` of the limit below it. The beginning
+  of the history then stays the same for the following requests, which lets
+  the provider reuse its cache of the prompt prefix.
+  """
+
+  def __init__(self, prompt_str: str, token_limit: int, eviction_block_ratio: float = 0):
+    if not 0 <= eviction_block_ratio < 1:
+      raise ValueError("eviction_block_ratio must be in [0, 1)")
     self.token_limit = token_limit
-    self.history: List[Message] = []
-    self.current_tokens = len(TOKENIZER.encode(prompt_str))
+    self.eviction_block_ratio = eviction_block_ratio
+    # A deque lets us evict the oldest messages in O(1) instead of shifting
+    # the whole list on every eviction
+    self.history: Deque[Message] = deque()
+    self.current_tokens = len(get_tokenizer().encode(prompt_str))
+    self.current_size_bytes = 0
+    # The part of `current_tokens` taken by images
+    self.current_image_tokens = 0
+    # The messages that are accounted by their upper bound in `current_tokens`
+    self._uncounted_messages: list[tuple[Message, int]] = []
+    # Monotonic counters that let consumers sync with the history incrementally
+    self.added_count = 0
+    self.evicted_count = 0
+
+  def add(self, message: Message) -> list[Message]:
+    """Add the message and return the messages evicted to make room for it."""
 
-  def add(self, message: Message):
     self.history.append(message)
-    self.current_tokens += message.len_tokens
-    while self.current_tokens > self.token_limit:
-      deleted_message = self.history.pop(0)
-      self.current_tokens -= deleted_message.len_tokens
+    self.added_count += 1
+    self.current_tokens += message.max_len_tokens
+    self.current_size_bytes += message.size_bytes
+    self.current_image_tokens += message.image_tokens
+    if not message.is_counted:
+      self._uncounted_messages.append((message, message.max_len_tokens))
+    if self.current_tokens <= self.token_limit:
+      return []
+
+    self._count_messages()
+    if self.current_tokens <= self.token_limit:
+      return []
+    target_tokens = int(self.token_limit * (1 - self.eviction_block_ratio))
+    evicted_messages: list[Message] = []
+    while self.current_tokens > target_tokens and self.history:
+      deleted_message = self._evict_oldest()
+      evicted_messages.append(deleted_message)
+      # Responses to structured tool calls are not valid without the call
+      for _ in range(self._get_tool_responses_end(deleted_message)):
+        evicted_messages.append(self._evict_oldest())
+    return evicted_messages
+
+  def _get_tool_responses_end(self, message: Message) -> int:
+    """How many of the oldest messages to evict to drop the responses to the message's tool calls.
+
+    The responses usually follow the call right away, but histories stored
+    before the other messages were held back during the calls can have
+    messages in between.
+    """
+
+    call_ids = {tool_call.call_id for tool_call in message.tool_calls}
+    end = 0
+    for i, history_message in enumerate(self.history):
+      if not call_ids:
+        break
+      if history_message.tool_call_id in call_ids:
+        call_ids.discard(history_message.tool_call_id)
+        end = i + 1
+      elif history_message.tool_calls:
+        # The responses to the next call can't answer this one
+        break
+    return end
+
+  def _evict_oldest(self) -> Message:
+    deleted_message = self.history.popleft()
+    self.evicted_count += 1
+    self.current_tokens -= deleted_message.len_tokens
+    self.current_size_bytes -= deleted_message.size_bytes
+    self.current_image_tokens -= deleted_message.image_tokens
+    return deleted_message
+
+  def _count_messages(self):
+    for message, max_len_tokens in self._uncounted_messages:
+      self.current_tokens += message.len_tokens - max_len_tokens
+    self._uncounted_messages.clear()
+
+
+def message_to_dict(message: Message) -> dict[str, Any]:
+  content: Any
+  if isinstance(message.content, str):
+    content = message.content
+  else:
+    content = {
+      "images": [image._asdict() for image in message.content.images],
+      "text": message.content.text,
+    }
+  data: dict[str, Any] = {
+    "author": message.author,
+    "content": content,
+    # Don't tokenize the message just to store it, it's counted on load if needed
+    "len_tokens": message.len_tokens if message.is_counted else None,
+  }
+  if message.tool_calls:
+    data["tool_calls"] = [tool_call._asdict() for tool_call in message.tool_calls]
+  if message.tool_call_id is not None:
+    data["tool_call_id"] = message.tool_call_id
+  return data
+
+
+def message_from_dict(data: dict[str, Any]) -> Message:
+  content: ContentType
+  if isinstance(data["content"], str):
+    content = data["content"]
+  else:
+    content = ImageContent(
+      images=[Image(**image) for image in data["content"]["images"]],
+      text=data["content"]["text"],
+    )
+  return Message(
+    data["author"],
+    content,
+    len_tokens=data.get("len_tokens"),
+    tool_calls=tuple(NativeToolCall(**tool_call) for tool_call in data.get("tool_calls", [])),
+    tool_call_id=data.get("tool_call_id"),
+  )
+
+
+# English text is about 4 characters per token
+TRIM_PREFIX_CHARS_PER_TOKEN = 5
+TRIM_MARGIN_TOKENS = 16
 
 
 def trim_by_token_size(message: str, token_limit: int, trimmed_suffix: str = "") -> str:
-  tokens = TOKENIZER.encode(message)
+  # Every token is at least one byte long, so there is nothing to trim
+  if len(message.encode("utf-8")) <= token_limit:
+    return message
+
+  # Tool responses can be huge, so we encode only a prefix that is long enough
+  # to contain `token_limit` tokens, growing it if needed. The last tokens of a
+  # prefix may differ from the tokens of the full message, so we require a few
+  # extra tokens beyond the limit.
+  tokenizer = get_tokenizer()
+  prefix_len = token_limit * TRIM_PREFIX_CHARS_PER_TOKEN
+  while True:
+    tokens = tokenizer.encode(message[:prefix_len])
+    if prefix_len >= len(message) or len(tokens) > token_limit + TRIM_MARGIN_TOKENS:
+      break
+    prefix_len *= 2
+
   if len(tokens) <= token_limit:
     return message
-  return TOKENIZER.decode(tokens[:token_limit]) + trimmed_suffix
+  return tokenizer.decode(tokens[:token_limit]) + trimmed_suffix
@@ -0,0 +1,253 @@
+import bisect
+import contextlib
+import threading
+import time
+from typing import Generator
+
+# Response and tool latencies range from milliseconds to minutes
+DEFAULT_BUCKETS_SEC = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class _Metric:
+  type_name = ""
+
+  def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()):
+    self.name = name
+    self.description = description
+    self.label_names = label_names
+    self._lock = threading.Lock()
+    REGISTRY.append(self)
+
+  def _check_labels(self, label_values: tuple[str, ...]) -> None:
+    if len(label_values) != len(self.label_names):
+      raise ValueError(f"{self.name} expects labels: {', '.join(self.label_names)}")
+
+  def _format_labels(self, label_values: tuple[str, ...], extra: str = "") -> str:
+    labels = [
+      f'{name}="{_escape_label_value(value)}"'
+      for name, value in zip(self.label_names, label_values)
+    ]
+    if extra:
+      labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+  def format(self) -> list[str]:
+    """Render the metric in the Prometheus text format."""
+
+    return [
+      f"# HELP {self.name} {self.description}",
+      f"# TYPE {self.name} {self.type_name}",
+      *self._format_samples(),
+    ]
+
+  def _format_samples(self) -> list[str]:
+    raise NotImplementedError
+
+
+class Counter(_Metric):
+  """A monotonically increasing value, split by the values of its labels."""
+
+  type_name = "counter"
+
+  def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()):
+    super().__init__(name, description, label_names)
+    self._values: dict[tuple[str, ...], float] = {}
+
+  def inc(self, *label_values: str, amount: float = 1) -> None:
+    self._check_labels(label_values)
+    with self._lock:
+      self._values[label_values] = self._values.get(label_values, 0) + amount
+
+  def get(self, *label_values: str) -> float:
+    return self._values.get(label_values, 0)
+
+  def get_values(self) -> dict[tuple[str, ...], float]:
+    with self._lock:
+      return dict(self._values)
+
+  def _format_samples(self) -> list[str]:
+    return [
+      f"{self.name}{self._format_labels(labels)} {_format_value(value)}"
+      for labels, value in sorted(self.get_values().items())
+    ]
+
+
+class Gauge(_Metric):
+  """A value that goes up and down, split by the values of its labels.
+
+  Gauges that mirror some state are usually refreshed right before they are
+  exported, see `MetricsServer`.
+  """
+
+  type_name = "gauge"
+
+  def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()):
+    super().__init__(name, description, label_names)
+    self._values: dict[tuple[str, ...], float] = {}
+
+  def set(self, *label_values: str, value: float) -> None:
+    self._check_labels(label_values)
+    with self._lock:
+      self._values[label_values] = value
+
+  def clear(self) -> None:
+    """Drop all values, e.g. of the topics that are gone."""
+
+    with self._lock:
+      self._values.clear()
+
+  def get(self, *label_values: str) -> float:
+    return self._values.get(label_values, 0)
+
+  def _format_samples(self) -> list[str]:
+    with self._lock:
+      values = sorted(self._values.items())
+    return [f"{self.name}{self._format_labels(labels)} {_format_value(v)}" for labels, v in values]
+
+
+class _HistogramValue:
+  def __init__(self, bucket_count: int):
+    # Not cumulative, the last bucket is +Inf
+    self.bucket_counts = [0] * (bucket_count + 1)
+    self.sum = 0.0
+    self.count = 0
+
+
+class Histogram(_Metric):
+  """The distribution of observed values in buckets, split by the values of its labels."""
+
+  type_name = "histogram"
+
+  def __init__(
+    self,
+    name: str,
+    description: str,
+    label_names: tuple[str, ...] = (),
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS_SEC,
+  ):
+    super().__init__(name, description, label_names)
+    self.buckets = buckets
+    self._values: dict[tuple[str, ...], _HistogramValue] = {}
+
+  def observe(self, *label_values: str, value: float) -> None:
+    self._check_labels(label_values)
+    with self._lock:
+      histogram_value = self._values.get(label_values)
+      if histogram_value is None:
+        histogram_value = self._values[label_values] = _HistogramValue(len(self.buckets))
+      histogram_value.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+      histogram_value.sum += value
+      histogram_value.count += 1
+
+  @contextlib.contextmanager
+  def time(self, *label_values: str) -> Generator[None, None, None]:
+    """Observe the duration of the block in seconds, even if it raises."""
+
+    started_at = time.monotonic()
+    try:
+      yield
+    finally:
+      self.observe(*label_values, value=time.monotonic() - started_at)
+
+  def get_count(self, *label_values: str) -> int:
+    histogram_value = self._values.get(label_values)
+    return histogram_value.count if histogram_value else 0
+
+  def _format_samples(self) -> list[str]:
+    with self._lock:
+      values = sorted(
+        (labels, list(v.bucket_counts), v.sum, v.count) for labels, v in self._values.items()
+      )
+    samples: list[str] = []
+    for labels, bucket_counts, value_sum, count in values:
+      cumulative_count = 0
+      for bound, bucket_count in zip((*self.buckets, float("inf")), bucket_counts):
+        cumulative_count += bucket_count
+        le = f'le="{_format_value(bound)}"'
+        samples.append(f"{self.name}_bucket{self._format_labels(labels, le)} {cumulative_count}")
+      samples.append(f"{self.name}_sum{self._format_labels(labels)} {_format_value(value_sum)}")
+      samples.append(f"{self.name}_count{self._format_labels(labels)} {count}")
+    return samples
+
+
+def _escape_label_value(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+  if value == float("inf"):
+    return "+Inf"
+  if float(value).is_integer():
+    return str(int(value))
+  return repr(float(value))
+
+
+REGISTRY: list[_Metric] = []
+
+
+def format_metrics() -> str:
+  """Render all metrics in the Prometheus text exposition format."""
+
+  lines: list[str] = []
+  for metric in REGISTRY:
+    lines.extend(metric.format())
+  return "\n".join(lines) + "\n"
+
+
+# `mode` is "text" for the "Action: ..." protocol and "native" for the API's
+# structured tool calls. `stage` is what failed to parse: the "action" header
+# or the "tool_call" itself.
+TOOL_CALL_PARSE_FAILURES = Counter(
+  "minerva_tool_call_parse_failures_total",
+  "Model messages or tool calls that failed to parse",
+  ("mode", "stage"),
+)
+RESPONSE_RETRIES = Counter(
+  "minerva_response_retries_total",
+  "Extra model requests made because the previous answer failed to parse",
+  ("mode",),
+)
+# `cache` is "hit" for the prompt tokens served from the provider's prompt
+# cache and "miss" for the rest
+PROMPT_TOKENS = Counter(
+  "minerva_prompt_tokens_total",
+  "Prompt tokens sent to the model",
+  ("cache",),
+)
+COMPLETION_TOKENS = Counter(
+  "minerva_completion_tokens_total",
+  "Completion tokens generated by the model",
+)
+TOOL_USE_LIMIT_REACHED = Counter(
+  "minerva_tool_use_limit_reached_total",
+  "Responses that reached the tool use limit",
+  ("mode",),
+)
+RESPONSE_DURATION = Histogram(
+  "minerva_response_duration_seconds",
+  "The time from scheduling a response until it's sent, including all model and tool calls",
+  ("chat", "topic"),
+)
+MODEL_REQUEST_DURATION = Histogram(
+  "minerva_model_request_duration_seconds",
+  "The duration of a single model request",
+  ("chat", "topic"),
+)
+TOOL_CALL_DURATION = Histogram(
+  "minerva_tool_call_duration_seconds",
+  "The duration of a tool call, including the wait for its concurrency limit",
+  ("tool", "outcome"),
+)
+TELEGRAM_SEND_DURATION = Histogram(
+  "minerva_telegram_send_duration_seconds",
+  "The duration of a Telegram API call that sends, edits or deletes a message",
+  ("method",),
+)
+CHAT_SESSIONS = Gauge("minerva_chat_sessions", "Chat sessions in memory", ("chat",))
+HISTORY_MESSAGES = Gauge(
+  "minerva_history_messages", "Messages in the topic history", ("chat", "topic")
+)
+HISTORY_TOKENS = Gauge("minerva_history_tokens", "Tokens in the topic history", ("chat", "topic"))
+HISTORY_SIZE_BYTES = Gauge(
+  "minerva_history_size_bytes", "Memory used by the topic history", ("chat", "topic")
+)
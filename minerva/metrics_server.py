@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from minerva.metrics import format_metrics
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Scrapers send small requests, anything bigger or slower is not one of them
+MAX_REQUEST_HEADER_BYTES = 16 * 1024
+REQUEST_TIMEOUT_SEC = 5
+
+
+class MetricsServer:
+  """Serve the metrics in the Prometheus text format on `GET /metrics`.
+
+  A minimal HTTP/1.0 server on top of `asyncio.start_server`, so that we don't
+  need a web framework for a single endpoint. `on_collect` is called before
+  every scrape to refresh the gauges that mirror some state.
+  """
+
+  def __init__(self, host: str, port: int, on_collect: Optional[Callable[[], None]] = None):
+    self.host = host
+    self.port = port
+    self.on_collect = on_collect
+    self._server: Optional[asyncio.Server] = None
+
+  async def start(self) -> None:
+    self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+    # Port 0 picks a free port
+    self.port = self._server.sockets[0].getsockname()[1]
+    logger.info("serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+  async def close(self) -> None:
+    if self._server is None:
+      return
+    self._server.close()
+    await self._server.wait_closed()
+    self._server = None
+
+  async def _handle_connection(
+    self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+  ) -> None:
+    try:
+      async with asyncio.timeout(REQUEST_TIMEOUT_SEC):
+        request_line = await reader.readuntil(b"\r\n")
+        # Skip the headers, we don't need any of them
+        header_bytes = 0
+        while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+          header_bytes += len(line)
+          if header_bytes > MAX_REQUEST_HEADER_BYTES:
+            raise ValueError("Request headers are too large")
+
+      method, path, *_ = request_line.decode("latin-1").split(" ")
+      if method != "GET" or path.split("?")[0] != "/metrics":
+        await self._respond(writer, "404 Not Found", "Not found\n")
+        return
+      if self.on_collect is not None:
+        self.on_collect()
+      await self._respond(writer, "200 OK", format_metrics())
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, TimeoutError, ValueError):
+      pass
+    except Exception:
+      logger.exception("Failed to serve metrics")
+    finally:
+      writer.close()
+
+  async def _respond(self, writer: asyncio.StreamWriter, status: str, body: str) -> None:
+    body_bytes = body.encode("utf-8")
+    writer.write(
+      f"HTTP/1.0 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+      f"Content-Length: {len(body_bytes)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+      + body_bytes
+    )
+    await writer.drain()
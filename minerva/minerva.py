@@ -1,4 +1,5 @@
-from typing import cast
+import asyncio
+from typing import Awaitable, Callable, Optional, cast
 
 from openai import AsyncOpenAI
 
@@ -17,79 +18,211 @@ from telegram.ext import (
   ChatMemberHandler,
 )
 
+from minerva.chat_config import CALENDAR_TOOL_NAME, ChatConfig
 from minerva.chat_session import ChatSession
+from minerva.chat_session_pool import ChatSessionPool
 from minerva.get_image_from_telegram_photo import get_image_from_telegram_photo
-from minerva.config import AI_NAME, CALENDAR_ICS_URL
-from minerva.message_history import ImageContent, Message
+from minerva.history_store import HistoryStore, SqliteHistoryStore
+from minerva.history_summarizer import HistorySummarizer
+from minerva.image_store import IMAGE_STORE
+from minerva.http_client import HttpClientRegistry
+from minerva.media_group_collector import MediaGroupCollector
+from minerva.metrics import (
+  CHAT_SESSIONS,
+  HISTORY_MESSAGES,
+  HISTORY_SIZE_BYTES,
+  HISTORY_TOKENS,
+)
+from minerva.metrics_server import MetricsServer
+from minerva.config import (
+  AI_NAME,
+  CALENDAR_REFETCH_INTERVAL_MIN,
+  CHAT_SESSIONS_IDLE_TTL_MIN,
+  CHAT_SESSIONS_MAX_COUNT,
+  CHAT_SESSIONS_MAX_MEMORY_MB,
+  CHAT_SESSIONS_MAX_TOKENS,
+  HISTORY_STORE_PATH,
+  METRICS_HOST,
+  METRICS_PORT,
+  NATIVE_TOOL_CALLS,
+  OPENAI_SUMMARY_MODEL,
+  STREAM_RESPONSES,
+)
+from minerva.message_history import ImageContent, Message, get_tokenizer
 from minerva.prompt import USERNAMELESS_ID_PREFIX, Prompt
 from minerva.tools.fetch_html import close_fetch_html_browser, fetch_html
 from minerva.tools.generate_image import generate_image
+from minerva.tools.calendar.reminder_scheduler import ReminderScheduler
 from minerva.tools.send_text_file import send_text_file
 from minerva.tool_utils import GenericToolFn, format_tool_username
 
 MAX_TELEGRAM_MESSAGE_LENGTH_CHAR = 2000
+# Telegram limits how often bots can send and edit messages in groups
+STREAM_EDIT_INTERVAL_SEC = 1.5
+# Telegram delivers the photos of an album within a fraction of a second
+MEDIA_GROUP_WAIT_SEC = 1.0
 OPENAI_RESPONSE_MAX_TOKENS = 1512
 TOOL_RESPONSE_MAX_TOKENS = 2048
+# The cap for a single photo, fits a 16:9 photo in high detail, e.g. 1280x720
+# is 6 tiles. The photos of a topic also share its history budget, see
+# `ChatSession.get_max_image_tokens`
+IMAGE_MAX_TOKENS = 1105
 
 MAX_TOOL_USE_COUNT = 5
+# The max number of concurrent calls of a tool, across all topics. Other tools
+# are not limited.
+TOOL_CONCURRENCY_LIMITS = {
+  # Every call opens a browser page
+  "fetch_html": 4,
+  "generate_image": 2,
+}
 MAX_RETRY_COUNT = 3
+# The wall-clock limit of a response including all model and tool calls
+RESPONSE_TIMEOUT_SEC = 180
+# The last part of the response timeout, in which the model has to answer with
+# what it found so far
+BEST_EFFORT_ANSWER_TIMEOUT_SEC = 30
 HISTORY_MAX_TOKENS = 16384
+# Evict a quarter of the history at once when it's full, so the prompt prefix
+# stays the same for many requests and the provider can serve it from its cache
+HISTORY_EVICTION_BLOCK_RATIO = 0.25
+# The part of the history budget taken by the summary of the evicted messages
+# (with OPENAI_SUMMARY_MODEL)
+HISTORY_SUMMARY_MAX_TOKENS = 1024
 
 GENERAL_TOPIC_ID = 0
 
+# The tools chats can choose from, see `ChatConfig.tool_names`
+TOOLS: dict[str, GenericToolFn] = {
+  "fetch_html": fetch_html,
+  "send_text_file": send_text_file,
+  "generate_image": generate_image,
+}
+
+
+class MinervaChat:
+  """A Telegram chat Minerva talks in, with its own prompt and tools."""
+
+  def __init__(self, config: ChatConfig):
+    self.config = config
+    self.chat_id = config.chat_id
+    self.tools: dict[str, GenericToolFn] = {name: TOOLS[name] for name in config.tool_names}
+    # Created on initialize, when we know the bot username
+    self.prompt: Optional[Prompt] = None
+
 
 class Minerva:
+  """The bot process, serving every configured chat.
+
+  The expensive resources are shared by all chats: the OpenAI client, the
+  HTTP clients, the history store, the chat sessions and their memory budget,
+  the browser of `fetch_html`, the tokenizer, the calendars, and the reminder
+  scheduler.
+  """
+
   def __init__(
     self,
     application: Application,
-    chat_id: int,
+    chats: list[ChatConfig],
     openai_api_key: str,
     openai_base_url: str,
     openai_model: str,
   ):
     self.application = application
-    self.chat_id = chat_id
-    self.chat_sessions: dict[int, ChatSession] = {}
+    self.history_store: HistoryStore | None = (
+      SqliteHistoryStore(HISTORY_STORE_PATH) if HISTORY_STORE_PATH else None
+    )
+    self.metrics_server = (
+      MetricsServer(METRICS_HOST, METRICS_PORT, on_collect=self._collect_metrics)
+      if METRICS_PORT is not None
+      else None
+    )
+    self.media_groups = MediaGroupCollector(self._handle_messages, wait_sec=MEDIA_GROUP_WAIT_SEC)
+    # Shared by the tools and the meeting reminderers, closed on shutdown
+    self.http_clients = HttpClientRegistry()
     self.openai = AsyncOpenAI(api_key=openai_api_key, base_url=openai_base_url)
     self.openai_model = openai_model
-    self.tools: dict[str, GenericToolFn] = {
-      "fetch_html": fetch_html,
-      "send_text_file": send_text_file,
-      "generate_image": generate_image,
+    self.history_summarizer = (
+      HistorySummarizer(self.openai, OPENAI_SUMMARY_MODEL, HISTORY_SUMMARY_MAX_TOKENS)
+      if OPENAI_SUMMARY_MODEL
+      else None
+    )
+    self.chats = {config.chat_id: MinervaChat(config) for config in chats}
+    self.chat_sessions = ChatSessionPool(
+      self._create_chat_session,
+      max_sessions=CHAT_SESSIONS_MAX_COUNT,
+      idle_ttl_sec=CHAT_SESSIONS_IDLE_TTL_MIN * 60,
+      max_total_tokens=CHAT_SESSIONS_MAX_TOKENS,
+      max_total_size_bytes=CHAT_SESSIONS_MAX_MEMORY_MB * 1024 * 1024,
+    )
+
+    # The limits are shared by all chats
+    self.tool_semaphores = {
+      tool_name: asyncio.Semaphore(limit) for tool_name, limit in TOOL_CONCURRENCY_LIMITS.items()
     }
+    # Sends the meeting reminders of all calendars
+    self.reminder_scheduler = ReminderScheduler()
 
-    if CALENDAR_ICS_URL:
+    chats_with_calendar = [chat for chat in self.chats.values() if chat.config.calendar_ics_url]
+    if chats_with_calendar:
       from minerva.tools.calendar.get_query_calendar import get_query_calendar
 
-      query_calendar = get_query_calendar(CALENDAR_ICS_URL)
-      self.tools["query_calendar"] = query_calendar
+      from minerva.tools.calendar.calendar_cache import CalendarCache
 
       from minerva.tools.calendar.meeting_reminderer import setup_meeting_reminderer
 
-      async def send_reminder(message: str) -> None:
-        if GENERAL_TOPIC_ID not in self.chat_sessions:
-          self.chat_sessions[GENERAL_TOPIC_ID] = self._create_chat_session(GENERAL_TOPIC_ID)
-        chat_session = self.chat_sessions[GENERAL_TOPIC_ID]
-
-        chat_session.add_message(
-          Message(
-            author=format_tool_username("calendar"),
-            content=message,
+      # Shared by the calendar tools and the meeting reminderers of the chats with the same calendar
+      calendar_caches: dict[str, CalendarCache] = {}
+      for chat in chats_with_calendar:
+        calendar_ics_url = cast(str, chat.config.calendar_ics_url)
+        calendar_cache = calendar_caches.get(calendar_ics_url)
+        if calendar_cache is None:
+          calendar_cache = CalendarCache(
+            calendar_ics_url,
+            refetch_interval_sec=CALENDAR_REFETCH_INTERVAL_MIN * 60,
+            http_clients=self.http_clients,
           )
+          calendar_caches[calendar_ics_url] = calendar_cache
+
+        chat.tools[CALENDAR_TOOL_NAME] = get_query_calendar(calendar_cache)
+        setup_meeting_reminderer(
+          self._create_reminder_sender(chat),
+          calendar_ics_url,
+          calendar_cache,
+          self.reminder_scheduler,
+        )
+
+  def _create_reminder_sender(self, chat: MinervaChat) -> Callable[[str], Awaitable[None]]:
+    async def send_reminder(message: str) -> None:
+      chat_session = await self.chat_sessions.get(chat.chat_id, GENERAL_TOPIC_ID)
+
+      chat_session.add_message(
+        Message(
+          author=format_tool_username("calendar"),
+          content=message,
         )
-        await chat_session.create_response(user_id="calendar")
+      )
+      await chat_session.create_response(user_id="calendar")
 
-      setup_meeting_reminderer(send_reminder, CALENDAR_ICS_URL)
+    return send_reminder
 
   async def initialize(self) -> None:
+    # Load the tokenizer while the rest of the startup work is done
+    tokenizer_loading = asyncio.create_task(asyncio.to_thread(get_tokenizer))
     self.me = cast(TelegramUser, await self.application.bot.get_me())
     if not self.me.username:
       raise ValueError("Unexpected: Minerva bot doesn't have a username")
     self.username = self.me.username
     self.username_with_mention = f"@{self.me.username}"
-    self.prompt = Prompt(ai_name=AI_NAME, ai_username=self.me.username, tools=self.tools)
-
-    print("Starting Minerva with prompt:\n", self.prompt)
+    for chat in self.chats.values():
+      chat.prompt = Prompt(
+        ai_name=AI_NAME,
+        ai_username=self.me.username,
+        tools=chat.tools,
+        native_tool_calls=NATIVE_TOOL_CALLS,
+        persona_prompt=chat.config.prompt,
+      )
+      print(f"Starting Minerva in chat {chat.chat_id} with prompt:\n", chat.prompt)
 
     self.application.add_handler(MessageHandler(filters.TEXT | filters.PHOTO, self.on_message))
     self.application.add_handler(
@@ -99,18 +232,36 @@ class Minerva:
       )
     )
 
-    print(
-      f"Minerva is ready to chat in chat {self.chat_id}. Minerva username is {self.me.username}."
+    # Images left by the previous run are referenced by the restored histories
+    await IMAGE_STORE.collect_garbage(
+      await self.history_store.load_image_ids() if self.history_store is not None else []
     )
 
+    # Every message is counted with the tokenizer, so it's loaded before
+    # handling the first one, without blocking the event loop
+    await tokenizer_loading
+
+    if self.metrics_server is not None:
+      await self.metrics_server.start()
+
+    chat_ids = ", ".join(str(chat_id) for chat_id in self.chats)
+    print(f"Minerva is ready to chat in chats {chat_ids}. Minerva username is {self.me.username}.")
+
   async def shutdown(self) -> None:
+    self.reminder_scheduler.stop()
+    if self.metrics_server is not None:
+      await self.metrics_server.close()
+    if self.history_store is not None:
+      await self.history_store.close()
+    await IMAGE_STORE.close()
     await close_fetch_html_browser()
+    await self.http_clients.close()
 
   async def on_chat_member_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.my_chat_member:
       return
 
-    if update.my_chat_member.chat.id == self.chat_id:
+    if update.my_chat_member.chat.id in self.chats:
       return
 
     if update.my_chat_member.new_chat_member.user.id != self.me.id:
@@ -134,53 +285,74 @@ class Minerva:
     if not message.from_user:
       raise ValueError("Unexpected: message.from_user is None")
 
-    if message.chat.id != self.chat_id:
+    if message.chat.id not in self.chats:
       await message.reply_text("I'm sorry, I can't talk to you here.")
       if message.chat.type != ChatType.PRIVATE:
         await message.chat.leave()
       return
 
+    if message.media_group_id:
+      # Telegram sends every photo of an album as a separate message, handle
+      # them together once the whole album arrives
+      self.media_groups.add(message)
+      return
+
+    await self._handle_messages([message])
+
+  async def _handle_messages(self, messages: list[TelegramMessage]) -> None:
+    """Add a message, or all messages of a media group, to the history as a single message."""
+
+    message = messages[0]
+    if not message.from_user:
+      raise ValueError("Unexpected: message.from_user is None")
+
     topic_id = self._get_topic_id(message)
-    should_respond = self._is_reply_to_me(message) or self._is_mentioned(message)
+    should_respond = any(self._is_reply_to_me(m) or self._is_mentioned(m) for m in messages)
     if should_respond:
       # Send typing notification before starting to download the images because
       # downloading may take some time and we want to let the user that we
       # started processing their request
       await message.chat.send_chat_action(ChatAction.TYPING, message_thread_id=topic_id)
 
+    chat = self.chats[message.chat.id]
     message_author = message.from_user.username or f"{USERNAMELESS_ID_PREFIX}{message.from_user.id}"
-    history_message: Message
+    # Keep the session in the pool while the photos download, otherwise another
+    # topic could evict it and the message would go to a dropped session
+    async with self.chat_sessions.pin(chat.chat_id, topic_id) as chat_session:
+      chat_session.add_message(
+        await self._create_history_message(messages, message_author, chat_session)
+      )
+
+      if not should_respond:
+        return
+
+      # Don't wait for the response, so that messages sent while it's being
+      # created are added to the history and coalesced into a single follow-up
+      chat_session.create_response(
+        user_id=f"telegram-{message.from_user.id}",
+        reply_to_message_id=message.id,
+      )
+
+  async def _create_history_message(
+    self, messages: list[TelegramMessage], message_author: str, chat_session: ChatSession
+  ) -> Message:
+    message = messages[0]
     if message.text:
-      history_message = Message(author=message_author, content=message.text)
-    elif message.photo:
-      history_message = Message(
+      return Message(author=message_author, content=message.text)
+    if message.photo:
+      bot = cast(Bot, self.application.bot)
+      photos = [m.photo for m in messages if m.photo]
+      max_image_tokens = chat_session.get_max_image_tokens(len(photos))
+      images = await asyncio.gather(
+        *(get_image_from_telegram_photo(bot, photo, max_image_tokens) for photo in photos)
+      )
+      # Usually only the first photo of an album has a caption
+      captions = [m.caption for m in messages if m.caption]
+      return Message(
         author=message_author,
-        content=ImageContent(
-          images=[
-            await get_image_from_telegram_photo(cast(Bot, self.application.bot), message.photo)
-          ],
-          text=message.caption,
-        ),
+        content=ImageContent(images=list(images), text="\n".join(captions) or None),
       )
-      # If the user uploads multiple photos in a single message, Telegram API
-      # will emit different message events for them
-      # TODO(yurij): wait for other photos here
-    else:
-      raise ValueError("Unsupported message type")
-
-    # Add message to chat history
-    if topic_id not in self.chat_sessions:
-      self.chat_sessions[topic_id] = self._create_chat_session(topic_id)
-    chat_session = self.chat_sessions[topic_id]
-    chat_session.add_message(history_message)
-
-    if not should_respond:
-      return
-
-    await chat_session.create_response(
-      user_id=f"telegram-{message.from_user.id}",
-      reply_to_message_id=message.id,
-    )
+    raise ValueError("Unsupported message type")
 
   def _get_topic_id(self, message: TelegramMessage) -> int:
     # The General topic doesn't have a "message_thread_id"
@@ -210,7 +382,23 @@ class Minerva:
 
     return False
 
-  def _create_chat_session(self, topic_id: int) -> ChatSession:
+  def _collect_metrics(self) -> None:
+    # Evicted sessions should disappear from the metrics
+    for gauge in (HISTORY_MESSAGES, HISTORY_TOKENS, HISTORY_SIZE_BYTES):
+      gauge.clear()
+    session_counts = {chat_id: 0 for chat_id in self.chats}
+    for topic_stats in self.chat_sessions.get_stats():
+      session_counts[topic_stats.chat_id] += 1
+      chat_label = str(topic_stats.chat_id)
+      topic = str(topic_stats.topic_id)
+      HISTORY_MESSAGES.set(chat_label, topic, value=topic_stats.message_count)
+      HISTORY_TOKENS.set(chat_label, topic, value=topic_stats.history_tokens)
+      HISTORY_SIZE_BYTES.set(chat_label, topic, value=topic_stats.size_bytes)
+    for chat_id, session_count in session_counts.items():
+      CHAT_SESSIONS.set(str(chat_id), value=session_count)
+
+  def _create_chat_session(self, chat_id: int, topic_id: int) -> ChatSession:
+    chat = self.chats[chat_id]
     return ChatSession(
       bot=cast(Bot, self.application.bot),
       ai_username=self.username,
@@ -218,12 +406,25 @@ class Minerva:
       openai_model_name=self.openai_model,
       max_completion_tokens=OPENAI_RESPONSE_MAX_TOKENS,
       max_history_tokens=HISTORY_MAX_TOKENS,
-      prompt=str(self.prompt),
-      tools=self.tools,
-      chat_id=self.chat_id,
+      prompt=str(chat.prompt),
+      tools=chat.tools,
+      chat_id=chat.chat_id,
       topic_id=topic_id,
       max_create_response_retry_count=MAX_RETRY_COUNT,
       max_create_response_tool_use_count=MAX_TOOL_USE_COUNT,
       max_telegram_message_length_char=MAX_TELEGRAM_MESSAGE_LENGTH_CHAR,
       max_tool_response_tokens=TOOL_RESPONSE_MAX_TOKENS,
+      max_image_tokens=IMAGE_MAX_TOKENS,
+      stream_responses=STREAM_RESPONSES,
+      stream_edit_interval_sec=STREAM_EDIT_INTERVAL_SEC,
+      native_tool_calls=NATIVE_TOOL_CALLS,
+      tool_semaphores=self.tool_semaphores,
+      response_timeout_sec=RESPONSE_TIMEOUT_SEC,
+      best_effort_answer_timeout_sec=BEST_EFFORT_ANSWER_TIMEOUT_SEC,
+      history_eviction_block_ratio=HISTORY_EVICTION_BLOCK_RATIO,
+      history_summarizer=self.history_summarizer,
+      http_clients=self.http_clients,
+      history_store=(
+        self.history_store.for_topic(chat.chat_id, topic_id) if self.history_store else None
+      ),
     )
@@ -1,4 +1,4 @@
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 from enum import StrEnum
 from minerva.tool_utils import format_tool, format_tool_username, GenericToolFn
 
@@ -16,29 +16,29 @@ class ModelMessage(NamedTuple):
   content: str
 
 
-def parse_model_message(message: str) -> ModelMessage:
-  lines = message.strip().split("\n")
+def parse_model_action(header: str) -> ModelAction:
+  """Parse the "Action: ..." header line of a model message."""
 
-  if not lines[0].startswith(ACTION_PREFIX):
+  if not header.startswith(ACTION_PREFIX):
     raise ValueError(f'Action is missing, the message must start with "{ACTION_PREFIX}"')
 
-  action_str = lines[0].split(":")[1].strip()
+  action_str = header.split(":")[1].strip()
 
   try:
-    action = ModelAction(action_str)
+    return ModelAction(action_str)
   except ValueError:
     allowed_actions = ", ".join([str(action) for action in ModelAction.__members__.values()])
     raise ValueError(f"'{action_str}' action is not supported, must be one of: {allowed_actions}")
 
+
+def parse_model_message(message: str) -> ModelMessage:
+  lines = message.strip().split("\n")
+  action = parse_model_action(lines[0])
   content = "\n".join(lines[1:])
   return ModelMessage(action, content)
 
 
-def get_base_prompt(
-  ai_name: str,
-  ai_username: str,
-  tools: dict[str, GenericToolFn],
-) -> str:
+def get_default_persona_prompt(ai_name: str) -> str:
   return f"""You are {ai_name}, she/her, a Telegram AI assistant whose purpose is to help software engineers to enhance their skills and knowledge. You are good at breaking down intricate concepts and explaining them clearly and understandably. You are highly effective as a partner and a mentor. You are friendly, respectful, and have a good sense of humor, but you never make crude or obscene jokes, and you are never sarcastic. You are happy to help with any task related to software development. You may still answer when asked something unrelated to software development, but use your friendliness and respectful humor to eventually guide the conversation back to the main topic.
 
 Provide short responses suitable for a Telegram discussion unless you need to elaborate.
@@ -47,7 +47,19 @@ If it makes sense, instead of providing a solution, nudge the user to think abou
 
 Never be instructive. Always be supportive and encouraging. Prefer to talk like a partner rather than like a mentor. Every interaction with you should make people feel satisfied. Don't be too formal; speak naturally but without taunts and sarcasm. Respond in the style of Dr. House. Never explicitly reference Dr. House, and don't make it obvious that you are mimicking him. Never be rude or insensitive.
 
-Never repeat yourself. Be original.
+Never repeat yourself. Be original."""  # noqa: E501
+
+
+def get_base_prompt(
+  ai_name: str,
+  ai_username: str,
+  tools: dict[str, GenericToolFn],
+  native_tool_calls: bool = False,
+  persona_prompt: Optional[str] = None,
+) -> str:
+  tools_prompt = get_native_tools_prompt() if native_tool_calls else get_text_tools_prompt(tools)
+  persona_prompt = persona_prompt or get_default_persona_prompt(ai_name)
+  return f"""{persona_prompt}
 
 The conversation history will include multiple participants, and each message is structured as follows:
 participant username: message content
@@ -67,12 +79,25 @@ IMPORTANT: Always escape these characters when NOT using them for markdown forma
 - Asterisk: * → becomes \\*
 - Backtick: ` → becomes \\`
 
-To help the user you may use tools. To use a tool, say:
+{tools_prompt}"""  # noqa: E501
+
+
+def get_text_tools_prompt(tools: dict[str, GenericToolFn]) -> str:
+  """Instructions for calling tools with the "Action: ..." text protocol."""
+
+  return f"""To help the user you may use tools. To use a tool, say:
 Action: tool
 tool_name(arguments)
 
 The tool will be called with the provided arguments and the result will be returned to you as tool response.
 
+If you need several independent tools, call them at once, one call per line:
+Action: tool
+tool_name(arguments)
+other_tool_name(arguments)
+
+The tools will be called concurrently, and their responses will be returned to you in the same order.
+
 Tool response will be added to the conversation history as:
 {format_tool_username("tool_name")}: tool response
 
@@ -112,14 +137,35 @@ The messages from you that will appear in the chat.
 """  # noqa: E501
 
 
+def get_native_tools_prompt() -> str:
+  """Instructions for calling tools with the API's structured tool calls."""
+
+  return f"""To help the user you may call the provided tools. The tool responses will be returned to you. If you need several independent tools, call them at once.
+
+If the tool cannot be found or fails, the tool response will start with "ERROR:".
+
+IMPORTANT: Calls to tools and tool responses are visible only to you. You will decide what to do with the tool response and what to share with the user.
+
+Do not mention tools in your responses.
+
+You can use tools multiple times in a row. You can't use tools more than five (5) times in a row.
+
+System ERROR messages are sent by {format_tool_username("ERROR")} and are visible to you only. If you get an error, first try fulfilling the user request again.
+
+When you don't call a tool, your message will appear in the chat.
+"""  # noqa: E501
+
+
 class Prompt:
   def __init__(
     self,
     ai_name: str,
     ai_username: str,
     tools: dict[str, GenericToolFn],
+    native_tool_calls: bool = False,
+    persona_prompt: Optional[str] = None,
   ):
-    self.prompt = get_base_prompt(ai_name, ai_username, tools)
+    self.prompt = get_base_prompt(ai_name, ai_username, tools, native_tool_calls, persona_prompt)
 
   def __str__(self):
     return self.prompt
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Any, Callable, Coroutine, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseRequest(NamedTuple):
+  user_id: str
+  reply_to_message_id: Optional[int] = None
+
+
+class ResponseScheduler:
+  """Serialize response creation for a single chat session.
+
+  Only one response is created at a time, so concurrent responses don't
+  interleave their writes into the same history. Requests that arrive while a
+  response is in flight are coalesced into a single follow-up response that
+  replies to the latest of them. The follow-up sees every message added to the
+  history in the meantime, so answering each request separately would only
+  cost extra model calls.
+
+  The response in flight can be cancelled with `cancel_current`, e.g. when the
+  user sends a follow-up before it's answered. The scheduler then moves on to
+  the pending request, if any.
+  """
+
+  def __init__(self, create_response: Callable[[ResponseRequest], Coroutine[Any, Any, None]]):
+    self._create_response = create_response
+    self._worker: Optional[asyncio.Task[None]] = None
+    self._pending_request: Optional[ResponseRequest] = None
+    self._pending_future: Optional[asyncio.Future[None]] = None
+    self._pending_request_count = 0
+    self._current_request: Optional[ResponseRequest] = None
+    self._current_task: Optional[asyncio.Task[None]] = None
+
+  @property
+  def is_busy(self) -> bool:
+    return self._worker is not None
+
+  @property
+  def current_request(self) -> Optional[ResponseRequest]:
+    """The request of the response in flight."""
+
+    return self._current_request
+
+  def cancel_current(self) -> bool:
+    """Cancel the response in flight, return whether there was one to cancel."""
+
+    if self._current_task is None or self._current_task.done():
+      return False
+    return self._current_task.cancel()
+
+  def submit(self, request: ResponseRequest) -> asyncio.Future[None]:
+    """Schedule a response and return a future that resolves once it's sent."""
+
+    if self._pending_future is None:
+      self._pending_future = asyncio.get_running_loop().create_future()
+    self._pending_request = request
+    self._pending_request_count += 1
+    future = self._pending_future
+
+    if self._worker is None:
+      self._worker = asyncio.create_task(self._run())
+    return future
+
+  async def _run(self) -> None:
+    try:
+      while self._pending_request is not None and self._pending_future is not None:
+        request, future = self._pending_request, self._pending_future
+        if self._pending_request_count > 1:
+          logger.info("coalesced %d response requests into one", self._pending_request_count)
+        self._pending_request = None
+        self._pending_future = None
+        self._pending_request_count = 0
+
+        self._current_request = request
+        self._current_task = asyncio.create_task(self._create_response(request))
+        try:
+          await self._current_task
+        except asyncio.CancelledError:
+          task = asyncio.current_task()
+          if task is not None and task.cancelling():
+            # The scheduler itself was cancelled, not just the response
+            raise
+          logger.info("response cancelled: user=%s", request.user_id)
+        except Exception:
+          logger.exception("Failed to create a response")
+        finally:
+          self._current_request = None
+          self._current_task = None
+          if not future.done():
+            future.set_result(None)
+    finally:
+      self._worker = None
+      if self._pending_future is not None and not self._pending_future.done():
+        # We were cancelled before we got to the pending request
+        self._pending_future.cancel()
+      self._pending_request = None
+      self._pending_future = None
+      self._pending_request_count = 0
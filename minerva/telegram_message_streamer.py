@@ -0,0 +1,137 @@
+import logging
+import time
+from typing import Optional
+
+from telegram import Bot, Message as TelegramMessage
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+
+from minerva.markdown_splitter import split_markdown
+from minerva.metrics import TELEGRAM_SEND_DURATION
+from minerva.prompt import ModelAction, parse_model_action
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramMessageStreamer:
+  """Show a model answer in Telegram while the model is still generating it.
+
+  The streamer is fed the accumulated model answer as it grows. Once the
+  "Action: respond" header arrives (or right away, if the answer has no
+  header), it sends the answer content and keeps
+  editing the sent message, rolling over into new messages when the content
+  doesn't fit into one. Intermediate updates are sent as plain text because
+  partial markdown is often invalid; `finish` renders the final markdown.
+  """
+
+  def __init__(
+    self,
+    bot: Bot,
+    chat_id: int,
+    topic_id: int,
+    reply_to_message_id: Optional[int],
+    max_message_length_char: int,
+    edit_interval_sec: float,
+    has_action_header: bool = True,
+  ):
+    self.bot = bot
+    self.chat_id = chat_id
+    self.topic_id = topic_id
+    self.reply_to_message_id = reply_to_message_id
+    self.max_message_length_char = max_message_length_char
+    self.edit_interval_sec = edit_interval_sec
+
+    self.has_action_header = has_action_header
+
+    # Answers without the header are always sent to the chat
+    self._action: Optional[ModelAction] = None if has_action_header else ModelAction.RESPOND
+    self._sent_messages: list[TelegramMessage] = []
+    self._sent_texts: list[str] = []
+    self._last_update_at = 0.0
+
+  @property
+  def is_streaming(self) -> bool:
+    """Whether a part of the answer was already sent to the chat."""
+    return len(self._sent_messages) > 0
+
+  async def on_answer_update(self, answer: str) -> None:
+    if self._action is None:
+      answer = answer.lstrip()
+      if "\n" not in answer:
+        # Wait until we get the full header line
+        return
+      try:
+        self._action = parse_model_action(answer.split("\n", 1)[0])
+      except ValueError:
+        # Let the chat session handle the malformed message once it's complete
+        self._action = ModelAction.USE_TOOL
+
+    if self._action != ModelAction.RESPOND:
+      return
+
+    now = time.monotonic()
+    if now - self._last_update_at < self.edit_interval_sec:
+      return
+    self._last_update_at = now
+
+    content = answer
+    if self.has_action_header:
+      lines = answer.strip().split("\n", 1)
+      content = lines[1] if len(lines) > 1 else ""
+    await self._update(content, parse_mode=None)
+
+  async def finish(self, content: str) -> None:
+    """Replace the streamed messages with the final, markdown-formatted answer."""
+    chunk_count = await self._update(content, parse_mode=ParseMode.MARKDOWN, force=True)
+    # The final answer can take fewer messages than the streamed draft, e.g. when
+    # the markdown is shorter than the plain text or the model rewrote its answer
+    for sent_message in self._sent_messages[chunk_count:]:
+      try:
+        with TELEGRAM_SEND_DURATION.time("delete_message"):
+          await self.bot.delete_message(chat_id=self.chat_id, message_id=sent_message.message_id)
+      except BadRequest:
+        logger.warning("Failed to delete streamed message %d", sent_message.message_id)
+    del self._sent_messages[chunk_count:]
+    del self._sent_texts[chunk_count:]
+
+  async def _update(self, content: str, parse_mode: Optional[str], force: bool = False) -> int:
+    """Send or edit the messages for the content and return the number of its chunks.
+
+    When the content is empty, the sent messages are left as is.
+    """
+    if not content.strip():
+      return len(self._sent_messages)
+
+    chunks = list(split_markdown(content, self.max_message_length_char))
+    for i, chunk in enumerate(chunks):
+      if i >= len(self._sent_messages):
+        with TELEGRAM_SEND_DURATION.time("send_message"):
+          sent_message = await self.bot.send_message(
+            chat_id=self.chat_id,
+            text=chunk,
+            message_thread_id=self.topic_id,
+            reply_to_message_id=self.reply_to_message_id,
+            parse_mode=parse_mode,
+          )
+        self._sent_messages.append(sent_message)
+        self._sent_texts.append(chunk)
+        continue
+
+      if not force and self._sent_texts[i] == chunk:
+        continue
+
+      try:
+        with TELEGRAM_SEND_DURATION.time("edit_message_text"):
+          await self.bot.edit_message_text(
+            text=chunk,
+            chat_id=self.chat_id,
+            message_id=self._sent_messages[i].message_id,
+            parse_mode=parse_mode,
+          )
+      except BadRequest as err:
+        # Telegram rejects edits that don't change the message
+        if "not modified" not in str(err).lower():
+          raise
+      self._sent_texts[i] = chunk
+
+    return len(chunks)
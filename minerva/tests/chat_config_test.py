@@ -0,0 +1,35 @@
+import pytest
+
+from minerva.chat_config import DEFAULT_TOOL_NAMES, ChatConfig, parse_chat_configs
+
+
+def test_parse_chat_configs():
+  chats = parse_chat_configs(
+    """[
+      {"chat_id": -100, "calendar_ics_url": "https://example.com/calendar.ics"},
+      {"chat_id": -200, "prompt": "You are a cat.", "tools": ["fetch_html"]}
+    ]"""
+  )
+
+  assert chats == [
+    ChatConfig(
+      chat_id=-100,
+      tool_names=DEFAULT_TOOL_NAMES,
+      calendar_ics_url="https://example.com/calendar.ics",
+    ),
+    ChatConfig(chat_id=-200, prompt="You are a cat.", tool_names=("fetch_html",)),
+  ]
+
+
+@pytest.mark.parametrize(
+  "config_str, error",
+  [
+    ("[]", "non-empty list"),
+    ('[{"chat_id": "-100"}]', "integer chat_id"),
+    ('[{"chat_id": -100, "tools": ["rm_rf"]}]', "unknown tools: rm_rf"),
+    ('[{"chat_id": -100}, {"chat_id": -100}]', "duplicate chat ids"),
+  ],
+)
+def test_parse_chat_configs_rejects_invalid_configs(config_str: str, error: str):
+  with pytest.raises(ValueError, match=error):
+    parse_chat_configs(config_str)
@@ -0,0 +1,139 @@
+from typing import Any, Optional, cast
+
+import pytest
+
+from minerva.chat_session import ChatSession
+from minerva.chat_session_pool import ChatSessionPool
+from minerva.history_store import HistoryStore, SqliteHistoryStore
+from minerva.message_history import Message
+
+
+def create_chat_session(
+  chat_id: int, topic_id: int, history_store: Optional[HistoryStore] = None
+) -> ChatSession:
+  return ChatSession(
+    bot=cast(Any, None),
+    ai_username="minerva",
+    openai_client=cast(Any, None),
+    openai_model_name="gpt-5.4",
+    max_completion_tokens=100,
+    max_history_tokens=10_000,
+    max_create_response_retry_count=3,
+    max_create_response_tool_use_count=5,
+    max_telegram_message_length_char=2000,
+    max_tool_response_tokens=100,
+    max_image_tokens=1000,
+    tools={},
+    prompt="prompt",
+    chat_id=chat_id,
+    topic_id=topic_id,
+    history_store=history_store.for_topic(chat_id, topic_id) if history_store else None,
+  )
+
+
+def create_pool(
+  max_sessions: int = 10,
+  idle_ttl_sec: float = 3600,
+  max_total_tokens: int = 1_000_000,
+  history_store: Optional[HistoryStore] = None,
+) -> ChatSessionPool:
+  return ChatSessionPool(
+    lambda chat_id, topic_id: create_chat_session(chat_id, topic_id, history_store),
+    max_sessions=max_sessions,
+    idle_ttl_sec=idle_ttl_sec,
+    max_total_tokens=max_total_tokens,
+    max_total_size_bytes=1024 * 1024,
+  )
+
+
+def get_history_contents(chat_session: ChatSession) -> list[Any]:
+  return [message.content for message in chat_session.llm_session.history.history]
+
+
+@pytest.mark.asyncio
+async def test_chat_session_pool_reuses_sessions():
+  pool = create_pool()
+
+  first = await pool.get(1, 1)
+  assert await pool.get(1, 1) is first
+  assert len(pool) == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_session_pool_evicts_least_recently_used_sessions():
+  pool = create_pool(max_sessions=2)
+
+  first = await pool.get(1, 1)
+  await pool.get(1, 2)
+  await pool.get(1, 1)
+  await pool.get(1, 3)
+
+  assert len(pool) == 2
+  assert sorted(stats.topic_id for stats in pool.get_stats()) == [1, 3]
+  assert await pool.get(1, 1) is first
+
+
+@pytest.mark.asyncio
+async def test_chat_session_pool_evicts_sessions_over_token_budget():
+  pool = create_pool()
+  first = await pool.get(1, 1)
+  first.add_message(Message("user", "hello"))
+  pool.max_total_tokens = first.llm_session.history.current_tokens * 3
+
+  for topic_id in range(2, 4):
+    (await pool.get(1, topic_id)).add_message(Message("user", "hello"))
+  (await pool.get(1, 4)).add_message(Message("user", "hello"))
+  await pool.get(1, 4)
+
+  assert sorted(stats.topic_id for stats in pool.get_stats()) == [2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_chat_session_pool_evicts_idle_sessions(monkeypatch: pytest.MonkeyPatch):
+  now = 1000.0
+  monkeypatch.setattr("minerva.chat_session_pool.time.monotonic", lambda: now)
+  pool = create_pool(idle_ttl_sec=60)
+
+  await pool.get(1, 1)
+  now += 61
+  await pool.get(1, 2)
+
+  assert [stats.topic_id for stats in pool.get_stats()] == [2]
+
+
+@pytest.mark.asyncio
+async def test_chat_session_pool_restores_evicted_sessions_from_history_store(tmp_path: Any):
+  history_store = SqliteHistoryStore(str(tmp_path / "history.sqlite3"))
+  pool = create_pool(max_sessions=1, history_store=history_store)
+
+  first = await pool.get(1, 1)
+  first.add_message(Message("user", "hello"))
+  await pool.get(1, 2)
+  restored = await pool.get(1, 1)
+  await history_store.close()
+
+  assert restored is not first
+  assert get_history_contents(restored) == ["hello"]
+
+
+@pytest.mark.asyncio
+async def test_chat_session_pool_shares_the_budget_between_chats():
+  pool = create_pool(max_sessions=2)
+
+  await pool.get(1, 1)
+  await pool.get(2, 1)
+  await pool.get(3, 1)
+
+  assert [(stats.chat_id, stats.topic_id) for stats in pool.get_stats()] == [(2, 1), (3, 1)]
+
+
+@pytest.mark.asyncio
+async def test_chat_session_pool_keeps_pinned_sessions():
+  pool = create_pool(max_sessions=1)
+
+  async with pool.pin(1, 1) as pinned:
+    await pool.get(1, 2)
+    assert await pool.get(1, 1) is pinned
+
+  await pool.get(1, 2)
+  assert [stats.topic_id for stats in pool.get_stats()] == [2]
@@ -0,0 +1,359 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import Any, Optional, Unpack
+from unittest.mock import AsyncMock
+
+import pytest
+from openai.types.chat import ChatCompletion
+
+from minerva.chat_session import (
+  CANCELLED_TOOL_RESPONSE,
+  OUT_OF_TIME_ERROR,
+  RESPONSE_TIMEOUT_ANSWER,
+  ChatSession,
+)
+from minerva.message_history import Image, ImageContent, Message
+from minerva.metrics import PROMPT_TOKENS, RESPONSE_RETRIES, TOOL_CALL_PARSE_FAILURES
+from minerva.tool_utils import GenericToolFn
+from minerva.tools.tool_kwargs import DefaultToolKwargs
+
+
+async def sum(a: int, b: int, **kwargs: Unpack[DefaultToolKwargs]) -> str:
+  """Sum two numbers."""
+  return str(a + b)
+
+
+def create_completion(
+  content: Optional[str] = None,
+  tool_calls: list[tuple[str, str, str]] = [],
+  usage: Optional[dict[str, Any]] = None,
+) -> ChatCompletion:
+  message: dict[str, Any] = {"role": "assistant", "content": content}
+  if tool_calls:
+    message["tool_calls"] = [
+      {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+      for call_id, name, arguments in tool_calls
+    ]
+  return ChatCompletion.model_validate(
+    {
+      "id": "completion",
+      "object": "chat.completion",
+      "created": 0,
+      "model": "gpt-5.4",
+      "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+      "usage": usage,
+    }
+  )
+
+
+def create_chat_session(
+  completions: list[ChatCompletion],
+  tools: dict[str, GenericToolFn] = {"sum": sum},
+  native_tool_calls: bool = True,
+  tool_semaphores: Optional[dict[str, asyncio.Semaphore]] = None,
+  response_timeout_sec: Optional[float] = None,
+  best_effort_answer_timeout_sec: Optional[float] = None,
+) -> tuple[ChatSession, Any, Any]:
+  bot = SimpleNamespace(send_message=AsyncMock())
+  openai_client = SimpleNamespace(
+    chat=SimpleNamespace(completions=SimpleNamespace(create=AsyncMock(side_effect=completions)))
+  )
+  chat_session = ChatSession(
+    bot=bot,  # type: ignore
+    ai_username="minerva",
+    openai_client=openai_client,  # type: ignore
+    openai_model_name="gpt-5.4",
+    max_completion_tokens=100,
+    max_history_tokens=10_000,
+    max_create_response_retry_count=3,
+    max_create_response_tool_use_count=5,
+    max_telegram_message_length_char=2000,
+    max_tool_response_tokens=100,
+    max_image_tokens=1000,
+    tools=tools,
+    prompt="prompt",
+    chat_id=1,
+    topic_id=2,
+    native_tool_calls=native_tool_calls,
+    tool_semaphores=tool_semaphores,
+    response_timeout_sec=response_timeout_sec,
+    best_effort_answer_timeout_sec=best_effort_answer_timeout_sec,
+  )
+  return chat_session, bot, openai_client
+
+
+@pytest.mark.asyncio
+async def test_chat_session_calls_native_tools():
+  chat_session, bot, openai_client = create_chat_session(
+    [
+      create_completion(tool_calls=[("call-1", "sum", json.dumps({"a": 1, "b": 2}))]),
+      create_completion("It's 3"),
+    ]
+  )
+
+  await chat_session.create_response(user_id="user")
+
+  request = openai_client.chat.completions.create.await_args_list[0].kwargs
+  assert request["tools"][0]["function"]["name"] == "sum"
+  assert request["tools"][0]["function"]["parameters"]["required"] == ["a", "b"]
+
+  messages = openai_client.chat.completions.create.await_args_list[1].kwargs["messages"]
+  assert messages[-2]["role"] == "assistant"
+  assert messages[-2]["tool_calls"][0]["id"] == "call-1"
+  assert messages[-1] == {"role": "tool", "content": "3", "tool_call_id": "call-1"}
+  assert bot.send_message.await_args.kwargs["text"] == "It's 3"
+
+
+@pytest.mark.asyncio
+async def test_chat_session_reports_native_tool_call_parse_failures():
+  parse_failures = TOOL_CALL_PARSE_FAILURES.get("native", "tool_call")
+  retries = RESPONSE_RETRIES.get("native")
+  chat_session, bot, openai_client = create_chat_session(
+    [
+      create_completion(tool_calls=[("call-1", "sum", '{"a": 1')]),
+      create_completion("Sorry"),
+    ]
+  )
+
+  await chat_session.create_response(user_id="user")
+
+  messages = openai_client.chat.completions.create.await_args_list[1].kwargs["messages"]
+  assert messages[-1]["tool_call_id"] == "call-1"
+  assert "Tool arguments are not valid JSON" in messages[-1]["content"]
+  assert TOOL_CALL_PARSE_FAILURES.get("native", "tool_call") == parse_failures + 1
+  assert RESPONSE_RETRIES.get("native") == retries + 1
+  assert bot.send_message.await_args.kwargs["text"] == "Sorry"
+
+
+class SlowTools:
+  def __init__(self):
+    self.running_count = 0
+    self.max_running_count = 0
+
+  async def fetch(self, url: str, **kwargs: Unpack[DefaultToolKwargs]) -> str:
+    self.running_count += 1
+    self.max_running_count = max(self.max_running_count, self.running_count)
+    # The later calls finish first
+    await asyncio.sleep(0.03 - 0.01 * int(url))
+    self.running_count -= 1
+    return f"page {url}"
+
+
+@pytest.mark.asyncio
+async def test_chat_session_runs_native_tool_calls_concurrently():
+  slow_tools = SlowTools()
+  chat_session, _, openai_client = create_chat_session(
+    [
+      create_completion(
+        tool_calls=[(f"call-{i}", "fetch", json.dumps({"url": str(i)})) for i in range(3)]
+      ),
+      create_completion("Done"),
+    ],
+    tools={"fetch": slow_tools.fetch},
+    tool_semaphores={"fetch": asyncio.Semaphore(2)},
+  )
+
+  await chat_session.create_response(user_id="user")
+
+  messages = openai_client.chat.completions.create.await_args_list[1].kwargs["messages"]
+  assert [(m["tool_call_id"], m["content"]) for m in messages[-3:]] == [
+    ("call-0", "page 0"),
+    ("call-1", "page 1"),
+    ("call-2", "page 2"),
+  ]
+  assert slow_tools.max_running_count == 2
+
+
+@pytest.mark.asyncio
+async def test_chat_session_runs_text_tool_calls_concurrently():
+  slow_tools = SlowTools()
+  chat_session, bot, openai_client = create_chat_session(
+    [
+      create_completion("Action: tool\nfetch('0')\nfetch('1')\nfetch('2')"),
+      create_completion("Action: respond\nDone"),
+    ],
+    tools={"fetch": slow_tools.fetch},
+    native_tool_calls=False,
+  )
+
+  await chat_session.create_response(user_id="user")
+
+  messages = openai_client.chat.completions.create.await_args_list[1].kwargs["messages"]
+  assert [(m["name"], m["content"]) for m in messages[-3:]] == [
+    ("TOOL-fetch", "page 0"),
+    ("TOOL-fetch", "page 1"),
+    ("TOOL-fetch", "page 2"),
+  ]
+  assert slow_tools.max_running_count == 3
+  assert bot.send_message.await_args.kwargs["text"] == "Done"
+
+
+class BlockingTool:
+  def __init__(self):
+    self.started = asyncio.Event()
+
+  async def wait(self, **kwargs: Unpack[DefaultToolKwargs]) -> str:
+    """Never finish."""
+    self.started.set()
+    await asyncio.sleep(10)
+    return "done"
+
+
+@pytest.mark.asyncio
+async def test_chat_session_follow_up_cancels_the_response_in_flight():
+  blocking_tool = BlockingTool()
+  chat_session, bot, openai_client = create_chat_session(
+    [
+      create_completion(tool_calls=[("call-1", "wait", "{}")]),
+      create_completion("Done"),
+    ],
+    tools={"wait": blocking_tool.wait},
+  )
+
+  first = chat_session.create_response(user_id="user")
+  await asyncio.wait_for(blocking_tool.started.wait(), timeout=1)
+  second = chat_session.create_response(user_id="user")
+  await asyncio.wait_for(asyncio.gather(first, second), timeout=1)
+
+  messages = openai_client.chat.completions.create.await_args_list[1].kwargs["messages"]
+  assert messages[-1] == {
+    "role": "tool",
+    "content": CANCELLED_TOOL_RESPONSE,
+    "tool_call_id": "call-1",
+  }
+  assert bot.send_message.await_count == 1
+  assert bot.send_message.await_args.kwargs["text"] == "Done"
+
+
+@pytest.mark.asyncio
+async def test_chat_session_answers_when_the_response_times_out():
+  blocking_tool = BlockingTool()
+  chat_session, bot, _ = create_chat_session(
+    [create_completion("Action: tool\nwait()")],
+    tools={"wait": blocking_tool.wait},
+    native_tool_calls=False,
+    response_timeout_sec=0.05,
+  )
+
+  await asyncio.wait_for(chat_session.create_response(user_id="user"), timeout=1)
+
+  assert bot.send_message.await_args.kwargs["text"] == RESPONSE_TIMEOUT_ANSWER
+  last_message = chat_session.llm_session.history.history[-1]
+  assert last_message.content == f"Action: respond\n{RESPONSE_TIMEOUT_ANSWER}"
+
+
+@pytest.mark.asyncio
+async def test_chat_session_answers_from_the_work_done_when_the_response_times_out():
+  blocking_tool = BlockingTool()
+  chat_session, bot, openai_client = create_chat_session(
+    [
+      create_completion(tool_calls=[("call-1", "wait", "{}")]),
+      create_completion("I couldn't finish, but here is what I know"),
+    ],
+    tools={"wait": blocking_tool.wait},
+    response_timeout_sec=1.05,
+    best_effort_answer_timeout_sec=1,
+  )
+
+  await asyncio.wait_for(chat_session.create_response(user_id="user"), timeout=2)
+
+  first_request = openai_client.chat.completions.create.await_args_list[0].kwargs
+  assert 0 < first_request["timeout"] <= 0.05
+  request = openai_client.chat.completions.create.await_args_list[1].kwargs
+  assert request["tool_choice"] == "none"
+  assert request["messages"][-2]["content"] == CANCELLED_TOOL_RESPONSE
+  assert request["messages"][-1]["content"] == OUT_OF_TIME_ERROR
+  assert bot.send_message.await_args.kwargs["text"] == "I couldn't finish, but here is what I know"
+
+
+@pytest.mark.asyncio
+async def test_chat_session_reports_cached_prompt_tokens():
+  cache_hits = PROMPT_TOKENS.get("hit")
+  cache_misses = PROMPT_TOKENS.get("miss")
+  chat_session, _, openai_client = create_chat_session(
+    [
+      create_completion(
+        "Hi",
+        usage={
+          "prompt_tokens": 1500,
+          "completion_tokens": 10,
+          "total_tokens": 1510,
+          "prompt_tokens_details": {"cached_tokens": 1024},
+        },
+      )
+    ]
+  )
+
+  await chat_session.create_response(user_id="user")
+
+  request = openai_client.chat.completions.create.await_args.kwargs
+  assert request["prompt_cache_key"] == "minerva:1:2"
+  assert PROMPT_TOKENS.get("hit") == cache_hits + 1024
+  assert PROMPT_TOKENS.get("miss") == cache_misses + 476
+
+
+def test_chat_session_shares_the_history_budget_between_images():
+  chat_session, _, _ = create_chat_session([])
+  # 765 tokens in high detail
+  image = Image(image_id="image.jpeg", height_px=1024, width_px=1024, size_bytes=0, detail="high")
+
+  assert chat_session.get_max_image_tokens(1) == 1000
+  assert chat_session.get_max_image_tokens(20) == 500
+
+  chat_session.add_message(Message("user", ImageContent(images=[image] * 12)))
+
+  assert chat_session.get_max_image_tokens(1) == 820
+  assert chat_session.get_max_image_tokens(2) == 410
+
+
+@pytest.mark.asyncio
+async def test_chat_session_adds_messages_sent_during_native_tool_calls_after_the_responses():
+  tool_started = asyncio.Event()
+  message_added = asyncio.Event()
+
+  async def fetch(url: str, **kwargs: Unpack[DefaultToolKwargs]) -> str:
+    tool_started.set()
+    await message_added.wait()
+    return f"page {url}"
+
+  chat_session, _, openai_client = create_chat_session(
+    [
+      create_completion(tool_calls=[("call-1", "fetch", json.dumps({"url": "a"}))]),
+      create_completion("Done"),
+    ],
+    tools={"fetch": fetch},
+  )
+
+  response = chat_session.create_response(user_id="user")
+  await tool_started.wait()
+  chat_session.add_message(Message("user", "are you there?"))
+  message_added.set()
+  await response
+
+  messages = openai_client.chat.completions.create.await_args_list[1].kwargs["messages"]
+  assert [m["role"] for m in messages[-3:]] == ["assistant", "tool", "user"]
+  assert messages[-2]["tool_call_id"] == "call-1"
+  assert messages[-1]["content"] == [{"type": "text", "text": "are you there?"}]
+  authors = [m.author for m in chat_session.llm_session.history.history]
+  assert authors == ["minerva", "TOOL-fetch", "user", "minerva"]
+
+
+@pytest.mark.asyncio
+async def test_chat_session_reports_malformed_text_tool_calls_to_the_model():
+  parse_failures = TOOL_CALL_PARSE_FAILURES.get("text", "tool_call")
+  chat_session, bot, openai_client = create_chat_session(
+    [
+      create_completion("Action: tool\nsum(1, 2)\nsum(3, 4"),
+      create_completion("Action: respond\nSorry"),
+    ],
+    native_tool_calls=False,
+  )
+
+  await chat_session.create_response(user_id="user")
+
+  messages = openai_client.chat.completions.create.await_args_list[1].kwargs["messages"]
+  assert messages[-1]["name"] == "TOOL-ERROR"
+  assert messages[-1]["content"].startswith("ERROR: Expected end of text")
+  assert TOOL_CALL_PARSE_FAILURES.get("text", "tool_call") == parse_failures + 1
+  assert bot.send_message.await_args.kwargs["text"] == "Sorry"
@@ -0,0 +1,118 @@
+import pytest
+
+from minerva.format_chat_history_for_openai import (
+  MISSING_IMAGE_TEXT,
+  OpenAiChatPayload,
+  format_chat_history_for_openai,
+)
+from minerva.image_store import IMAGE_STORE
+from minerva.message_history import Image, ImageContent, Message, MessageHistory
+from minerva.tool_utils import format_tool_username
+
+
+@pytest.mark.asyncio
+async def test_format_chat_history_for_openai():
+  image_id = await IMAGE_STORE.put(b"image", "image/jpeg")
+  history = MessageHistory(prompt_str="prompt", token_limit=10_000)
+  history.add(Message("user", "hello"))
+  history.add(Message(format_tool_username("fetch_html"), "<p>hi</p>"))
+  history.add(
+    Message(
+      "user",
+      ImageContent(
+        images=[Image(image_id=image_id, height_px=10, width_px=10, size_bytes=5)],
+        text="look",
+      ),
+    )
+  )
+
+  assert await format_chat_history_for_openai("prompt", history) == [
+    {"role": "system", "content": "prompt"},
+    {"role": "user", "content": [{"type": "text", "text": "hello"}], "name": "user"},
+    {"role": "system", "content": "<p>hi</p>", "name": "TOOL-fetch_html"},
+    {
+      "role": "user",
+      "content": [
+        {
+          "type": "image_url",
+          "image_url": {"url": "data:image/jpeg;base64,aW1hZ2U=", "detail": "auto"},
+        },
+        {"type": "text", "text": "look"},
+      ],
+      "name": "user",
+    },
+  ]
+
+
+@pytest.mark.asyncio
+async def test_openai_chat_payload_follows_appends_and_evictions():
+  message = Message("user0", "hello")
+  history = MessageHistory(prompt_str="", token_limit=message.len_tokens * 3)
+  payload = OpenAiChatPayload("prompt", history)
+
+  assert await payload.get_messages() == await format_chat_history_for_openai("prompt", history)
+
+  for i in range(2):
+    history.add(Message(f"user{i}", "hello"))
+  assert await payload.get_messages() == await format_chat_history_for_openai("prompt", history)
+
+  for i in range(2, 4):
+    history.add(Message(f"user{i}", "hello"))
+  assert await payload.get_messages() == await format_chat_history_for_openai("prompt", history)
+
+  # Evict everything that was synced and some of the new messages too
+  for i in range(4, 9):
+    history.add(Message(f"user{i}", "hello"))
+  assert await payload.get_messages() == await format_chat_history_for_openai("prompt", history)
+
+
+@pytest.mark.asyncio
+async def test_openai_chat_payload_reuses_converted_messages():
+  history = MessageHistory(prompt_str="", token_limit=10_000)
+  payload = OpenAiChatPayload("prompt", history)
+  history.add(Message("user", "hello"))
+
+  first = await payload.get_messages()
+  history.add(Message("user", "world"))
+  second = await payload.get_messages()
+
+  assert first[1] is second[1]
+
+
+@pytest.mark.asyncio
+async def test_openai_chat_payload_inlines_images_without_caching_them():
+  image_id = await IMAGE_STORE.put(b"image", "image/jpeg")
+  history = MessageHistory(prompt_str="", token_limit=10_000)
+  payload = OpenAiChatPayload("prompt", history)
+  history.add(
+    Message(
+      "user",
+      ImageContent(images=[Image(image_id=image_id, height_px=10, width_px=10, size_bytes=5)]),
+    )
+  )
+
+  messages = await payload.get_messages()
+
+  assert messages == await format_chat_history_for_openai("prompt", history)
+  assert "base64" not in str(history.history[0].openai_message)
+
+
+@pytest.mark.asyncio
+async def test_format_chat_history_for_openai_replaces_missing_images_with_text():
+  history = MessageHistory(prompt_str="", token_limit=10_000)
+  history.add(
+    Message(
+      "user",
+      ImageContent(
+        images=[Image(image_id="missing.jpeg", height_px=10, width_px=10, size_bytes=5)],
+        text="look",
+      ),
+    )
+  )
+
+  messages = await format_chat_history_for_openai("prompt", history)
+
+  assert messages[1].get("content") == [
+    {"type": "text", "text": MISSING_IMAGE_TEXT},
+    {"type": "text", "text": "look"},
+  ]
@@ -0,0 +1,176 @@
+from typing import Any, cast
+
+import pytest
+
+from minerva.history_store import SqliteHistoryStore
+from minerva.image_store import ImageStore
+from minerva.llm_session import CANCELLED_TOOL_RESPONSE, LlmSession
+from minerva.message_history import Image, ImageContent, Message, NativeToolCall
+
+
+def get_contents(messages: list[Message]) -> list[Any]:
+  return [message.content for message in messages]
+
+
+@pytest.mark.asyncio
+async def test_sqlite_history_store_persists_messages(tmp_path: Any):
+  path = str(tmp_path / "history.sqlite3")
+  store = SqliteHistoryStore(path)
+  image_content = ImageContent(
+    images=[Image(image_id="image.jpeg", height_px=10, width_px=20, size_bytes=4)],
+    text="look",
+  )
+  store.add(1, 2, Message("user", "hello"))
+  store.add(1, 2, Message("user", image_content))
+  store.add(1, 3, Message("user", "other topic"))
+  await store.close()
+
+  store = SqliteHistoryStore(path)
+  messages = await store.load(1, 2)
+  await store.close()
+
+  assert get_contents(messages) == ["hello", image_content]
+  assert messages[0].len_tokens == Message("user", "hello").len_tokens
+
+
+@pytest.mark.asyncio
+async def test_sqlite_history_store_loads_buffered_writes(tmp_path: Any):
+  store = SqliteHistoryStore(str(tmp_path / "history.sqlite3"), flush_interval_sec=3600)
+  store.add(1, 2, Message("user", "hello"))
+
+  assert get_contents(await store.load(1, 2)) == ["hello"]
+  await store.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_history_store_trims_history(tmp_path: Any):
+  store = SqliteHistoryStore(str(tmp_path / "history.sqlite3"), max_pending_writes=2)
+  for i in range(5):
+    store.add(1, 2, Message("user", f"message {i}"))
+  store.trim(1, 2, keep_last=2)
+
+  assert get_contents(await store.load(1, 2)) == ["message 3", "message 4"]
+  await store.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_history_store_replaces_summary(tmp_path: Any):
+  path = str(tmp_path / "history.sqlite3")
+  store = SqliteHistoryStore(path)
+  assert await store.load_summary(1, 2) is None
+  store.set_summary(1, 2, "first")
+  store.set_summary(1, 2, "second")
+  store.set_summary(1, 3, "other topic")
+  await store.close()
+
+  store = SqliteHistoryStore(path)
+  assert await store.load_summary(1, 2) == "second"
+  await store.close()
+
+
+@pytest.mark.asyncio
+async def test_llm_session_trims_the_store_when_history_is_restored(tmp_path: Any):
+  store = SqliteHistoryStore(str(tmp_path / "history.sqlite3"))
+  message = Message("user", "message 0")
+  for i in range(5):
+    store.add(1, 2, Message("user", f"message {i}"))
+  llm_session = LlmSession(
+    ai_username="minerva",
+    openai_client=cast(Any, None),
+    openai_model_name="gpt-5.4",
+    max_completion_tokens=100,
+    max_history_tokens=message.len_tokens * 2,
+    prompt="",
+    history_store=store.for_topic(1, 2),
+  )
+
+  await llm_session.load_history()
+
+  assert get_contents(list(llm_session.history.history)) == ["message 3", "message 4"]
+  assert get_contents(await store.load(1, 2)) == ["message 3", "message 4"]
+  await store.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_history_store_loads_the_image_references(tmp_path: Any):
+  store = SqliteHistoryStore(str(tmp_path / "history.sqlite3"))
+  image = Image(image_id="abc.jpeg", height_px=10, width_px=20, size_bytes=30)
+  store.add(1, 2, Message("user", ImageContent(images=[image, image], text='"images": ')))
+  store.add(1, 3, Message("user", ImageContent(images=[image])))
+  store.add(1, 3, Message("user", '"images": [{"image_id": "text.jpeg"}]'))
+
+  assert await store.load_image_ids() == ["abc.jpeg", "abc.jpeg", "abc.jpeg"]
+  await store.close()
+
+
+@pytest.mark.asyncio
+async def test_llm_session_deletes_the_images_of_evicted_messages(
+  tmp_path: Any, monkeypatch: pytest.MonkeyPatch
+):
+  image_store = ImageStore(str(tmp_path / "images"), max_memory_bytes=1024)
+  monkeypatch.setattr("minerva.llm_session.IMAGE_STORE", image_store)
+  history_store = SqliteHistoryStore(str(tmp_path / "history.sqlite3"))
+  message = Message("user", "hello")
+  llm_session = LlmSession(
+    ai_username="minerva",
+    openai_client=cast(Any, None),
+    openai_model_name="gpt-5.4",
+    max_completion_tokens=100,
+    max_history_tokens=message.len_tokens * 2,
+    prompt="",
+    history_store=history_store.for_topic(1, 2),
+  )
+  image_id = await image_store.put(b"image", "image/png")
+  image = Image(image_id=image_id, height_px=1, width_px=1, size_bytes=5)
+
+  llm_session.add_message(Message("user", ImageContent(images=[image])))
+  for _ in range(3):
+    llm_session.add_message(Message("user", "hello"))
+  await image_store.close()
+
+  assert await image_store.get(image_id) is None
+  assert await history_store.load_image_ids() == []
+  await history_store.close()
+
+
+@pytest.mark.asyncio
+async def test_llm_session_answers_the_tool_calls_left_unanswered_in_the_store(tmp_path: Any):
+  store = SqliteHistoryStore(str(tmp_path / "history.sqlite3"))
+  tool_calls = (
+    NativeToolCall("call-1", "fetch", '{"url": "a"}'),
+    NativeToolCall("call-2", "fetch", '{"url": "b"}'),
+  )
+  store.add(1, 2, Message("user", "fetch a and b"))
+  store.add(1, 2, Message("minerva", "", tool_calls=tool_calls))
+  store.add(1, 2, Message("TOOL-fetch", "page a", tool_call_id="call-1"))
+
+  def create_llm_session() -> LlmSession:
+    return LlmSession(
+      ai_username="minerva",
+      openai_client=cast(Any, None),
+      openai_model_name="gpt-5.4",
+      max_completion_tokens=100,
+      max_history_tokens=10_000,
+      prompt="",
+      history_store=store.for_topic(1, 2),
+    )
+
+  llm_session = create_llm_session()
+  await llm_session.load_history()
+  llm_session.add_message(Message("user", "are you there?"))
+
+  expected = [
+    (None, "fetch a and b"),
+    (None, ""),
+    ("call-1", "page a"),
+    ("call-2", CANCELLED_TOOL_RESPONSE),
+    (None, "are you there?"),
+  ]
+  history = list(llm_session.history.history)
+  assert [(m.tool_call_id, m.content) for m in history] == expected
+  # The missing response is stored too
+  restored_session = create_llm_session()
+  await restored_session.load_history()
+  restored_history = list(restored_session.history.history)
+  assert [(m.tool_call_id, m.content) for m in restored_history] == expected
+  await store.close()
@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import AsyncMock
+
+import pytest
+
+from minerva.format_chat_history_for_openai import SUMMARY_HEADER
+from minerva.history_summarizer import HistorySummarizer
+from minerva.llm_session import LlmSession
+from minerva.message_history import Message
+
+
+def create_openai_client(*summaries: str) -> Any:
+  completions = [
+    SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=summary))])
+    for summary in summaries
+  ]
+  return SimpleNamespace(
+    chat=SimpleNamespace(completions=SimpleNamespace(create=AsyncMock(side_effect=completions)))
+  )
+
+
+@pytest.mark.asyncio
+async def test_history_summarizer_merges_messages_into_the_summary():
+  openai_client = create_openai_client("Alice likes Rust")
+  summarizer = HistorySummarizer(openai_client, "cheap-model", max_summary_tokens=100)
+
+  summary = await summarizer.summarize(
+    "Alice asked about Rust",
+    [Message("alice", "I like it"), Message("TOOL-fetch_html", "x" * 1000)],
+  )
+
+  assert summary == "Alice likes Rust"
+  request = openai_client.chat.completions.create.await_args.kwargs
+  assert request["model"] == "cheap-model"
+  assert request["max_completion_tokens"] == 100
+  content = request["messages"][1]["content"]
+  assert "Current summary:\nAlice asked about Rust" in content
+  assert "alice: I like it" in content
+  # Tool responses are cut short
+  assert "x" * 1000 not in content
+
+
+@pytest.mark.asyncio
+async def test_llm_session_pins_the_summary_of_evicted_messages():
+  message = Message("user0", "hello")
+  summarizer = HistorySummarizer(
+    create_openai_client("user0 and user1 said hello"), "cheap-model", max_summary_tokens=10
+  )
+  llm_session = LlmSession(
+    ai_username="minerva",
+    openai_client=create_openai_client(),
+    openai_model_name="gpt-5.4",
+    max_completion_tokens=100,
+    max_history_tokens=message.len_tokens * 4 + 10,
+    prompt="",
+    summarizer=summarizer,
+  )
+
+  for i in range(6):
+    llm_session.add_message(Message(f"user{i}", "hello"))
+  await asyncio.wait_for(llm_session.wait_for_summary(), timeout=1)
+
+  assert [m.author for m in llm_session.history.history] == ["user2", "user3", "user4", "user5"]
+  assert llm_session.summary == "user0 and user1 said hello"
+  messages = await llm_session.payload.get_messages()
+  assert messages[1] == {
+    "role": "system",
+    "content": f"{SUMMARY_HEADER}\nuser0 and user1 said hello",
+  }
+  assert len(messages) == 6
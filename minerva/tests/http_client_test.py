@@ -0,0 +1,18 @@
+import pytest
+
+from minerva.http_client import HttpClientRegistry
+
+
+@pytest.mark.asyncio
+async def test_http_client_registry_shares_a_client_per_host():
+  http_clients = HttpClientRegistry()
+
+  client = http_clients.get("https://example.com/calendar.ics")
+  assert http_clients.get("https://example.com/image.png") is client
+  assert http_clients.get("https://example.org/image.png") is not client
+  assert http_clients.get("http://example.com/image.png") is not client
+
+  await http_clients.close()
+  assert client.is_closed
+  with pytest.raises(RuntimeError):
+    http_clients.get("https://example.com/calendar.ics")
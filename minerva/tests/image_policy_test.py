@@ -0,0 +1,63 @@
+from telegram import PhotoSize
+
+from minerva.image_policy import select_photo_size
+from minerva.message_history import get_image_token_count_for_size
+
+
+def create_photo(width: int, height: int) -> tuple[PhotoSize, ...]:
+  # Telegram sends the sizes from the smallest to the largest
+  sides = [90, 320, 800, 1280]
+  return tuple(
+    PhotoSize(
+      file_id=f"file-{w}",
+      file_unique_id=f"unique-{w}",
+      width=w * width // max(width, height),
+      height=w * height // max(width, height),
+    )
+    for w in sides
+    if w <= max(width, height)
+  )
+
+
+def test_get_image_token_count_for_size():
+  assert get_image_token_count_for_size(4096, 4096, "low") == 85
+  # 512x512 is a single tile
+  assert get_image_token_count_for_size(512, 512, "high") == 255
+  # 1024x1024 is scaled down to 768x768, 2x2 tiles
+  assert get_image_token_count_for_size(1024, 1024, "high") == 765
+  # 2048x4096 is scaled down to 1024x2048 and then to 768x1536, 2x3 tiles
+  assert get_image_token_count_for_size(2048, 4096, "high") == 1105
+  assert get_image_token_count_for_size(1280, 720, "auto") == 1105
+
+
+def test_select_photo_size_picks_the_largest_size_within_budget():
+  choice = select_photo_size(create_photo(1280, 960), max_image_tokens=1105)
+
+  assert (choice.photo_size.width, choice.photo_size.height) == (1280, 960)
+  assert choice.detail == "high"
+  assert choice.token_count == 765
+
+
+def test_select_photo_size_downgrades_resolution_to_fit_budget():
+  # 1280x320 is 3x1 tiles, 800x200 is 2x1 tiles
+  choice = select_photo_size(create_photo(1280, 320), max_image_tokens=500)
+
+  assert (choice.photo_size.width, choice.photo_size.height) == (800, 200)
+  assert choice.detail == "high"
+  assert choice.token_count == 425
+
+
+def test_select_photo_size_uses_low_detail_for_small_photos():
+  choice = select_photo_size(create_photo(320, 240), max_image_tokens=1105)
+
+  assert (choice.photo_size.width, choice.photo_size.height) == (320, 240)
+  assert choice.detail == "low"
+  assert choice.token_count == 85
+
+
+def test_select_photo_size_falls_back_to_low_detail():
+  choice = select_photo_size(create_photo(1280, 960), max_image_tokens=100)
+
+  assert (choice.photo_size.width, choice.photo_size.height) == (320, 240)
+  assert choice.detail == "low"
+  assert choice.token_count == 85
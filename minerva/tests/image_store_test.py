@@ -0,0 +1,95 @@
+import importlib
+from typing import Any
+
+import pytest
+
+import minerva.config
+from minerva.image_store import ImageStore
+
+
+@pytest.mark.asyncio
+async def test_image_store_returns_data_urls(tmp_path: Any):
+  store = ImageStore(str(tmp_path), max_memory_bytes=1024)
+
+  image_id = await store.put(b"image", "image/png")
+
+  assert image_id.endswith(".png")
+  assert await store.get_data_url(image_id) == "data:image/png;base64,aW1hZ2U="
+
+
+@pytest.mark.asyncio
+async def test_image_store_deduplicates_images(tmp_path: Any):
+  store = ImageStore(str(tmp_path), max_memory_bytes=1024)
+
+  assert await store.put(b"image", "image/png") == await store.put(b"image", "image/png")
+  assert len(list(tmp_path.iterdir())) == 1
+
+
+@pytest.mark.asyncio
+async def test_image_store_reads_images_evicted_from_memory_from_disk(tmp_path: Any):
+  store = ImageStore(str(tmp_path), max_memory_bytes=8)
+
+  first_image_id = await store.put(b"first", "image/png")
+  await store.put(b"second", "image/png")
+
+  first_image = await store.get(first_image_id)
+  assert first_image is not None and first_image.data == b"first"
+  first_image = await ImageStore(str(tmp_path), max_memory_bytes=8).get(first_image_id)
+  assert first_image is not None and first_image.data == b"first"
+
+
+@pytest.mark.asyncio
+async def test_image_store_returns_none_for_missing_images(tmp_path: Any):
+  store = ImageStore(str(tmp_path), max_memory_bytes=1024)
+
+  assert await store.get("missing.png") is None
+  assert await ImageStore(None, max_memory_bytes=1024).get_data_url("missing.png") is None
+
+
+@pytest.mark.asyncio
+async def test_image_store_deletes_images_when_the_last_reference_is_released(tmp_path: Any):
+  store = ImageStore(str(tmp_path), max_memory_bytes=1024)
+  image_id = await store.put(b"image", "image/png")
+  await store.put(b"image", "image/png")
+
+  store.release([image_id])
+  await store.close()
+  assert await store.get(image_id) is not None
+
+  store.release([image_id])
+  await store.close()
+  assert await store.get(image_id) is None
+  assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_image_store_keeps_images_stored_again_before_the_delete(tmp_path: Any):
+  store = ImageStore(str(tmp_path), max_memory_bytes=1024)
+  image_id = await store.put(b"image", "image/png")
+
+  store.release([image_id])
+  await store.put(b"image", "image/png")
+  await store.close()
+
+  assert await ImageStore(str(tmp_path), max_memory_bytes=1024).get(image_id) is not None
+
+
+@pytest.mark.asyncio
+async def test_image_store_collects_the_images_left_unreferenced(tmp_path: Any):
+  store = ImageStore(str(tmp_path), max_memory_bytes=1024)
+  kept_image_id = await store.put(b"kept", "image/png")
+  deleted_image_id = await store.put(b"deleted", "image/png")
+
+  restarted_store = ImageStore(str(tmp_path), max_memory_bytes=1024)
+  await restarted_store.collect_garbage([kept_image_id])
+
+  assert await restarted_store.get(kept_image_id) is not None
+  assert await restarted_store.get(deleted_image_id) is None
+
+
+def test_image_store_dir_uses_a_temporary_directory_when_empty(monkeypatch: pytest.MonkeyPatch):
+  monkeypatch.setenv("IMAGE_STORE_DIR", "")
+
+  assert importlib.reload(minerva.config).IMAGE_STORE_DIR is None
+  monkeypatch.undo()
+  importlib.reload(minerva.config)
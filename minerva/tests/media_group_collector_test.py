@@ -0,0 +1,35 @@
+import asyncio
+import datetime
+
+import pytest
+from telegram import Chat, Message as TelegramMessage
+
+from minerva.media_group_collector import MediaGroupCollector
+
+
+def create_message(message_id: int, media_group_id: str) -> TelegramMessage:
+  return TelegramMessage(
+    message_id=message_id,
+    date=datetime.datetime.now(),
+    chat=Chat(id=1, type=Chat.SUPERGROUP),
+    media_group_id=media_group_id,
+  )
+
+
+@pytest.mark.asyncio
+async def test_media_group_collector_passes_whole_groups_at_once():
+  media_groups: list[list[int]] = []
+
+  async def on_media_group(messages: list[TelegramMessage]):
+    media_groups.append([m.message_id for m in messages])
+
+  collector = MediaGroupCollector(on_media_group, wait_sec=0.05)
+  collector.add(create_message(2, "album"))
+  collector.add(create_message(3, "other album"))
+  await asyncio.sleep(0.02)
+  collector.add(create_message(1, "album"))
+  assert media_groups == []
+
+  await asyncio.sleep(0.1)
+
+  assert sorted(media_groups) == [[1, 2], [3]]
@@ -0,0 +1,179 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import tiktoken
+
+from minerva.message_history import (
+  Image,
+  ImageContent,
+  Message,
+  MessageHistory,
+  NativeToolCall,
+  get_tokenizer,
+  trim_by_token_size,
+)
+
+
+def get_history_authors(history: MessageHistory) -> list[str]:
+  return [message.author for message in history.history]
+
+
+def test_message_history_keeps_messages_within_token_limit():
+  message = Message("user0", "hello")
+  history = MessageHistory(prompt_str="", token_limit=message.len_tokens * 3)
+
+  for i in range(3):
+    history.add(Message(f"user{i}", "hello"))
+
+  assert get_history_authors(history) == ["user0", "user1", "user2"]
+  assert history.current_tokens == message.len_tokens * 3
+
+
+def test_message_history_evicts_oldest_messages():
+  message = Message("user0", "hello")
+  history = MessageHistory(prompt_str="", token_limit=message.len_tokens * 3)
+
+  for i in range(5):
+    history.add(Message(f"user{i}", "hello"))
+
+  assert get_history_authors(history) == ["user2", "user3", "user4"]
+  assert history.current_tokens == message.len_tokens * 3
+
+
+def test_message_history_evicts_multiple_messages_to_fit_a_large_one():
+  short_message = Message("user0", "hello")
+  long_message = Message("long", "hello " * 10)
+  history = MessageHistory(
+    prompt_str="", token_limit=short_message.len_tokens * 2 + long_message.len_tokens
+  )
+
+  for i in range(5):
+    history.add(Message(f"user{i}", "hello"))
+  history.add(Message("long", "hello " * 10))
+
+  assert get_history_authors(history) == ["user3", "user4", "long"]
+  assert history.current_tokens == short_message.len_tokens * 2 + long_message.len_tokens
+
+
+def test_message_history_evicts_in_blocks():
+  message = Message("user0", "hello")
+  history = MessageHistory(
+    prompt_str="", token_limit=message.len_tokens * 8, eviction_block_ratio=0.25
+  )
+
+  for i in range(9):
+    history.add(Message(f"user{i}", "hello"))
+
+  # Over the limit, evict down to 75% of it at once
+  assert get_history_authors(history) == [f"user{i}" for i in range(3, 9)]
+  assert history.evicted_count == 3
+
+  # The history starts with the same message until it's full again
+  for i in range(9, 11):
+    history.add(Message(f"user{i}", "hello"))
+  assert get_history_authors(history)[0] == "user3"
+  assert history.evicted_count == 3
+
+
+def test_message_history_counts_prompt_tokens():
+  message = Message("user0", "hello")
+  history = MessageHistory(prompt_str="prompt", token_limit=message.len_tokens * 2)
+
+  history.add(Message("user0", "hello"))
+  history.add(Message("user1", "hello"))
+
+  assert get_history_authors(history) == ["user1"]
+
+
+def test_message_history_counts_messages_only_near_the_limit():
+  history = MessageHistory(prompt_str="", token_limit=1000)
+
+  for i in range(3):
+    history.add(Message(f"user{i}", "hello"))
+
+  assert not any(message.is_counted for message in history.history)
+  assert history.current_tokens >= sum(message.len_tokens for message in history.history)
+
+  history.add(Message("long", "hello " * 200))
+
+  assert all(message.is_counted for message in history.history)
+  assert history.current_tokens == sum(message.len_tokens for message in history.history)
+
+
+def test_trim_by_token_size_matches_full_encoding():
+  tokenizer = get_tokenizer()
+  message = "".join(f"line {i}: some words, numbers {i * 7919} and ünïcödé\n" for i in range(5000))
+
+  for token_limit in [1, 10, 100, 1000]:
+    expected = tokenizer.decode(tokenizer.encode(message)[:token_limit]) + "..."
+    assert trim_by_token_size(message, token_limit, "...") == expected
+
+
+def test_trim_by_token_size_keeps_short_messages():
+  assert trim_by_token_size("hello world", 2, "...") == "hello world"
+  assert trim_by_token_size("hello world", 1, "...") == "hello..."
+
+
+def test_message_history_evicts_tool_responses_together_with_tool_calls():
+  tool_call = NativeToolCall("call-1", "sum", '{"a": 1, "b": 2}')
+  messages = [
+    Message("minerva", "", tool_calls=(tool_call,)),
+    Message("TOOL-sum", "3", tool_call_id="call-1"),
+    Message("user0", "hello"),
+    Message("user1", "hello"),
+  ]
+  history = MessageHistory(
+    prompt_str="", token_limit=sum(message.len_tokens for message in messages) - 1
+  )
+  for message in messages:
+    history.add(message)
+
+  assert get_history_authors(history) == ["user0", "user1"]
+
+
+def test_get_tokenizer_loads_the_tokenizer_once_for_concurrent_calls(
+  monkeypatch: pytest.MonkeyPatch,
+):
+  tokenizer = get_tokenizer()
+  load_count = 0
+
+  def get_encoding(encoding_name: str) -> tiktoken.Encoding:
+    nonlocal load_count
+    load_count += 1
+    time.sleep(0.05)
+    return tokenizer
+
+  monkeypatch.setattr("minerva.message_history._tokenizer", None)
+  monkeypatch.setattr("minerva.message_history.tiktoken.get_encoding", get_encoding)
+  with ThreadPoolExecutor(max_workers=4) as executor:
+    futures = [executor.submit(get_tokenizer) for _ in range(4)]
+    tokenizers = [future.result() for future in futures]
+
+  assert load_count == 1
+  assert all(t is tokenizer for t in tokenizers)
+
+
+def test_message_history_evicts_tool_responses_that_dont_follow_the_tool_calls():
+  tool_call = NativeToolCall("call-1", "sum", '{"a": 1, "b": 2}')
+  messages = [
+    Message("minerva", "", tool_calls=(tool_call,)),
+    Message("user0", "hello"),
+    Message("TOOL-sum", "3", tool_call_id="call-1"),
+    Message("user1", "hello"),
+  ]
+  history = MessageHistory(
+    prompt_str="", token_limit=sum(message.len_tokens for message in messages) - 1
+  )
+  for message in messages:
+    history.add(message)
+
+  assert get_history_authors(history) == ["user1"]
+
+
+def test_message_size_counts_utf8_bytes():
+  assert Message("user", "hello").size_bytes == 9
+  # "привет" is 6 characters, but 12 bytes in UTF-8
+  assert Message("user", "привет").size_bytes == 16
+  image = Image(image_id="image.jpeg", height_px=1, width_px=1, size_bytes=100)
+  assert Message("user", ImageContent(images=[image], text="привет")).size_bytes == 116
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from minerva.metrics import Counter, Gauge, Histogram, format_metrics
+from minerva.metrics_server import MetricsServer
+
+
+def test_histogram_formats_cumulative_buckets():
+  histogram = Histogram("test_duration_seconds", "Test durations", ("tool",), buckets=(0.1, 1))
+  histogram.observe("fetch", value=0.05)
+  histogram.observe("fetch", value=0.1)
+  histogram.observe("fetch", value=5)
+
+  assert histogram.format() == [
+    "# HELP test_duration_seconds Test durations",
+    "# TYPE test_duration_seconds histogram",
+    'test_duration_seconds_bucket{tool="fetch",le="0.1"} 2',
+    'test_duration_seconds_bucket{tool="fetch",le="1"} 2',
+    'test_duration_seconds_bucket{tool="fetch",le="+Inf"} 3',
+    'test_duration_seconds_sum{tool="fetch"} 5.15',
+    'test_duration_seconds_count{tool="fetch"} 3',
+  ]
+
+
+def test_counter_and_gauge_format_labels():
+  counter = Counter("test_total", "Test counter", ("mode",))
+  counter.inc("text", amount=2)
+  gauge = Gauge("test_sessions", "Test gauge")
+  gauge.set(value=3)
+
+  assert counter.format()[2:] == ['test_total{mode="text"} 2']
+  assert gauge.format()[2:] == ["test_sessions 3"]
+  with pytest.raises(ValueError):
+    counter.inc()
+
+
+@pytest.mark.asyncio
+async def test_metrics_server_serves_metrics():
+  collect_count = 0
+
+  def on_collect():
+    nonlocal collect_count
+    collect_count += 1
+
+  server = MetricsServer("127.0.0.1", 0, on_collect=on_collect)
+  await server.start()
+  try:
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    response = (await reader.read()).decode("utf-8")
+    writer.close()
+  finally:
+    await server.close()
+
+  headers, body = response.split("\r\n\r\n", 1)
+  assert headers.startswith("HTTP/1.0 200 OK")
+  assert body == format_metrics()
+  assert "# TYPE minerva_response_duration_seconds histogram" in body
+  assert collect_count == 1
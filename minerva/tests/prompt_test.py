@@ -1,4 +1,4 @@
-from minerva.prompt import ModelAction, ModelMessage, parse_model_message
+from minerva.prompt import ModelAction, ModelMessage, Prompt, parse_model_message
 
 
 def test_parse_model_message_parses_respond_action():
@@ -63,3 +63,16 @@ def test_parse_model_message_no_content():
 
   parsed = parse_model_message(model_message)
   assert parsed == ModelMessage(ModelAction.RESPOND, "")
+
+
+def test_prompt_replaces_the_persona():
+  default_prompt = str(Prompt(ai_name="Minerva", ai_username="minerva_bot", tools={}))
+  prompt = str(
+    Prompt(ai_name="Minerva", ai_username="minerva_bot", tools={}, persona_prompt="You are a cat.")
+  )
+
+  assert prompt.startswith("You are a cat.\n\n")
+  assert default_prompt.startswith("You are Minerva, she/her")
+  assert (
+    prompt.split("\n\n", 1)[1] == default_prompt.split("Never repeat yourself. Be original.\n\n")[1]
+  )
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from minerva.response_scheduler import ResponseRequest, ResponseScheduler
+
+
+@pytest.mark.asyncio
+async def test_response_scheduler_coalesces_requests_made_during_a_response():
+  handled_requests: list[ResponseRequest] = []
+  release_first_response = asyncio.Event()
+
+  async def create_response(request: ResponseRequest):
+    handled_requests.append(request)
+    if len(handled_requests) == 1:
+      await release_first_response.wait()
+
+  scheduler = ResponseScheduler(create_response)
+  first = scheduler.submit(ResponseRequest("user1", 1))
+  await asyncio.sleep(0)
+  second = scheduler.submit(ResponseRequest("user2", 2))
+  third = scheduler.submit(ResponseRequest("user3", 3))
+  assert second is third
+
+  release_first_response.set()
+  await asyncio.gather(first, second, third)
+
+  assert handled_requests == [ResponseRequest("user1", 1), ResponseRequest("user3", 3)]
+  assert not scheduler.is_busy
+
+
+@pytest.mark.asyncio
+async def test_response_scheduler_runs_responses_one_at_a_time():
+  running_count = 0
+  max_running_count = 0
+
+  async def create_response(request: ResponseRequest):
+    nonlocal running_count, max_running_count
+    running_count += 1
+    max_running_count = max(max_running_count, running_count)
+    await asyncio.sleep(0.01)
+    running_count -= 1
+
+  scheduler = ResponseScheduler(create_response)
+  for i in range(3):
+    scheduler.submit(ResponseRequest(f"user{i}"))
+    await asyncio.sleep(0)
+  await scheduler.submit(ResponseRequest("last"))
+
+  assert max_running_count == 1
+
+
+@pytest.mark.asyncio
+async def test_response_scheduler_survives_failed_responses():
+  handled_requests: list[ResponseRequest] = []
+
+  async def create_response(request: ResponseRequest):
+    handled_requests.append(request)
+    raise ValueError("boom")
+
+  scheduler = ResponseScheduler(create_response)
+  await scheduler.submit(ResponseRequest("user1"))
+  await scheduler.submit(ResponseRequest("user2"))
+
+  assert len(handled_requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_response_scheduler_cancels_the_current_response():
+  handled_requests: list[ResponseRequest] = []
+  cancelled_requests: list[ResponseRequest] = []
+
+  async def create_response(request: ResponseRequest):
+    handled_requests.append(request)
+    if len(handled_requests) == 1:
+      try:
+        await asyncio.sleep(10)
+      except asyncio.CancelledError:
+        cancelled_requests.append(request)
+        raise
+
+  scheduler = ResponseScheduler(create_response)
+  first = scheduler.submit(ResponseRequest("user1", 1))
+  await asyncio.sleep(0)
+  await asyncio.sleep(0)
+  assert scheduler.current_request == ResponseRequest("user1", 1)
+
+  assert scheduler.cancel_current()
+  second = scheduler.submit(ResponseRequest("user1", 2))
+  await asyncio.wait_for(asyncio.gather(first, second), timeout=1)
+
+  assert handled_requests == [ResponseRequest("user1", 1), ResponseRequest("user1", 2)]
+  assert cancelled_requests == [ResponseRequest("user1", 1)]
+  assert scheduler.current_request is None
+  assert not scheduler.cancel_current()
+  assert not scheduler.is_busy
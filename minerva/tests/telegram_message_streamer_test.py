@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import AsyncMock
+
+import pytest
+from telegram.constants import ParseMode
+
+from minerva.telegram_message_streamer import TelegramMessageStreamer
+
+
+class FakeBot:
+  def __init__(self):
+    self.sent_message_count = 0
+    self.send_message = AsyncMock(side_effect=self._send_message)
+    self.edit_message_text = AsyncMock()
+    self.delete_message = AsyncMock()
+
+  async def _send_message(self, **kwargs: Any):
+    self.sent_message_count += 1
+    return SimpleNamespace(message_id=self.sent_message_count)
+
+
+def create_streamer(bot: FakeBot, max_message_length_char: int = 2000):
+  return TelegramMessageStreamer(
+    bot=bot,  # type: ignore
+    chat_id=1,
+    topic_id=2,
+    reply_to_message_id=3,
+    max_message_length_char=max_message_length_char,
+    edit_interval_sec=0,
+  )
+
+
+@pytest.mark.asyncio
+async def test_streamer_sends_then_edits_respond_messages():
+  bot = FakeBot()
+  streamer = create_streamer(bot)
+
+  await streamer.on_answer_update("Action: res")
+  assert not streamer.is_streaming
+
+  await streamer.on_answer_update("Action: respond\nHel")
+  assert streamer.is_streaming
+  assert bot.send_message.await_args is not None
+  assert bot.send_message.await_args.kwargs["text"] == "Hel"
+  assert bot.send_message.await_args.kwargs["parse_mode"] is None
+  assert bot.send_message.await_args.kwargs["reply_to_message_id"] == 3
+
+  await streamer.on_answer_update("Action: respond\nHello *world")
+  assert bot.edit_message_text.await_args is not None
+  assert bot.edit_message_text.await_args.kwargs["text"] == "Hello *world"
+
+  await streamer.finish("Hello *world*")
+  assert bot.send_message.await_count == 1
+  assert bot.edit_message_text.await_args.kwargs["text"] == "Hello *world*"
+  assert bot.edit_message_text.await_args.kwargs["parse_mode"] == ParseMode.MARKDOWN
+
+
+@pytest.mark.asyncio
+async def test_streamer_rolls_over_into_new_messages():
+  bot = FakeBot()
+  streamer = create_streamer(bot, max_message_length_char=10)
+
+  await streamer.on_answer_update("Action: respond\nhello")
+  await streamer.on_answer_update("Action: respond\nhello world")
+
+  assert bot.send_message.await_count == 2
+  sent_texts = [call.kwargs["text"] for call in bot.send_message.await_args_list]
+  assert sent_texts == ["hello", "world"]
+
+
+@pytest.mark.asyncio
+async def test_streamer_deletes_messages_not_needed_by_the_final_answer():
+  bot = FakeBot()
+  streamer = create_streamer(bot, max_message_length_char=10)
+
+  await streamer.on_answer_update("Action: respond\nhello wonderful world")
+  assert bot.send_message.await_count == 3
+
+  await streamer.finish("hello")
+
+  assert bot.edit_message_text.await_args is not None
+  assert bot.edit_message_text.await_args.kwargs["message_id"] == 1
+  assert bot.edit_message_text.await_args.kwargs["text"] == "hello"
+  deleted_ids = [call.kwargs["message_id"] for call in bot.delete_message.await_args_list]
+  assert deleted_ids == [2, 3]
+
+  # Later updates don't touch the deleted messages
+  await streamer.finish("hello world")
+  assert bot.send_message.await_count == 4
+  assert bot.delete_message.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_streamer_ignores_tool_calls():
+  bot = FakeBot()
+  streamer = create_streamer(bot)
+
+  await streamer.on_answer_update("Action: tool\nfetch_html('https://example.com')")
+
+  assert not streamer.is_streaming
+  assert bot.send_message.await_count == 0
@@ -1,5 +1,17 @@
 from typing import Unpack
-from minerva.tool_utils import GenericToolFn, ToolCall, format_tool, parse_tool_call
+
+import pyparsing as pp
+import pytest
+
+from minerva.tool_utils import (
+  GenericToolFn,
+  ToolCall,
+  format_tool,
+  get_tool_json_schema,
+  parse_native_tool_call,
+  parse_tool_call,
+  parse_tool_calls,
+)
 from minerva.tools.tool_kwargs import DefaultToolKwargs
 
 
@@ -101,3 +113,151 @@ def test_parse_tool_call_supports_arguments_with_dashes():
   assert toolCall == ToolCall(
     tool_name="fetch", args=["https://github.com/move-fast-and-break-things"]
   )
+
+
+def test_parse_tool_call_supports_multiline_string_arguments():
+  tools: dict[str, GenericToolFn] = {
+    "fetch": fetch,
+  }
+
+  toolCall = parse_tool_call("fetch('first line\nsecond line')\n", tools)
+  assert toolCall == ToolCall(tool_name="fetch", args=["first line\nsecond line"])
+
+
+def test_parse_tool_call_supports_string_arguments_with_escaped_quotes():
+  tools: dict[str, GenericToolFn] = {
+    "fetch": fetch,
+  }
+
+  toolCall = parse_tool_call("fetch('it\\'s')", tools)
+  assert toolCall == ToolCall(tool_name="fetch", args=["it's"])
+
+
+def test_parse_tool_call_converts_string_arguments_to_the_signature_types():
+  tools: dict[str, GenericToolFn] = {
+    "sum": sum,
+  }
+
+  toolCall = parse_tool_call("sum('1', \"2\")", tools)
+  assert toolCall == ToolCall(tool_name="sum", args=[1, 2])
+
+  try:
+    parse_tool_call("sum('1')", tools)
+    assert False
+  except ValueError as e:
+    assert str(e) == "The number of arguments does not match the tool's signature."
+
+
+async def greet(name: str, greeting: str = "Hello", **kwargs: Unpack[DefaultToolKwargs]) -> str:
+  """Greet someone.
+
+  Args:
+    name: The name of the person
+      to greet.
+    greeting: The greeting to use.
+
+  Use it to be polite.
+  """
+  return f"{greeting}, {name}!"
+
+
+@pytest.mark.parametrize("message", ["sum(1, 2) garbage", "fetch('a')\nsum(1, 2"])
+def test_parse_tool_call_fails_on_trailing_text(message: str):
+  tools: dict[str, GenericToolFn] = {
+    "sum": sum,
+    "fetch": fetch,
+  }
+
+  with pytest.raises(pp.ParseException):
+    parse_tool_call(message, tools)
+
+
+def test_get_tool_json_schema():
+  assert get_tool_json_schema("greet", greet) == {
+    "type": "function",
+    "function": {
+      "name": "greet",
+      "description": "Greet someone.\n\nUse it to be polite.",
+      "parameters": {
+        "type": "object",
+        "properties": {
+          "name": {"type": "string", "description": "The name of the person to greet."},
+          "greeting": {
+            "type": "string",
+            "description": "The greeting to use.",
+            "default": "Hello",
+          },
+        },
+        "required": ["name"],
+        "additionalProperties": False,
+      },
+    },
+  }
+
+  schema = get_tool_json_schema("sum", sum)
+  assert schema["function"].get("parameters") == {
+    "type": "object",
+    "properties": {"a": {"type": "integer"}, "b": {"type": "integer"}},
+    "required": ["a", "b"],
+    "additionalProperties": False,
+  }
+
+
+def test_parse_native_tool_call():
+  tools: dict[str, GenericToolFn] = {
+    "sum": sum,
+    "greet": greet,
+  }
+
+  assert parse_native_tool_call("sum", '{"a": 1, "b": "2"}', tools) == ToolCall("sum", [1, 2])
+  assert parse_native_tool_call("greet", '{"name": "Bob"}', tools) == ToolCall(
+    "greet", ["Bob", "Hello"]
+  )
+
+  for tool_name, arguments, error in [
+    ("do_x", "{}", "Tool do_x not found."),
+    ("sum", '{"a": 1}', "Missing argument: b."),
+    ("sum", '{"a": 1, "b": 2, "c": 3}', "Unknown arguments: c."),
+    ("sum", "[1, 2]", "Tool arguments must be a JSON object."),
+  ]:
+    try:
+      parse_native_tool_call(tool_name, arguments, tools)
+      assert False
+    except ValueError as e:
+      assert str(e) == error
+
+
+def test_parse_tool_calls_parses_one_call_per_line():
+  tools: dict[str, GenericToolFn] = {
+    "sum": sum,
+    "fetch": fetch,
+  }
+
+  assert parse_tool_calls("fetch('https://example.com')", tools) == [
+    ToolCall(tool_name="fetch", args=["https://example.com"])
+  ]
+  assert parse_tool_calls(
+    "sum(1, 2)\nfetch('multiline\ncontent')\nfetch(\"https://example.com\")", tools
+  ) == [
+    ToolCall(tool_name="sum", args=[1, 2]),
+    ToolCall(tool_name="fetch", args=["multiline\ncontent"]),
+    ToolCall(tool_name="fetch", args=["https://example.com"]),
+  ]
+
+
+@pytest.mark.parametrize(
+  "message",
+  [
+    "fetch('a')\nsum(1, 2",
+    "fetch('a')\nfetch('b",
+    "sum(1,2) garbage(",
+  ],
+)
+def test_parse_tool_calls_fails_on_a_malformed_trailing_call(message: str):
+  tools: dict[str, GenericToolFn] = {
+    "sum": sum,
+    "fetch": fetch,
+  }
+
+  with pytest.raises(pp.ParseException):
+    parse_tool_calls(message, tools)
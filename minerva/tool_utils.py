@@ -1,6 +1,10 @@
-from inspect import signature, Parameter, Signature
-from typing import Any, Coroutine, NamedTuple, Callable, cast
+import functools
+import json
+import re
+from inspect import cleandoc, signature, Parameter, Signature
+from typing import Any, Coroutine, NamedTuple, Callable, Optional, cast
 import pyparsing as pp
+from openai.types.chat import ChatCompletionToolParam
 
 
 TOOL_PREFIX = "TOOL-"
@@ -8,19 +12,42 @@ TOOL_PREFIX = "TOOL-"
 GenericToolFn = Callable[..., Coroutine[Any, Any, str]]
 
 
-def get_tool_signature(tool: GenericToolFn) -> Signature:
-  """Get the signature of a tool, excluding **kwargs.
+class ToolSpec(NamedTuple):
+  signature: Signature
+  # Convert the parsed arguments to the types of the tool parameters
+  arg_converters: tuple[Callable[[Any], Any], ...]
 
-  We exclude **kwargs because LLM doesn't care about them, they are passed
-  automatically by our runtime.
+
+def _to_str(arg: Any) -> str:
+  return arg if isinstance(arg, str) else str(arg)
+
+
+@functools.cache
+def get_tool_spec(tool: GenericToolFn) -> ToolSpec:
+  """Inspect the tool once and cache the result.
+
+  The specs of all tools are computed when the prompt is built, so parsing
+  tool calls doesn't need to inspect them again.
   """
 
   sig = signature(tool)
   filtered_params = [
     param for param in sig.parameters.values() if param.kind != Parameter.VAR_KEYWORD
   ]
-  filtered_sig = sig.replace(parameters=filtered_params)
-  return filtered_sig
+  arg_converters = tuple(
+    _to_str if param.annotation is str else param.annotation for param in filtered_params
+  )
+  return ToolSpec(signature=sig.replace(parameters=filtered_params), arg_converters=arg_converters)
+
+
+def get_tool_signature(tool: GenericToolFn) -> Signature:
+  """Get the signature of a tool, excluding **kwargs.
+
+  We exclude **kwargs because LLM doesn't care about them, they are passed
+  automatically by our runtime.
+  """
+
+  return get_tool_spec(tool).signature
 
 
 def format_tool(name: str, tool: GenericToolFn) -> str:
@@ -35,6 +62,29 @@ class ToolCall(NamedTuple):
   args: list[Any]
 
 
+# Support robust argument parsing including quoted strings (single/double),
+# escaped quotes with backslash, and multiline content inside quotes. The
+# grammar is built once, building it costs more than parsing a tool call.
+_QUOTED_SINGLE = cast(Any, pp.QuotedString("'", escChar="\\", multiline=True))
+_QUOTED_DOUBLE = cast(Any, pp.QuotedString('"', escChar="\\", multiline=True))
+_SIMPLE_TOKEN = cast(Any, pp.Word(pp.alphanums + "._-:/"))
+_TOOL_CALL_GRAMMAR = cast(
+  Any,
+  pp.Word(pp.alphanums + "_").setResultsName("tool_name")
+  + pp.Suppress("(")
+  + pp.Optional(pp.delimitedList(_QUOTED_SINGLE | _QUOTED_DOUBLE | _SIMPLE_TOKEN, delim=","))
+  + pp.Suppress(")"),
+)
+_TOOL_CALLS_GRAMMAR = cast(Any, pp.OneOrMore(pp.Group(_TOOL_CALL_GRAMMAR)))
+
+# A call with a single quoted argument without escapes, e.g. fetch_html('https://example.com')
+_SINGLE_STR_ARG_TOOL_CALL_RE = re.compile(
+  r"\s*(?P<tool_name>[a-zA-Z0-9_]+)\(\s*"
+  r"""(?:'(?P<single_quoted>[^'\\]*)'|"(?P<double_quoted>[^"\\]*)")"""
+  r"\s*\)\s*"
+)
+
+
 def parse_tool_call(message: str, tools: dict[str, GenericToolFn]) -> ToolCall:
   """Parse a tool call message and return a ToolCall object.
 
@@ -52,46 +102,176 @@ def parse_tool_call(message: str, tools: dict[str, GenericToolFn]) -> ToolCall:
   Convert arguments to the correct types according to the tool's signature.
   """
 
-  # Support robust argument parsing including quoted strings (single/double),
-  # escaped quotes with backslash, and multiline content inside quotes.
-  quoted_single = cast(Any, pp.QuotedString("'", escChar="\\", multiline=True))
-  quoted_double = cast(Any, pp.QuotedString('"', escChar="\\", multiline=True))
-  simple_token = cast(Any, pp.Word(pp.alphanums + "._-:/"))
+  match = _SINGLE_STR_ARG_TOOL_CALL_RE.fullmatch(message)
+  if match:
+    # The common case of a single quoted argument without escapes, like
+    # fetch_html('https://example.com'), doesn't need the full grammar
+    tool_name = match["tool_name"]
+    args: list[Any] = [
+      match["single_quoted"] if match["single_quoted"] is not None else match["double_quoted"]
+    ]
+  else:
+    # Text after the call is an error rather than being ignored
+    parsed = _TOOL_CALL_GRAMMAR.parse_string(message, parse_all=True)
+    tool_name = cast(str, parsed["tool_name"])
+    args = cast(list[Any], parsed[1:])
 
-  arg_expr = quoted_single | quoted_double | simple_token
+  return _to_tool_call(tool_name, args, tools)
+
+
+def parse_tool_calls(message: str, tools: dict[str, GenericToolFn]) -> list[ToolCall]:
+  """Parse a message with one or more tool calls, one call per line.
+
+  Examples:
+  fetch_html('https://example.com')
+  fetch_html('https://example.org')
+  """
+
+  if _SINGLE_STR_ARG_TOOL_CALL_RE.fullmatch(message):
+    return [parse_tool_call(message, tools)]
+
+  # Without `parse_all`, a malformed call after the valid ones would be dropped
+  # silently instead of reporting the error to the model
+  parsed = _TOOL_CALLS_GRAMMAR.parse_string(message, parse_all=True)
+  return [
+    _to_tool_call(cast(str, call["tool_name"]), cast(list[Any], call[1:]), tools) for call in parsed
+  ]
 
-  tool_call = cast(
-    Any,
-    pp.Word(pp.alphanums + "_").setResultsName("tool_name")
-    + pp.Suppress("(")
-    + pp.Optional(pp.delimitedList(arg_expr, delim=","))
-    + pp.Suppress(")"),
-  )
-  parsed = tool_call.parseString(message)
-  tool_name = cast(str, parsed["tool_name"])
-  args = cast(list[Any], parsed[1:])
 
+def _to_tool_call(tool_name: str, args: list[Any], tools: dict[str, GenericToolFn]) -> ToolCall:
   try:
     tool = tools[tool_name]
   except KeyError:
     raise ValueError(f"Tool {tool_name} not found.")
 
-  tool_signature = get_tool_signature(tool)
-  if len(args) != len(tool_signature.parameters):
+  tool_spec = get_tool_spec(tool)
+  if len(args) != len(tool_spec.arg_converters):
     raise ValueError("The number of arguments does not match the tool's signature.")
 
+  typed_args = [convert(arg) for convert, arg in zip(tool_spec.arg_converters, args)]
+  return ToolCall(tool_name=tool_name, args=typed_args)
+
+
+def parse_native_tool_call(
+  tool_name: str, arguments: str, tools: dict[str, GenericToolFn]
+) -> ToolCall:
+  """Parse a structured tool call made by the model through the API.
+
+  `arguments` is the JSON object generated by the model. The arguments are
+  converted to the types of the tool's signature, and the missing optional
+  arguments are filled with their defaults.
+  """
+
+  try:
+    tool = tools[tool_name]
+  except KeyError:
+    raise ValueError(f"Tool {tool_name} not found.")
+
+  try:
+    parsed_arguments: Any = json.loads(arguments) if arguments.strip() else {}
+  except json.JSONDecodeError as err:
+    raise ValueError(f"Tool arguments are not valid JSON: {err}")
+  if not isinstance(parsed_arguments, dict):
+    raise ValueError("Tool arguments must be a JSON object.")
+  kwargs = cast(dict[str, Any], parsed_arguments)
+
+  tool_spec = get_tool_spec(tool)
+  params = tool_spec.signature.parameters
+  unknown_args = [name for name in kwargs if name not in params]
+  if unknown_args:
+    raise ValueError(f"Unknown arguments: {', '.join(unknown_args)}.")
+
   typed_args: list[Any] = []
-  for arg, param in zip(args, tool_signature.parameters.values()):
-    if param.annotation is str:
-      if isinstance(arg, str):
-        typed_args.append(arg)
-      else:
-        typed_args.append(str(arg))
+  for param, convert in zip(params.values(), tool_spec.arg_converters):
+    if param.name in kwargs:
+      typed_args.append(convert(kwargs[param.name]))
+    elif param.default is not Parameter.empty:
+      typed_args.append(param.default)
     else:
-      typed_args.append(param.annotation(arg))
+      raise ValueError(f"Missing argument: {param.name}.")
 
   return ToolCall(tool_name=tool_name, args=typed_args)
 
 
+_JSON_SCHEMA_TYPES: dict[Any, str] = {
+  str: "string",
+  int: "integer",
+  float: "number",
+  bool: "boolean",
+}
+
+
+def _parse_docstring(docstring: Optional[str]) -> tuple[str, dict[str, str]]:
+  """Split a Google-style docstring into the description and the argument descriptions."""
+
+  if not docstring:
+    return "", {}
+
+  description_lines: list[str] = []
+  arg_descriptions: dict[str, str] = {}
+  arg_indent: Optional[int] = None
+  current_arg: Optional[str] = None
+  in_args = False
+  for line in cleandoc(docstring).split("\n"):
+    if line.strip() == "Args:":
+      in_args = True
+      continue
+
+    indent = len(line) - len(line.lstrip())
+    if in_args and line.strip() and indent > 0:
+      match = re.match(r"(\w+)(?: \(.*?\))?:\s*(.*)", line.strip())
+      if match and (arg_indent is None or indent == arg_indent):
+        arg_indent = indent
+        current_arg = cast(str, match[1])
+        arg_descriptions[current_arg] = cast(str, match[2])
+      elif current_arg is not None:
+        arg_descriptions[current_arg] += f" {line.strip()}"
+      continue
+
+    # The arguments section ends with the first line that is not indented
+    if line.strip():
+      in_args = False
+    description_lines.append(line)
+
+  description = re.sub(r"\n{3,}", "\n\n", "\n".join(description_lines)).strip()
+  return description, arg_descriptions
+
+
+@functools.cache
+def get_tool_json_schema(name: str, tool: GenericToolFn) -> ChatCompletionToolParam:
+  """Describe the tool for the API's structured tool calling.
+
+  The parameters schema is derived from the tool's signature, and the
+  descriptions come from its Google-style docstring.
+  """
+
+  description, arg_descriptions = _parse_docstring(tool.__doc__)
+  properties: dict[str, Any] = {}
+  required: list[str] = []
+  for param in get_tool_spec(tool).signature.parameters.values():
+    param_schema: dict[str, Any] = {"type": _JSON_SCHEMA_TYPES.get(param.annotation, "string")}
+    if param.name in arg_descriptions:
+      param_schema["description"] = arg_descriptions[param.name]
+    if param.default is Parameter.empty:
+      required.append(param.name)
+    else:
+      param_schema["default"] = param.default
+    properties[param.name] = param_schema
+
+  return {
+    "type": "function",
+    "function": {
+      "name": name,
+      "description": description,
+      "parameters": {
+        "type": "object",
+        "properties": properties,
+        "required": required,
+        "additionalProperties": False,
+      },
+    },
+  }
+
+
 def format_tool_username(tool_name: str) -> str:
   return f"{TOOL_PREFIX}{tool_name}"
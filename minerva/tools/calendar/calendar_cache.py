@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+import icalendar
+
+from minerva.http_client import HttpClientRegistry
+from minerva.tools.calendar.calendar_index import CalendarIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFETCH_INTERVAL_SEC = 15 * 60
+
+
+class CalendarCache:
+  """The parsed calendar, shared by everything that reads it.
+
+  The calendar is refetched at most once per `refetch_interval_sec`, with a
+  conditional request (ETag / Last-Modified), so an unchanged calendar is
+  neither downloaded nor parsed again. Concurrent readers of a stale calendar
+  wait for a single refetch. If the refetch fails, readers get the last
+  calendar we have.
+
+  `get_index` returns the calendar with its recurring events expanded, which
+  is updated once per calendar version.
+  """
+
+  def __init__(
+    self,
+    calendar_url: str,
+    refetch_interval_sec: float = DEFAULT_REFETCH_INTERVAL_SEC,
+    http_clients: Optional[HttpClientRegistry] = None,
+  ):
+    self.calendar_url = calendar_url
+    self.refetch_interval_sec = refetch_interval_sec
+    self.http_clients = http_clients
+
+    self._calendar: Optional[icalendar.cal.Component] = None
+    self._fetched_at: Optional[float] = None
+    self._etag: Optional[str] = None
+    self._last_modified: Optional[str] = None
+    self._lock = asyncio.Lock()
+    self._index = CalendarIndex()
+    self._index_lock = asyncio.Lock()
+    # Bumped every time the calendar content changes
+    self.version = 0
+
+  @property
+  def is_fresh(self) -> bool:
+    return (
+      self._fetched_at is not None
+      and time.monotonic() - self._fetched_at < self.refetch_interval_sec
+    )
+
+  async def get(self) -> icalendar.cal.Component:
+    """Get the calendar, refetching it if it's older than the refetch interval."""
+
+    if self._calendar is not None and self.is_fresh:
+      return self._calendar
+
+    async with self._lock:
+      # Another reader might have refetched the calendar while we waited
+      if self._calendar is None or not self.is_fresh:
+        try:
+          await self._refetch()
+        except Exception:
+          if self._calendar is None:
+            raise
+          logger.exception("Failed to refetch the calendar, using the cached one")
+      assert self._calendar is not None
+      return self._calendar
+
+  async def get_index(self) -> CalendarIndex:
+    """Get the index of the calendar, updating it if the calendar has changed."""
+
+    calendar = await self.get()
+    if self._index.needs_update(calendar, datetime.now(timezone.utc)):
+      async with self._index_lock:
+        # Expanding the events takes a while, don't block the event loop
+        await asyncio.to_thread(self._index.update, calendar, datetime.now(timezone.utc))
+    return self._index
+
+  async def _refetch(self) -> None:
+    headers: dict[str, str] = {}
+    if self._calendar is not None:
+      if self._etag:
+        headers["If-None-Match"] = self._etag
+      if self._last_modified:
+        headers["If-Modified-Since"] = self._last_modified
+
+    response = await self._request(headers)
+    if response.status_code == 304 and self._calendar is not None:
+      logger.debug("calendar is not modified")
+      self._fetched_at = time.monotonic()
+      return
+    response.raise_for_status()
+
+    # Parsing a large calendar takes a while, don't block the event loop
+    self._calendar = await asyncio.to_thread(icalendar.Calendar.from_ical, response.text)
+    self._etag = response.headers.get("ETag")
+    self._last_modified = response.headers.get("Last-Modified")
+    self._fetched_at = time.monotonic()
+    self.version += 1
+    logger.info("fetched calendar: size_bytes=%d", len(response.content))
+
+  async def _request(self, headers: dict[str, str]) -> httpx.Response:
+    if self.http_clients is not None:
+      return await self.http_clients.get(self.calendar_url).get(self.calendar_url, headers=headers)
+    async with httpx.AsyncClient() as client:
+      return await client.get(self.calendar_url, headers=headers)
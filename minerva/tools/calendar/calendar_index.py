@@ -0,0 +1,253 @@
+import hashlib
+import logging
+import re
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import NamedTuple, Optional
+
+import icalendar
+
+from minerva.tools.calendar.query_icalendar import Event, query_icalendar
+
+logger = logging.getLogger(__name__)
+
+# The longest query the calendar tool allows
+MAX_QUERY_DAYS = 366
+# The index expands the occurrences this far ahead, so it only has to be built
+# from scratch about once a quarter, when a year-long query stops fitting in it
+INDEX_LOOKAHEAD_DAYS = MAX_QUERY_DAYS + 90
+# Floating times and all-day events are compared in the timezone of the other
+# side, which is within 14 hours of UTC. The index keys treat them as UTC, so
+# every key comparison is padded by this much and the exact check is done by
+# `overlaps`.
+TIMEZONE_SLACK_SEC = 24 * 60 * 60
+
+# Google Calendar stamps every event with the export time, it's not a change
+DTSTAMP_PATTERN = re.compile(rb"^DTSTAMP[;:][^\r\n]*\r\n", re.MULTILINE)
+
+
+def _to_timestamp(value: date | datetime) -> float:
+  if not isinstance(value, datetime):
+    value = datetime(value.year, value.month, value.day)
+  if value.tzinfo is None:
+    value = value.replace(tzinfo=timezone.utc)
+  return value.timestamp()
+
+
+def _to_comparable(value: date | datetime, default_tzinfo: Optional[tzinfo]) -> datetime:
+  if not isinstance(value, datetime):
+    value = datetime(value.year, value.month, value.day)
+  if value.tzinfo is None:
+    value = value.replace(tzinfo=default_tzinfo)
+  return value
+
+
+def overlaps(
+  span_start: date | datetime,
+  span_end: date | datetime,
+  event_start: date | datetime,
+  event_end: date | datetime,
+) -> bool:
+  """Whether the event falls into the span, the same way `query_icalendar` decides it.
+
+  All-day events start and end at midnight. Floating times and dates are taken
+  in the timezone of the first of the values that has one. Zero-length events
+  are in the span if they start in it, and a zero-length span contains the
+  events that are running at that moment.
+  """
+
+  default_tzinfo = next(
+    (
+      value.tzinfo
+      for value in (span_start, span_end, event_start, event_end)
+      if isinstance(value, datetime) and value.tzinfo is not None
+    ),
+    None,
+  )
+  span_start = _to_comparable(span_start, default_tzinfo)
+  span_end = _to_comparable(span_end, default_tzinfo)
+  event_start = _to_comparable(event_start, default_tzinfo)
+  event_end = _to_comparable(event_end, default_tzinfo)
+
+  if event_start == event_end:
+    if span_start == span_end:
+      return event_start == span_start
+    return span_start <= event_start < span_end
+  if span_start == span_end:
+    return event_start <= span_start < event_end
+  return event_start < span_end and span_start < event_end
+
+
+def _copy_properties(calendar: icalendar.cal.Component) -> icalendar.Calendar:
+  # The calendar properties (X-WR-TIMEZONE) change how the events are expanded
+  properties_calendar = icalendar.Calendar()
+  for name, value in calendar.items():
+    properties_calendar[name] = value
+  return properties_calendar
+
+
+def _get_digest(properties: bytes, components: list[icalendar.cal.Component]) -> bytes:
+  digest = hashlib.sha256(properties)
+  for component in components:
+    digest.update(DTSTAMP_PATTERN.sub(b"", component.to_ical()))
+  return digest.digest()
+
+
+class _Series(NamedTuple):
+  digest: bytes
+  # In the order the library yields them
+  events: list[Event]
+
+
+class _Occurrence(NamedTuple):
+  start_ts: float
+  uid: str
+  seq: int
+  event: Event
+
+
+class _IndexState(NamedTuple):
+  calendar: icalendar.cal.Component
+  window: tuple[datetime, datetime]
+  window_start_ts: float
+  window_end_ts: float
+  series: dict[str, _Series]
+  uid_order: dict[str, int]
+  occurrences: list[_Occurrence]
+  starts: list[float]
+  max_duration_sec: float
+
+  def covers(self, from_ts: float, to_ts: float) -> bool:
+    return (
+      self.window_start_ts + TIMEZONE_SLACK_SEC <= from_ts
+      and to_ts <= self.window_end_ts - TIMEZONE_SLACK_SEC
+    )
+
+  def covers_max_query(self, now: datetime) -> bool:
+    now_ts = _to_timestamp(now)
+    return self.covers(now_ts, now_ts + timedelta(days=MAX_QUERY_DAYS).total_seconds())
+
+
+class CalendarIndex:
+  """The occurrences of the calendar events, expanded ahead of time and sorted by start.
+
+  Expanding the recurrence rules is the expensive part of a calendar query,
+  and it used to be repeated for every query. The index expands them once per
+  calendar version over a window of `INDEX_LOOKAHEAD_DAYS`, and answers a
+  query with a binary search for the occurrences that may overlap it, checked
+  with the same overlap rules as `query_icalendar`, so both return the same
+  events in the same order.
+
+  When the calendar changes, only the series (events with the same UID) whose
+  content changed are expanded again.
+
+  `update` runs in a worker thread while `query` runs on the event loop, so
+  every version of the index is built as a separate `_IndexState` and swapped
+  in with a single assignment. A query reads one state from start to end.
+  """
+
+  def __init__(self, lookahead_days: int = INDEX_LOOKAHEAD_DAYS):
+    self.lookahead_days = lookahead_days
+    self._state: Optional[_IndexState] = None
+
+  def needs_update(self, calendar: icalendar.cal.Component, now: datetime) -> bool:
+    state = self._state
+    return state is None or calendar is not state.calendar or not state.covers_max_query(now)
+
+  def update(self, calendar: icalendar.cal.Component, now: datetime) -> None:
+    """Index a new version of the calendar, reusing the series that didn't change."""
+
+    state = self._state
+    if state is not None and calendar is state.calendar and state.covers_max_query(now):
+      return
+
+    if state is not None and state.covers_max_query(now):
+      window = state.window
+      old_series = state.series
+    else:
+      # Start the window a bit earlier to cover the events in progress
+      window = (
+        now - timedelta(seconds=2 * TIMEZONE_SLACK_SEC),
+        now + timedelta(days=self.lookahead_days),
+      )
+      old_series = {}
+
+    components_by_uid: dict[str, list[icalendar.cal.Component]] = {}
+    for component in calendar.walk("VEVENT"):
+      # Same grouping as in the library, components without a UID are separate series
+      uid = str(component.get("UID", id(component)))
+      components_by_uid.setdefault(uid, []).append(component)
+
+    properties = _copy_properties(calendar).to_ical()
+    series_by_uid: dict[str, _Series] = {}
+    expanded_count = 0
+    for uid, components in components_by_uid.items():
+      digest = _get_digest(properties, components)
+      series = old_series.get(uid)
+      if series is None or series.digest != digest:
+        series = _Series(digest, self._expand(calendar, components, *window))
+        expanded_count += 1
+      series_by_uid[uid] = series
+
+    occurrences = [
+      _Occurrence(_to_timestamp(event.start), uid, seq, event)
+      for uid, series in series_by_uid.items()
+      for seq, event in enumerate(series.events)
+    ]
+    occurrences.sort(key=lambda occurrence: occurrence.start_ts)
+
+    self._state = _IndexState(
+      calendar=calendar,
+      window=window,
+      window_start_ts=_to_timestamp(window[0]),
+      window_end_ts=_to_timestamp(window[1]),
+      series=series_by_uid,
+      uid_order={uid: order for order, uid in enumerate(series_by_uid)},
+      occurrences=occurrences,
+      starts=[occurrence.start_ts for occurrence in occurrences],
+      max_duration_sec=max(
+        (_to_timestamp(o.event.end) - o.start_ts for o in occurrences), default=0.0
+      ),
+    )
+    logger.info(
+      "indexed calendar: series=%d expanded_series=%d occurrences=%d",
+      len(series_by_uid),
+      expanded_count,
+      len(occurrences),
+    )
+
+  def _expand(
+    self,
+    calendar: icalendar.cal.Component,
+    components: list[icalendar.cal.Component],
+    window_start: datetime,
+    window_end: datetime,
+  ) -> list[Event]:
+    series_calendar = _copy_properties(calendar)
+    for component in components:
+      series_calendar.add_component(component)
+    return query_icalendar(series_calendar, window_start, window_end)
+
+  def query(self, date_from: datetime, date_to: datetime | timedelta) -> list[Event]:
+    """Query the indexed calendar for events in the time range, like `query_icalendar`."""
+
+    state = self._state
+    if state is None:
+      raise RuntimeError("The calendar is not indexed yet")
+    if isinstance(date_to, timedelta):
+      date_to = date_from + date_to
+
+    from_ts = _to_timestamp(date_from)
+    to_ts = _to_timestamp(date_to)
+    if not state.covers(from_ts, to_ts):
+      return query_icalendar(state.calendar, date_from, date_to)
+
+    lo = bisect_left(state.starts, from_ts - state.max_duration_sec - TIMEZONE_SLACK_SEC)
+    hi = bisect_right(state.starts, to_ts + TIMEZONE_SLACK_SEC)
+    matches = [
+      occurrence
+      for occurrence in state.occurrences[lo:hi]
+      if overlaps(date_from, date_to, occurrence.event.start, occurrence.event.end)
+    ]
+    matches.sort(key=lambda occurrence: (state.uid_order[occurrence.uid], occurrence.seq))
+    return [occurrence.event for occurrence in matches]
@@ -1,13 +1,15 @@
 from datetime import datetime, timedelta
 from typing import Unpack
-import icalendar
-import httpx
 
-from minerva.tools.calendar.query_icalendar import query_icalendar
+from minerva.tools.calendar.calendar_cache import CalendarCache
 from minerva.tools.tool_kwargs import DefaultToolKwargs
 
 
-def get_query_calendar(calendar_url: str):
+def get_query_calendar(calendar: CalendarCache | str):
+  """Create the calendar tool for a calendar cache, or a calendar URL with its own cache."""
+
+  calendar_cache = CalendarCache(calendar) if isinstance(calendar, str) else calendar
+
   async def query_calendar(next_days: int, **kwargs: Unpack[DefaultToolKwargs]) -> str:
     """Query the event calendar for the next `next_days` days.
 
@@ -20,13 +22,9 @@ def get_query_calendar(calendar_url: str):
     if next_days > 366:
       raise ValueError("next_days must be at most 366")
 
-    async with httpx.AsyncClient() as client:
-      calendar_request = await client.get(calendar_url)
-    calendar_request.raise_for_status()
-    ics_content = calendar_request.text
-    cal = icalendar.Calendar.from_ical(ics_content)
+    calendar_index = await calendar_cache.get_index()
 
-    events = query_icalendar(cal, datetime.now(), timedelta(days=next_days))
+    events = calendar_index.query(datetime.now(), timedelta(days=next_days))
     if not events:
       return "No events found"
     return "\n\n".join([str(event) for event in events])
@@ -1,14 +1,22 @@
 import asyncio
-import httpx
 from datetime import datetime, timedelta, timezone
-from typing import Callable, Optional, Any, Dict, Set
+from typing import Callable, Optional, Any, Dict
 import icalendar
 
-from minerva.tools.calendar.query_icalendar import Event, query_icalendar
+from minerva.tools.calendar.calendar_cache import CalendarCache
+from minerva.tools.calendar.query_icalendar import Event
+from minerva.tools.calendar.reminder_scheduler import ReminderScheduler
 
 
 class MeetingReminderer:
-  """Class for managing meeting reminders from a calendar."""
+  """Class for managing meeting reminders from a calendar.
+
+  The calendar is checked every `check_interval_minutes`, and the reminders
+  are reconciled with the events by their `unique_id`: the reminders of new
+  events are added to the scheduler, and the ones of removed events are
+  cancelled. The scheduler sends every reminder on time, no matter how long
+  the check interval is.
+  """
 
   def __init__(
     self,
@@ -16,6 +24,8 @@ class MeetingReminderer:
     calendar_url: str,
     check_interval_minutes: int = 15,
     reminder_minutes_before: int = 15,
+    calendar_cache: Optional[CalendarCache] = None,
+    scheduler: Optional[ReminderScheduler] = None,
   ):
     """
     Initialize a MeetingReminderer instance.
@@ -25,24 +35,37 @@ class MeetingReminderer:
       calendar_url: URL of the calendar ICS file
       check_interval_minutes: How often to check the calendar (in minutes)
       reminder_minutes_before: How many minutes before the meeting to send reminders
+      calendar_cache: The calendar shared with other readers, the reminderer has its own if not set
+      scheduler: The scheduler shared with other reminderers, the reminderer has its own if not set
     """
 
     self.send_message_to_agent = send_message_to_agent
     self.calendar_url = calendar_url
     self.check_interval_minutes = check_interval_minutes
     self.reminder_minutes_before = reminder_minutes_before
+    self.calendar_cache = calendar_cache or CalendarCache(
+      calendar_url, refetch_interval_sec=check_interval_minutes * 60
+    )
+    self._owns_scheduler = scheduler is None
+    self.scheduler = ReminderScheduler() if scheduler is None else scheduler
 
-    self._scheduled_reminders: Dict[str, asyncio.Task[None]] = {}
+    # The events with a pending reminder, by their unique id
+    self._scheduled_events: Dict[str, Event] = {}
     self._reminder_loop_task: Optional[asyncio.Task[None]] = None
 
+  @property
+  def lookahead(self) -> timedelta:
+    """How far ahead to schedule the reminders, so that none is missed until the next check."""
+
+    return max(
+      timedelta(days=1),
+      timedelta(minutes=self.check_interval_minutes + self.reminder_minutes_before + 1),
+    )
+
   async def download_calendar(self) -> icalendar.cal.Component:
-    """Download and parse the calendar from the given URL."""
+    """Get the parsed calendar, downloading it only if it's stale and changed."""
 
-    async with httpx.AsyncClient() as client:
-      calendar_request = await client.get(self.calendar_url)
-    calendar_request.raise_for_status()
-    ics_content = calendar_request.text
-    return icalendar.Calendar.from_ical(ics_content)
+    return await self.calendar_cache.get()
 
   async def send_meeting_reminder(self, event: Event) -> None:
     """Send a reminder for a specific meeting."""
@@ -54,71 +77,48 @@ class MeetingReminderer:
 
     await self.send_message_to_agent(message)
 
-  async def schedule_reminder(self, event: Event) -> None:
-    """Schedule a reminder for a meeting at the set time before the meeting starts."""
-
-    now = datetime.now(timezone.utc)
-    reminder_time = event.start - timedelta(minutes=self.reminder_minutes_before)
+  def _get_key(self, event_id: str) -> tuple[int, str]:
+    # The scheduler may be shared by the reminderers of several calendars
+    return (id(self), event_id)
 
-    if reminder_time <= now:
-      return
-
-    wait_seconds = (reminder_time - now).total_seconds()
-    await asyncio.sleep(wait_seconds)
-
-    current_task = asyncio.current_task()
-    if not current_task:
-      raise RuntimeError("No current task found")
-    # Send the reminder only if this task hasn't been cancelled
-    if not current_task.cancelled():
+  def _schedule_reminder(self, event: Event, reminder_time: datetime) -> None:
+    async def remind() -> None:
+      self._scheduled_events.pop(event.unique_id, None)
       await self.send_meeting_reminder(event)
 
-  def _cancel_task_if_exists(self, task: Optional[asyncio.Task[None]]) -> None:
-    """Cancel a task if it exists and is not already done."""
+    self.scheduler.schedule(self._get_key(event.unique_id), reminder_time, remind)
+    self._scheduled_events[event.unique_id] = event
 
-    if task and not task.done():
-      task.cancel()
+  def _cancel_reminder(self, event_id: str) -> None:
+    self.scheduler.cancel(self._get_key(event_id))
+    self._scheduled_events.pop(event_id, None)
 
   async def check_for_upcoming_meetings(self) -> None:
-    """Check for upcoming meetings and schedule reminders exactly at the set time before each."""
+    """Check for upcoming meetings and reconcile their reminders with the scheduled ones."""
 
-    cal = await self.download_calendar()
+    calendar_index = await self.calendar_cache.get_index()
     now = datetime.now(timezone.utc)
+    events = calendar_index.query(now, now + self.lookahead)
 
-    tomorrow = now + timedelta(days=1)
-    events = query_icalendar(cal, now, tomorrow)
-
-    current_event_ids: Set[str] = {event.unique_id for event in events}
-    removed_event_ids = set(self._scheduled_reminders.keys()) - current_event_ids
-
-    for event_id in removed_event_ids:
-      self._cancel_task_if_exists(self._scheduled_reminders.get(event_id))
-      self._scheduled_reminders.pop(event_id, None)
-
-    # Schedule reminders for new meetings
+    reminder_times: Dict[str, datetime] = {}
+    upcoming_events: Dict[str, Event] = {}
     for event in events:
-      event_id = event.unique_id
       reminder_time = event.start - timedelta(minutes=self.reminder_minutes_before)
+      # Already reminded, or too late to remind
+      if reminder_time > now:
+        reminder_times[event.unique_id] = reminder_time
+        upcoming_events[event.unique_id] = event
+
+    for event_id in self._scheduled_events.keys() - upcoming_events.keys():
+      self._cancel_reminder(event_id)
 
-      # Only schedule a reminder if:
-      # 1. We haven't already scheduled it
-      # 2. The reminder time is in the future
-      if event_id not in self._scheduled_reminders and reminder_time > now:
-        # Schedule the reminder task
-        task: asyncio.Task[None] = asyncio.create_task(
-          self.schedule_reminder(event), name=f"reminder_{event_id}"
-        )
-        self._scheduled_reminders[event_id] = task
-
-    # Clean up completed reminder tasks
-    completed_reminders = [
-      event_id for event_id, task in self._scheduled_reminders.items() if task.done()
-    ]
-    for event_id in completed_reminders:
-      self._scheduled_reminders.pop(event_id)
+    for event_id, event in upcoming_events.items():
+      # Reschedule if the details in the reminder have changed
+      if self._scheduled_events.get(event_id) != event:
+        self._schedule_reminder(event, reminder_times[event_id])
 
   async def _meeting_reminder_loop(self) -> None:
-    """Periodically refresh the calendar and schedule reminders for new meetings."""
+    """Periodically refresh the calendar and reconcile the reminders."""
 
     check_interval = self.check_interval_minutes * 60  # Convert minutes to seconds
 
@@ -132,6 +132,7 @@ class MeetingReminderer:
     if self._reminder_loop_task is not None:
       return
 
+    self.scheduler.start()
     loop = asyncio.get_event_loop()
     self._reminder_loop_task = loop.create_task(
       self._meeting_reminder_loop(), name=f"meeting_reminder_loop_{id(self)}"
@@ -144,17 +145,21 @@ class MeetingReminderer:
       return
 
     # Cancel the main loop task
-    self._cancel_task_if_exists(self._reminder_loop_task)
+    self._reminder_loop_task.cancel()
     self._reminder_loop_task = None
 
-    # Cancel all scheduled reminder tasks
-    for event_id, task in list(self._scheduled_reminders.items()):
-      self._cancel_task_if_exists(task)
-      self._scheduled_reminders.pop(event_id)
+    # Cancel all scheduled reminders
+    for event_id in list(self._scheduled_events):
+      self._cancel_reminder(event_id)
+    if self._owns_scheduler:
+      self.scheduler.stop()
 
 
 def setup_meeting_reminderer(
-  send_message_to_agent: Callable[[str], Any], calendar_url: str
+  send_message_to_agent: Callable[[str], Any],
+  calendar_url: str,
+  calendar_cache: Optional[CalendarCache] = None,
+  scheduler: Optional[ReminderScheduler] = None,
 ) -> MeetingReminderer:
   """
   Set up the meeting reminder functionality.
@@ -162,13 +167,17 @@ def setup_meeting_reminderer(
   Args:
     send_message_to_agent: Function to send messages to the agent
     calendar_url: URL of the calendar ICS file
+    calendar_cache: The calendar shared with other readers
+    scheduler: The reminder scheduler shared with other reminderers
 
   Returns:
     A MeetingReminderer instance that has been started
   """
 
   # Create and start the reminderer
-  reminderer = MeetingReminderer(send_message_to_agent, calendar_url)
+  reminderer = MeetingReminderer(
+    send_message_to_agent, calendar_url, calendar_cache=calendar_cache, scheduler=scheduler
+  )
   reminderer.start()
 
   return reminderer
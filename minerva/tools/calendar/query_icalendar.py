@@ -40,6 +40,18 @@ def _trim_google_meet_links_from_description(description: str) -> str:
   return description
 
 
+def event_from_component(component: icalendar.cal.Component) -> Event:
+  """Create an event from an occurrence of a VEVENT component."""
+
+  summary = str(component.get("summary"))
+  description = _trim_google_meet_links_from_description(str(component.get("description", "")))
+  x_google_conference = str(component.get("x-google-conference"))
+  start = component.get("dtstart").dt
+  end = component.get("dtend").dt
+  rrule = component.get("rrule")
+  return Event(summary, description, x_google_conference, start, end, rrule)
+
+
 def query_icalendar(
   cal: icalendar.cal.Component,
   date_from: datetime,
@@ -48,14 +60,6 @@ def query_icalendar(
   """Query the calendar for events in the specified time range."""
 
   filtered_cal = recurring_ical_events.of(cal).between(date_from, date_to)
-  events: list[Event] = []
-  for component in filtered_cal:
-    if component.name == "VEVENT":
-      summary = str(component.get("summary"))
-      description = _trim_google_meet_links_from_description(str(component.get("description", "")))
-      x_google_conference = str(component.get("x-google-conference"))
-      start = component.get("dtstart").dt
-      end = component.get("dtend").dt
-      rrule = component.get("rrule")
-      events.append(Event(summary, description, x_google_conference, start, end, rrule))
-  return events
+  return [
+    event_from_component(component) for component in filtered_cal if component.name == "VEVENT"
+  ]
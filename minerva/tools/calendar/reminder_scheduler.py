@@ -0,0 +1,115 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Hashable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Wake up at least this often to notice the wall clock jumping, e.g. after a suspend
+MAX_SLEEP_SEC = 60
+
+ReminderCallback = Callable[[], Awaitable[None]]
+
+
+class _Reminder(NamedTuple):
+  remind_at: datetime
+  seq: int
+  callback: ReminderCallback
+
+
+class ReminderScheduler:
+  """Run callbacks at their times from a single task.
+
+  The pending reminders are kept in a heap, and the task sleeps until the
+  earliest one is due, or until the reminders change. Reminders are keyed, so
+  that scheduling a key again replaces its reminder. Replaced and cancelled
+  reminders are left in the heap and skipped when they come up.
+  """
+
+  def __init__(self):
+    self._reminders: dict[Hashable, _Reminder] = {}
+    self._heap: list[tuple[datetime, int, Hashable]] = []
+    self._seq = itertools.count()
+    self._changed = asyncio.Event()
+    self._task: Optional[asyncio.Task[None]] = None
+    self._callback_tasks: set[asyncio.Task[None]] = set()
+
+  def __len__(self) -> int:
+    return len(self._reminders)
+
+  def get_remind_at(self, key: Hashable) -> Optional[datetime]:
+    reminder = self._reminders.get(key)
+    return reminder.remind_at if reminder else None
+
+  def schedule(self, key: Hashable, remind_at: datetime, callback: ReminderCallback) -> None:
+    """Call `callback` at `remind_at` (timezone-aware), replacing the reminder of the key."""
+
+    reminder = _Reminder(remind_at, next(self._seq), callback)
+    self._reminders[key] = reminder
+    heapq.heappush(self._heap, (remind_at, reminder.seq, key))
+    self._changed.set()
+
+  def cancel(self, key: Hashable) -> bool:
+    if self._reminders.pop(key, None) is None:
+      return False
+    # Don't let the skipped entries pile up when the reminders change a lot
+    if len(self._heap) > 2 * len(self._reminders) + 16:
+      self._heap = [entry for entry in self._heap if self._is_pending(entry)]
+      heapq.heapify(self._heap)
+    self._changed.set()
+    return True
+
+  def _is_pending(self, entry: tuple[datetime, int, Hashable]) -> bool:
+    reminder = self._reminders.get(entry[2])
+    return reminder is not None and reminder.seq == entry[1]
+
+  def start(self) -> None:
+    if self._task is not None:
+      return
+
+    loop = asyncio.get_event_loop()
+    self._task = loop.create_task(self._run(), name=f"reminder_scheduler_{id(self)}")
+
+  def stop(self) -> None:
+    """Stop the scheduler and drop the pending reminders."""
+
+    if self._task is not None:
+      self._task.cancel()
+      self._task = None
+    for task in list(self._callback_tasks):
+      task.cancel()
+    self._reminders.clear()
+    self._heap.clear()
+
+  async def _run(self) -> None:
+    while True:
+      self._changed.clear()
+      while self._heap and not self._is_pending(self._heap[0]):
+        heapq.heappop(self._heap)
+
+      now = datetime.now(timezone.utc)
+      if self._heap and self._heap[0][0] <= now:
+        _, _, key = heapq.heappop(self._heap)
+        reminder = self._reminders.pop(key)
+        # A slow callback shouldn't hold up the reminders due at the same time
+        task = asyncio.create_task(self._call(key, reminder.callback))
+        self._callback_tasks.add(task)
+        task.add_done_callback(self._callback_tasks.discard)
+        continue
+
+      sleep_sec = MAX_SLEEP_SEC
+      if self._heap:
+        sleep_sec = min(sleep_sec, (self._heap[0][0] - now).total_seconds())
+      try:
+        async with asyncio.timeout(sleep_sec):
+          await self._changed.wait()
+      except TimeoutError:
+        pass
+
+  async def _call(self, key: Hashable, callback: ReminderCallback) -> None:
+    try:
+      await callback()
+    except Exception:
+      logger.exception("Reminder failed: key=%s", key)
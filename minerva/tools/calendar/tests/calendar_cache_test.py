@@ -0,0 +1,77 @@
+import asyncio
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os import path
+from threading import Thread
+from typing import Any, Iterator
+
+import pytest
+
+from minerva.tools.calendar.calendar_cache import CalendarCache
+
+ICS_PATH = path.join(path.dirname(__file__), "fixtures", "test-calendar.ics")
+ETAG = '"v1"'
+
+
+class CalendarServer:
+  def __init__(self):
+    self.statuses: list[int] = []
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        if self.headers.get("If-None-Match") == ETAG:
+          server.statuses.append(304)
+          self.send_response(304)
+          self.end_headers()
+          return
+
+        with open(ICS_PATH, "rb") as f:
+          ics_content = f.read()
+        server.statuses.append(200)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/calendar")
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(ics_content)
+
+      def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    self.httpd = HTTPServer(("", 0), Handler)
+    self.url = f"http://localhost:{self.httpd.server_port}/calendar.ics"
+
+
+@pytest.fixture
+def calendar_server() -> Iterator[CalendarServer]:
+  server = CalendarServer()
+  thread = Thread(target=server.httpd.serve_forever)
+  thread.start()
+  try:
+    yield server
+  finally:
+    server.httpd.shutdown()
+    thread.join()
+
+
+@pytest.mark.asyncio
+async def test_calendar_cache_shares_a_fetch_between_readers(calendar_server: CalendarServer):
+  calendar_cache = CalendarCache(calendar_server.url, refetch_interval_sec=60)
+
+  calendars = await asyncio.gather(*(calendar_cache.get() for _ in range(3)))
+  calendars.append(await calendar_cache.get())
+
+  assert all(calendar is calendars[0] for calendar in calendars)
+  assert calendar_server.statuses == [200]
+
+
+@pytest.mark.asyncio
+async def test_calendar_cache_keeps_the_parsed_calendar_if_not_modified(
+  calendar_server: CalendarServer,
+):
+  calendar_cache = CalendarCache(calendar_server.url, refetch_interval_sec=0)
+
+  calendar = await calendar_cache.get()
+  assert await calendar_cache.get() is calendar
+
+  assert calendar_server.statuses == [200, 304]
+  assert calendar_cache.version == 1
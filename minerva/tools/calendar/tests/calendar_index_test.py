@@ -0,0 +1,267 @@
+import asyncio
+import threading
+from datetime import UTC, date, datetime, timedelta, timezone
+from os import path
+from typing import Any
+from zoneinfo import ZoneInfo
+
+import icalendar
+import pytest
+
+from minerva.tools.calendar.calendar_index import CalendarIndex, overlaps
+from minerva.tools.calendar.query_icalendar import Event, query_icalendar
+
+ICS_PATH = path.join(path.dirname(__file__), "fixtures", "test-calendar.ics")
+NOW = datetime(2024, 9, 1, tzinfo=timezone.utc)
+
+EVENTS_ICS = """BEGIN:VEVENT
+UID:weekly
+SUMMARY:Weekly
+DTSTAMP:{stamp}
+DTSTART;TZID=Europe/Berlin:20240902T100000
+DTEND;TZID=Europe/Berlin:20240902T110000
+RRULE:FREQ=WEEKLY
+EXDATE;TZID=Europe/Berlin:20240909T100000
+END:VEVENT
+BEGIN:VEVENT
+UID:weekly
+SUMMARY:Weekly (moved)
+DTSTAMP:{stamp}
+RECURRENCE-ID;TZID=Europe/Berlin:20240916T100000
+DTSTART;TZID=Europe/Berlin:20240917T150000
+DTEND;TZID=Europe/Berlin:20240917T160000
+END:VEVENT
+BEGIN:VEVENT
+UID:all-day
+SUMMARY:{all_day_summary}
+DTSTAMP:{stamp}
+DTSTART;VALUE=DATE:20240903
+DTEND;VALUE=DATE:20240904
+RRULE:FREQ=MONTHLY
+END:VEVENT
+BEGIN:VEVENT
+UID:floating
+SUMMARY:Floating
+DTSTAMP:{stamp}
+DTSTART:20240904T230000
+DTEND:20240905T010000
+RRULE:FREQ=DAILY;INTERVAL=3
+END:VEVENT
+BEGIN:VEVENT
+UID:vacation
+SUMMARY:Vacation
+DTSTAMP:{stamp}
+DTSTART:20240825T000000Z
+DTEND:20240915T000000Z
+END:VEVENT
+"""
+
+
+def create_calendar(stamp: str = "20240901T000000Z", all_day_summary: str = "All day"):
+  with open(ICS_PATH) as f:
+    ics = f.read()
+  events = EVENTS_ICS.format(stamp=stamp, all_day_summary=all_day_summary)
+  ics = ics.replace("END:VCALENDAR", events.replace("\n", "\r\n") + "END:VCALENDAR")
+  return icalendar.Calendar.from_ical(ics)
+
+
+@pytest.mark.parametrize(
+  "date_from, date_to",
+  [
+    (datetime(2024, 9, 1, tzinfo=timezone.utc), datetime(2024, 9, 6, tzinfo=timezone.utc)),
+    (datetime(2024, 9, 2, 8, 0, tzinfo=timezone.utc), timedelta(hours=1)),
+    (datetime(2024, 9, 2, 9, 0, tzinfo=timezone.utc), timedelta(minutes=1)),
+    (datetime(2024, 9, 5), timedelta(days=1)),
+    (datetime(2024, 9, 3), timedelta(days=14)),
+    (datetime(2024, 10, 3, 12, 0), timedelta(days=366)),
+    (datetime(2025, 6, 1, tzinfo=timezone.utc), timedelta(days=30)),
+  ],
+)
+def test_calendar_index_matches_query_icalendar(date_from: datetime, date_to: datetime | timedelta):
+  calendar = create_calendar()
+  calendar_index = CalendarIndex()
+  calendar_index.update(calendar, NOW)
+
+  events = calendar_index.query(date_from, date_to)
+
+  assert events == query_icalendar(calendar, date_from, date_to)
+  assert events
+
+
+def test_calendar_index_falls_back_outside_of_the_window():
+  calendar = create_calendar()
+  calendar_index = CalendarIndex(lookahead_days=400)
+  calendar_index.update(calendar, NOW)
+
+  date_from = datetime(2026, 1, 1, tzinfo=timezone.utc)
+  events = calendar_index.query(date_from, timedelta(days=30))
+
+  assert events == query_icalendar(calendar, date_from, timedelta(days=30))
+  assert events
+  # Not indexed far enough ahead anymore
+  assert calendar_index.needs_update(calendar, NOW + timedelta(days=40))
+
+
+def test_calendar_index_reexpands_only_changed_series():
+  calendar_index = CalendarIndex()
+  calendar_index.update(create_calendar(), NOW)
+  date_from = datetime(2024, 9, 1, tzinfo=timezone.utc)
+  old_events = {
+    event.summary: event for event in calendar_index.query(date_from, timedelta(days=7))
+  }
+
+  # Every export has a new DTSTAMP, only the all-day event actually changed
+  calendar = create_calendar(stamp="20240902T000000Z", all_day_summary="All day (renamed)")
+  assert calendar_index.needs_update(calendar, NOW)
+  calendar_index.update(calendar, NOW)
+  events = calendar_index.query(date_from, timedelta(days=7))
+
+  assert events == query_icalendar(calendar, date_from, timedelta(days=7))
+  new_events = {event.summary: event for event in events}
+  assert "All day" not in new_events
+  assert "All day (renamed)" in new_events
+  assert new_events["Weekly"] is old_events["Weekly"]
+  assert new_events["Vacation"] is old_events["Vacation"]
+
+
+@pytest.mark.asyncio
+async def test_calendar_index_answers_queries_from_the_old_version_during_an_update(
+  monkeypatch: pytest.MonkeyPatch,
+):
+  calendar_index = CalendarIndex()
+  calendar_index.update(create_calendar(), NOW)
+  date_from = datetime(2024, 9, 1, tzinfo=timezone.utc)
+  old_events = calendar_index.query(date_from, timedelta(days=7))
+
+  # The all-day event is renamed and the vacation is removed
+  calendar = create_calendar(all_day_summary="All day (renamed)")
+  calendar.subcomponents = [c for c in calendar.subcomponents if c.get("UID") != "vacation"]
+  expanding = threading.Event()
+  resume = threading.Event()
+
+  def paused_query_icalendar(*args: Any) -> list[Event]:
+    expanding.set()
+    resume.wait(timeout=5)
+    return query_icalendar(*args)
+
+  monkeypatch.setattr(
+    "minerva.tools.calendar.calendar_index.query_icalendar", paused_query_icalendar
+  )
+  update = asyncio.create_task(asyncio.to_thread(calendar_index.update, calendar, NOW))
+  await asyncio.to_thread(expanding.wait, 5)
+
+  assert calendar_index.query(date_from, timedelta(days=7)) == old_events
+  resume.set()
+  await update
+  events = calendar_index.query(date_from, timedelta(days=7))
+
+  assert events == query_icalendar(calendar, date_from, timedelta(days=7))
+  assert "Vacation" not in {event.summary for event in events}
+
+
+BERLIN = ZoneInfo("Europe/Berlin")
+
+
+@pytest.mark.parametrize(
+  "span_start, span_end, event_start, event_end, expected",
+  [
+    # Timed events overlap when they share more than a boundary
+    (
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      datetime(2024, 9, 2, 9, tzinfo=UTC),
+      datetime(2024, 9, 2, 10, 30, tzinfo=UTC),
+      True,
+    ),
+    (
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      datetime(2024, 9, 2, 9, tzinfo=UTC),
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      False,
+    ),
+    (
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      datetime(2024, 9, 2, 12, tzinfo=UTC),
+      False,
+    ),
+    # Timezones are compared as instants
+    (
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      datetime(2024, 9, 2, 12, 30, tzinfo=BERLIN),
+      datetime(2024, 9, 2, 13, tzinfo=BERLIN),
+      True,
+    ),
+    # All-day events span the day in the timezone of the span
+    (
+      datetime(2024, 9, 3, 23, tzinfo=BERLIN),
+      datetime(2024, 9, 4, 1, tzinfo=BERLIN),
+      date(2024, 9, 3),
+      date(2024, 9, 4),
+      True,
+    ),
+    (
+      datetime(2024, 9, 4, tzinfo=BERLIN),
+      datetime(2024, 9, 4, 1, tzinfo=BERLIN),
+      date(2024, 9, 3),
+      date(2024, 9, 4),
+      False,
+    ),
+    # Floating times take the timezone of the span
+    (
+      datetime(2024, 9, 2, 10, tzinfo=BERLIN),
+      datetime(2024, 9, 2, 11, tzinfo=BERLIN),
+      datetime(2024, 9, 2, 10, 30),
+      datetime(2024, 9, 2, 11, 30),
+      True,
+    ),
+    # Zero-length events are in the span if they start in it
+    (
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      True,
+    ),
+    (
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      False,
+    ),
+    # A zero-length span contains the events running at that moment
+    (
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      True,
+    ),
+    (
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 11, tzinfo=UTC),
+      False,
+    ),
+    (
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      datetime(2024, 9, 2, 10, tzinfo=UTC),
+      True,
+    ),
+  ],
+)
+def test_overlaps(
+  span_start: datetime,
+  span_end: datetime,
+  event_start: date | datetime,
+  event_end: date | datetime,
+  expected: bool,
+):
+  assert overlaps(span_start, span_end, event_start, event_end) == expected
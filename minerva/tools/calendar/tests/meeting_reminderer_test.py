@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+
+import icalendar
+import pytest
+
+from minerva.tools.calendar.calendar_cache import CalendarCache
+from minerva.tools.calendar.meeting_reminderer import MeetingReminderer
+from minerva.tools.calendar.reminder_scheduler import ReminderScheduler
+
+
+class StaticCalendarCache(CalendarCache):
+  def __init__(self):
+    super().__init__("http://localhost/calendar.ics")
+    self.calendar = icalendar.Calendar()
+
+  def set_events(self, *events: tuple[str, datetime]) -> None:
+    calendar = icalendar.Calendar()
+    for uid, start in events:
+      event = icalendar.Event()
+      event.add("uid", uid)
+      event.add("summary", uid)
+      event.add("dtstart", start)
+      event.add("dtend", start + timedelta(hours=1))
+      calendar.add_component(event)
+    self.calendar = calendar
+
+  async def get(self) -> icalendar.cal.Component:
+    return self.calendar
+
+
+async def send_message_to_agent(message: str) -> None:
+  pass
+
+
+@pytest.mark.asyncio
+async def test_meeting_reminderer_reconciles_reminders_with_the_calendar():
+  calendar_cache = StaticCalendarCache()
+  scheduler = ReminderScheduler()
+  reminderer = MeetingReminderer(
+    send_message_to_agent,
+    calendar_cache.calendar_url,
+    # Longer than a day, the reminders must be scheduled until the next check
+    check_interval_minutes=2 * 24 * 60,
+    calendar_cache=calendar_cache,
+    scheduler=scheduler,
+  )
+  now = datetime.now(timezone.utc).replace(microsecond=0)
+  standup = now + timedelta(hours=1)
+  planning = now + timedelta(days=2)
+  started = now - timedelta(minutes=5)
+
+  calendar_cache.set_events(("standup", standup), ("planning", planning), ("started", started))
+  await reminderer.check_for_upcoming_meetings()
+
+  assert len(scheduler) == 2
+  assert scheduler.get_remind_at((id(reminderer), f"standup_{standup.isoformat()}")) == (
+    standup - timedelta(minutes=15)
+  )
+  assert scheduler.get_remind_at((id(reminderer), f"planning_{planning.isoformat()}")) == (
+    planning - timedelta(minutes=15)
+  )
+
+  # The standup moved, the planning was removed
+  moved_standup = standup + timedelta(minutes=30)
+  calendar_cache.set_events(("standup", moved_standup))
+  await reminderer.check_for_upcoming_meetings()
+
+  assert len(scheduler) == 1
+  assert scheduler.get_remind_at((id(reminderer), f"standup_{moved_standup.isoformat()}")) == (
+    moved_standup - timedelta(minutes=15)
+  )
@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from minerva.tools.calendar.reminder_scheduler import ReminderScheduler
+
+
+def create_callback(calls: list[str], name: str):
+  async def callback() -> None:
+    calls.append(name)
+
+  return callback
+
+
+@pytest.mark.asyncio
+async def test_reminder_scheduler_runs_reminders_in_time_order():
+  scheduler = ReminderScheduler()
+  scheduler.start()
+  calls: list[str] = []
+  now = datetime.now(timezone.utc)
+
+  scheduler.schedule("late", now + timedelta(milliseconds=100), create_callback(calls, "late"))
+  scheduler.schedule("early", now + timedelta(milliseconds=50), create_callback(calls, "early"))
+  scheduler.schedule("overdue", now - timedelta(seconds=1), create_callback(calls, "overdue"))
+  await asyncio.sleep(0.01)
+  assert calls == ["overdue"]
+
+  await asyncio.sleep(0.2)
+  assert calls == ["overdue", "early", "late"]
+  assert len(scheduler) == 0
+  scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_reminder_scheduler_replaces_and_cancels_reminders():
+  scheduler = ReminderScheduler()
+  scheduler.start()
+  calls: list[str] = []
+  now = datetime.now(timezone.utc)
+
+  scheduler.schedule("a", now + timedelta(seconds=10), create_callback(calls, "a"))
+  scheduler.schedule("b", now + timedelta(milliseconds=50), create_callback(calls, "b"))
+  # The earlier time wakes the scheduler up, the old reminder is skipped
+  scheduler.schedule("a", now + timedelta(milliseconds=20), create_callback(calls, "a2"))
+  assert scheduler.cancel("b")
+  assert not scheduler.cancel("b")
+
+  await asyncio.sleep(0.1)
+  assert calls == ["a2"]
+  assert scheduler.get_remind_at("a") is None
+  scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_reminder_scheduler_survives_failing_reminders():
+  scheduler = ReminderScheduler()
+  scheduler.start()
+  calls: list[str] = []
+  now = datetime.now(timezone.utc)
+
+  async def fail() -> None:
+    raise ValueError("failed")
+
+  scheduler.schedule("fail", now, fail)
+  scheduler.schedule("ok", now + timedelta(milliseconds=20), create_callback(calls, "ok"))
+
+  await asyncio.sleep(0.1)
+  assert calls == ["ok"]
+  scheduler.stop()
@@ -1,5 +1,5 @@
 import asyncio
-from typing import Unpack
+from typing import Optional, Unpack
 import lxml
 import lxml.html
 from lxml.html import clean
@@ -9,6 +9,7 @@ from playwright.async_api import (
   async_playwright,
 )
 
+from minerva.deadline import Deadline
 from minerva.tools.tool_kwargs import DefaultToolKwargs  # type: ignore
 
 DEFAULT_MAX_ACTIVE_TABS = 3
@@ -35,6 +36,13 @@ LXML_CLEANER = clean.Cleaner(
 )
 
 
+def _get_timeout_ms(timeout_ms: float, deadline: Optional[Deadline]) -> float:
+  if deadline is None:
+    return timeout_ms
+  # Playwright treats 0 as no timeout
+  return max(1, deadline.cap_timeout_sec(timeout_ms / 1000) * 1000)
+
+
 def _is_text_content_type(content_type: str) -> bool:
   normalized = content_type.lower()
   return normalized.startswith("text/") or "application/xhtml+xml" in normalized
@@ -76,7 +84,7 @@ class PlaywrightHtmlFetcher:
       await self._playwright.stop()
       self._playwright = None
 
-  async def fetch_rendered_html(self, url: str) -> str:
+  async def fetch_rendered_html(self, url: str, deadline: Optional[Deadline] = None) -> str:
     browser = await self._ensure_browser()
 
     async with self._tabs_semaphore:
@@ -85,7 +93,7 @@ class PlaywrightHtmlFetcher:
         response = await page.goto(
           url,
           wait_until="domcontentloaded",
-          timeout=NAVIGATION_TIMEOUT_MS,
+          timeout=_get_timeout_ms(NAVIGATION_TIMEOUT_MS, deadline),
         )
 
         if response is None:
@@ -101,7 +109,9 @@ class PlaywrightHtmlFetcher:
 
         try:
           # Dynamic websites may still be hydrating after DOM content is loaded.
-          await page.wait_for_load_state("networkidle", timeout=NETWORK_IDLE_TIMEOUT_MS)
+          await page.wait_for_load_state(
+            "networkidle", timeout=_get_timeout_ms(NETWORK_IDLE_TIMEOUT_MS, deadline)
+          )
         except PlaywrightTimeoutError:
           pass
 
@@ -120,7 +130,7 @@ async def fetch_html(url: str, **kwargs: Unpack[DefaultToolKwargs]) -> str:
 
   Use this tool when you need to visit a website and fetch its content.
   """
-  html = await PLAYWRIGHT_HTML_FETCHER.fetch_rendered_html(url)
+  html = await PLAYWRIGHT_HTML_FETCHER.fetch_rendered_html(url, kwargs.get("deadline"))
   return clean_html(html)
 
 
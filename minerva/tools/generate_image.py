@@ -1,9 +1,13 @@
 import base64
 from io import BytesIO
-from typing import Any, Callable, Literal, Unpack
+from typing import Any, Callable, Literal, Optional, Unpack
 import httpx
+from openai import NotGiven, not_given
 from telegram import InputFile
 
+from minerva.deadline import Deadline
+from minerva.http_client import HttpClientRegistry
+from minerva.image_store import IMAGE_STORE
 from minerva.message_history import Image, ImageContent, Message
 from minerva.tools.tool_kwargs import DefaultToolKwargs
 from minerva.config import OPENAI_IMAGE_MODEL
@@ -40,22 +44,40 @@ def _get_required_runtime_data(
 
 
 async def _request_image(
-  openai_client: Any, description: str, aspect: Aspect, image_model: str
+  openai_client: Any,
+  description: str,
+  aspect: Aspect,
+  image_model: str,
+  deadline: Optional[Deadline] = None,
 ) -> Any:
+  timeout: float | NotGiven = deadline.remaining_sec() if deadline is not None else not_given
   response = await openai_client.images.generate(
     model=image_model,
     prompt=description,
     size=f"{'x'.join(map(str, aspects.get(aspect, aspects[DEFAULT_IMAGE_ASPECT])))}",
     output_format=DEFAULT_IMAGE_FORMAT,
+    timeout=timeout,
   )
   if not response.data:
     raise ValueError("OpenAI returned no image data")
   return response.data[0]
 
 
-async def _download_image_bytes(image_url: str) -> tuple[bytes, str]:
-  async with httpx.AsyncClient(follow_redirects=True) as client:
-    image_response = await client.get(image_url, timeout=IMAGE_DOWNLOAD_TIMEOUT_SEC)
+async def _download_image_bytes(
+  image_url: str,
+  deadline: Optional[Deadline] = None,
+  http_clients: Optional[HttpClientRegistry] = None,
+) -> tuple[bytes, str]:
+  timeout_sec = IMAGE_DOWNLOAD_TIMEOUT_SEC
+  if deadline is not None:
+    timeout_sec = deadline.cap_timeout_sec(timeout_sec)
+  if http_clients is not None:
+    image_response = await http_clients.get(image_url).get(
+      image_url, timeout=timeout_sec, follow_redirects=True
+    )
+  else:
+    async with httpx.AsyncClient(follow_redirects=True) as client:
+      image_response = await client.get(image_url, timeout=timeout_sec)
   image_response.raise_for_status()
 
   raw_content_type = image_response.headers.get("content-type", "")
@@ -66,17 +88,20 @@ async def _download_image_bytes(image_url: str) -> tuple[bytes, str]:
   return image_response.content, image_format
 
 
-async def _resolve_image_data(first_image: Any) -> tuple[bytes, str, str]:
+async def _resolve_image_data(
+  first_image: Any,
+  deadline: Optional[Deadline] = None,
+  http_clients: Optional[HttpClientRegistry] = None,
+) -> tuple[bytes, str]:
   image_b64 = getattr(first_image, "b64_json", None)
   if image_b64:
-    return base64.b64decode(image_b64, validate=True), image_b64, DEFAULT_IMAGE_FORMAT
+    return base64.b64decode(image_b64, validate=True), DEFAULT_IMAGE_FORMAT
 
   image_url = getattr(first_image, "url", None)
   if not image_url:
     raise ValueError("OpenAI returned image data in unexpected format")
 
-  image_bytes, image_format = await _download_image_bytes(image_url)
-  return image_bytes, base64.b64encode(image_bytes).decode("utf-8"), image_format
+  return await _download_image_bytes(image_url, deadline, http_clients)
 
 
 async def _send_generated_image_to_telegram(
@@ -101,24 +126,24 @@ async def _send_generated_image_to_telegram(
   )
 
 
-def _add_generated_image_to_history(
+async def _add_generated_image_to_history(
   add_message_to_history: Callable[[Message], None],
   ai_username: str,
-  image_b64: str,
+  image_bytes: bytes,
   image_format: str,
   aspect: Aspect,
 ) -> None:
   width_px, height_px = aspects.get(aspect, aspects[DEFAULT_IMAGE_ASPECT])
-  image_data_uri = f"data:image/{image_format};base64,{image_b64}"
   add_message_to_history(
     Message(
       author=ai_username,
       content=ImageContent(
         images=[
           Image(
-            url=image_data_uri,
+            image_id=await IMAGE_STORE.put(image_bytes, f"image/{image_format}"),
             width_px=width_px,
             height_px=height_px,
+            size_bytes=len(image_bytes),
           )
         ],
         text="Generated image.",
@@ -127,7 +152,9 @@ def _add_generated_image_to_history(
   )
 
 
-async def generate_image(description: str, aspect: str = "square", **kwargs: Unpack[DefaultToolKwargs]) -> str:
+async def generate_image(
+  description: str, aspect: str = "square", **kwargs: Unpack[DefaultToolKwargs]
+) -> str:
   """Generate an image using OpenAI and send it to the chat as photo + original file.
 
   Args:
@@ -142,13 +169,18 @@ async def generate_image(description: str, aspect: str = "square", **kwargs: Unp
     )
 
   openai_client, ai_username, add_message_to_history = _get_required_runtime_data(kwargs)
-  first_image = await _request_image(openai_client, description, aspect, OPENAI_IMAGE_MODEL)
-  image_bytes, image_b64, image_format = await _resolve_image_data(first_image)
+  deadline = kwargs.get("deadline")
+  first_image = await _request_image(
+    openai_client, description, aspect, OPENAI_IMAGE_MODEL, deadline
+  )
+  image_bytes, image_format = await _resolve_image_data(
+    first_image, deadline, kwargs.get("http_clients")
+  )
 
   filename = f"generated-image.{image_format}"
   await _send_generated_image_to_telegram(kwargs, filename, image_bytes)
-  _add_generated_image_to_history(
-    add_message_to_history, ai_username, image_b64, image_format, aspect
+  await _add_generated_image_to_history(
+    add_message_to_history, ai_username, image_bytes, image_format, aspect
   )
 
   return f"sent:{filename}:{len(image_bytes)}"
@@ -4,7 +4,9 @@ from typing import Any
 
 import pytest
 
+from minerva.image_store import IMAGE_STORE
 from minerva.message_history import ImageContent
+from minerva.deadline import Deadline
 from minerva.tools.generate_image import generate_image
 
 ONE_PIXEL_PNG_B64 = (
@@ -47,7 +49,7 @@ class FakeHttpxClient:
     self.content = content
     self.content_type = content_type
     self.requested_url: str | None = None
-    self.request_timeout: int | None = None
+    self.request_timeout: float | None = None
 
   async def __aenter__(self):
     return self
@@ -108,7 +110,9 @@ async def test_generate_image():
   assert message.content.text == "Generated image."
   assert len(message.content.images) == 1
   image = message.content.images[0]
-  assert image.url == f"data:image/png;base64,{ONE_PIXEL_PNG_B64}"
+  assert (
+    await IMAGE_STORE.get_data_url(image.image_id) == f"data:image/png;base64,{ONE_PIXEL_PNG_B64}"
+  )
   assert image.width_px == 1024
   assert image.height_px == 1024
 
@@ -168,7 +172,61 @@ async def test_generate_image_downloads_image_when_only_url_is_returned(
   assert async_client_kwargs["follow_redirects"] is True
   assert len(history) == 1
   assert result.startswith("sent:generated-image.png:")
-  assert history[0].content.images[0].url.startswith("data:image/png;base64,")
+  image_id = history[0].content.images[0].image_id
+  data_url = await IMAGE_STORE.get_data_url(image_id)
+  assert data_url is not None and data_url.startswith("data:image/png;base64,")
+
+
+@pytest.mark.asyncio
+async def test_generate_image_requests_end_before_the_deadline(monkeypatch: pytest.MonkeyPatch):
+  response = SimpleNamespace(
+    data=[SimpleNamespace(b64_json=None, url="https://example.com/image.png")],
+  )
+  openai_client = FakeOpenAIClient(response=response)
+  kwargs, _, _ = get_default_tool_kwargs()
+  kwargs["openai_client"] = openai_client
+  kwargs["deadline"] = Deadline(5)
+
+  fake_httpx_client = FakeHttpxClient(content=b"fake-png-bytes")
+
+  def fake_async_client(**kwargs: Any):
+    return fake_httpx_client
+
+  monkeypatch.setattr("minerva.tools.generate_image.httpx.AsyncClient", fake_async_client)
+
+  await generate_image("test", **kwargs)
+
+  assert 0 < openai_client.images.calls[0]["timeout"] <= 5
+  assert fake_httpx_client.request_timeout is not None
+  assert 0 < fake_httpx_client.request_timeout <= 5
+
+
+class FakeHttpClientRegistry:
+  def __init__(self, client: FakeHttpxClient):
+    self.client = client
+    self.requested_urls: list[str] = []
+
+  def get(self, url: str) -> FakeHttpxClient:
+    self.requested_urls.append(url)
+    return self.client
+
+
+@pytest.mark.asyncio
+async def test_generate_image_downloads_image_with_shared_http_client():
+  response = SimpleNamespace(
+    data=[SimpleNamespace(b64_json=None, url="https://example.com/image.png")],
+  )
+  kwargs, _, history = get_default_tool_kwargs()
+  kwargs["openai_client"] = FakeOpenAIClient(response=response)
+  fake_httpx_client = FakeHttpxClient(content=b"fake-png-bytes")
+  http_clients = FakeHttpClientRegistry(fake_httpx_client)
+  kwargs["http_clients"] = http_clients
+
+  await generate_image("test", **kwargs)
+
+  assert http_clients.requested_urls == ["https://example.com/image.png"]
+  assert fake_httpx_client.requested_url == "https://example.com/image.png"
+  assert len(history) == 1
 
 
 @pytest.mark.asyncio
@@ -193,7 +251,9 @@ async def test_generate_image_url_fallback_uses_content_type_for_format(
 
   assert result.startswith("sent:generated-image.jpeg:")
   assert len(history) == 1
-  assert history[0].content.images[0].url.startswith("data:image/jpeg;base64,")
+  image_id = history[0].content.images[0].image_id
+  data_url = await IMAGE_STORE.get_data_url(image_id)
+  assert data_url is not None and data_url.startswith("data:image/jpeg;base64,")
 
 
 @pytest.mark.asyncio
@@ -1,6 +1,9 @@
 from typing import Any, Callable, NotRequired, TypedDict
 from telegram import Bot
 
+from minerva.deadline import Deadline
+from minerva.http_client import HttpClientRegistry
+
 
 class DefaultToolKwargs(TypedDict):
   bot: Bot
@@ -10,3 +13,7 @@ class DefaultToolKwargs(TypedDict):
   openai_client: NotRequired[Any]
   ai_username: NotRequired[str]
   add_message_to_history: NotRequired[Callable[..., Any]]
+  # Tools should finish their requests before the response deadline
+  deadline: NotRequired[Deadline | None]
+  # Shared HTTP clients, tools fall back to their own clients without them
+  http_clients: NotRequired[HttpClientRegistry | None]